@@ -0,0 +1,71 @@
+"""
+Benchmark a rollout of many field changes: one SET per field against one
+apply() of all of them.
+
+usage: python3 -m bench.bench_apply [n_configs]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import canfig
+from compiler import compile_source
+from bench.schema import generate_schema
+from evaluator import DB
+from migration import migrate
+
+
+def rollout(config_names: list, round_: int) -> dict:
+    """
+    :return: 5 field changes per config
+    """
+    changes = {}
+    for cfg in config_names:
+        changes[f"{cfg}.port"] = 8000 + round_
+        changes[f"{cfg}.description"] = f"rollout {round_}"
+        changes[f"{cfg}.run"] = round_ % 2
+        changes[f"{cfg}.alive_time"] = {"minute": round_ % 60, "second": 30}
+        changes[f"{cfg}.commands"] = [
+            {"name": f"cmd{k}", "description": f"command number {k}"} for k in range(3)
+        ]
+    return changes
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+
+    cplan = compile_source(generate_schema(n))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"))
+        migrate(db, cplan.tables, cplan.schema)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+            canfig.register_triggers(cplan.triggers, cplan.trigger_index)
+
+        config_names = list(cplan.fields)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            changes = rollout(config_names, 1)
+            start = time.perf_counter()
+            for field_dir, values in changes.items():
+                canfig.SET(field_dir, values)
+            t_set = time.perf_counter() - start
+
+            changes = rollout(config_names, 2)
+            start = time.perf_counter()
+            canfig.apply(changes)
+            t_apply = time.perf_counter() - start
+
+        assert canfig.GET(f"{config_names[0]}.port") == [{"port": 8002}]
+
+        print(f"{len(changes)} changes on {n} configs")
+        print(f"{'SET per field':>16} {t_set * 1000:>10.1f}ms")
+        print(f"{'apply':>16} {t_apply * 1000:>10.1f}ms")
+
+        db.close()
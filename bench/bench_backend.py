@@ -0,0 +1,86 @@
+"""
+Benchmark reads and writes on the sqlite backend and on the memory backend
+with write-behind persistence: GET and SET of a field, GET of a LIST, an
+element append, and the time the write-behind thread needs to catch up.
+
+usage: python3 -m bench.bench_backend [n_ops]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import canfig
+from compiler import compile_source
+from evaluator import DB
+from memory_backend import MemoryBackend
+from migration import migrate
+
+
+def per_op(fn, n: int) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n
+
+
+def run(cplan, backend: str, n: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DB(os.path.join(tmp, "bench.sqlite3"), "fast-local")
+        migrate(db, cplan.tables, cplan.schema)
+
+        canfig.final_plan.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+            canfig.db = db
+            canfig.apply(
+                {
+                    "Server.port": 8000,
+                    "Server.commands": [
+                        {"name": f"cmd{k}", "description": f"command number {k}"}
+                        for k in range(100)
+                    ],
+                }
+            )
+            if backend == "memory":
+                canfig.db = MemoryBackend(db, cplan.fields)
+
+            commands = canfig.final_plan["Server"]["commands"]
+            ret = {
+                "GET": per_op(lambda i: canfig.GET("Server.port"), n),
+                "GET list": per_op(lambda i: canfig.GET("Server.commands"), n),
+                "SET": per_op(lambda i: canfig.SET("Server.port", i), n),
+                "append": per_op(
+                    lambda i: commands.append(
+                        canfig.db, {"name": f"new{i}", "description": f"appended number {i}"}
+                    ),
+                    n // 10,
+                ),
+            }
+
+            start = time.perf_counter()
+            if backend == "memory":
+                canfig.db.flush()
+            ret["catch up"] = time.perf_counter() - start
+            assert canfig.GET("Server.port") == [{"port": n - 1}]
+            canfig.db.close()
+        return ret
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    results = {backend: run(cplan, backend, n) for backend in ("sqlite", "memory")}
+    print(f"{'':>10} {'sqlite':>12} {'memory':>12}")
+    for op in results["sqlite"]:
+        if op == "catch up":
+            cells = [f"{results[b][op] * 1000:>10.1f}ms" for b in results]
+        else:
+            cells = [f"{results[b][op] * 1e6:>10.1f}us" for b in results]
+        print(f"{op:>10} {' '.join(cells)}")
@@ -0,0 +1,85 @@
+"""
+Benchmark loading a plan from the binary candy against pickle of the same
+sections. "startup" decodes only the sections canfig.py and server.py read
+when they start on a database already on the schema, a pickle is always
+loaded whole.
+
+usage: python3 -m bench.bench_candy [n_configs ...]
+"""
+
+import os
+import pickle
+import sys
+import tempfile
+
+import candy
+from bench.bench_lexer import best_of
+from bench.schema import generate_schema
+from compiler import compile_source
+from slices import index_fields
+
+
+def load_pickle(pickle_file):
+    with open(pickle_file, "rb") as f:
+        return pickle.load(f)
+
+
+# sections read at startup, see canfig.py
+STARTUP = ["meta_data", "schema", "fields", "triggers", "trigger_index", "slices"]
+
+
+def load_all(cplan_file):
+    with candy.load(cplan_file) as reader:
+        return {name: reader[name] for name in reader.sections()}
+
+
+def load_startup(cplan_file):
+    with candy.load(cplan_file) as reader:
+        return [reader[name] for name in STARTUP] + [index_fields(reader["fields"])]
+
+
+def load_section(cplan_file, name):
+    with candy.load(cplan_file) as reader:
+        return reader[name]
+
+
+def load_record(cplan_file, name, i):
+    with candy.load(cplan_file) as reader:
+        return reader.record(name, i)
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 5000]
+
+    print(
+        f"{'configs':>8} {'pickle':>10} {'candy':>10} {'pickle load':>12}"
+        f" {'candy all':>10} {'startup':>10} {'configs':>10} {'1 config':>10} {'open':>10}"
+    )
+    for n in sizes:
+        cplan = compile_source(generate_schema(n))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            pickle_file = os.path.join(tmp, "plan.pickle")
+            cplan_file = os.path.join(tmp, "plan.candy")
+
+            with open(pickle_file, "wb") as f:
+                pickle.dump(cplan.sections(), file=f)
+            cplan.dump(cplan_file)
+
+            # both formats must hold the same plan
+            data = load_all(cplan_file)
+            assert data == load_pickle(pickle_file)
+
+            timings = [
+                best_of(lambda: load_pickle(pickle_file)),
+                best_of(lambda: load_all(cplan_file)),
+                best_of(lambda: load_startup(cplan_file)),
+                best_of(lambda: load_section(cplan_file, "configs")),
+                best_of(lambda: load_record(cplan_file, "configs", n // 2)),
+                best_of(lambda: candy.load(cplan_file).close()),
+            ]
+
+            print(
+                f"{n:>8} {os.path.getsize(pickle_file):>10} {os.path.getsize(cplan_file):>10} "
+                + " ".join(f"{t * 1000:>8.3f}ms" for t in timings)
+            )
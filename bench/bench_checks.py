@@ -0,0 +1,75 @@
+"""
+Benchmark the CHECK validators of Plan.bind on the LIST Server.commands: the
+bind of valid elements with and without the validators, and a SET whose last
+element fails CHECK(LENGTH(description) > 10), rejected by bind or by sqlite
+after the elements before it are written.
+
+usage: python3 -m bench.bench_checks [list_size ...]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+import canfig
+from bench.bench_lexer import best_of
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+from utils import CanfigException
+
+
+def commands(size: int, bad: bool = False) -> list:
+    ret = [{"name": f"cmd{k}", "description": f"command number {k}"} for k in range(size)]
+    if bad:
+        ret[-1]["description"] = "short"
+    return ret
+
+
+def run(cplan, size: int, checks: bool) -> tuple:
+    """
+    :return: (seconds per bind of valid elements, seconds to reject a bad one)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"), "fast-local")
+        migrate(db, cplan.tables, cplan.schema)
+
+        canfig.final_plan.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+        plan = canfig.final_plan["Server"]["commands"]
+        if not checks:
+            plan.init_checks([])
+
+        good, bad = commands(size), commands(size, bad=True)
+        t_bind = best_of(lambda: plan.bind(good), 5)
+
+        def reject():
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    canfig.SET("Server.commands", bad)
+            except CanfigException:
+                return
+            raise AssertionError("the bad element is written")
+
+        t_reject = best_of(reject, 5)
+        db.close()
+        return t_bind, t_reject
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 10000]
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    print(f"{'list':>8} {'bind':>10} {'bind chk':>10} {'reject sql':>11} {'reject chk':>11}")
+    for size in sizes:
+        t_bind, t_sql = run(cplan, size, False)
+        t_checked, t_chk = run(cplan, size, True)
+        print(
+            f"{size:>8} {t_bind * 1000:>8.2f}ms {t_checked * 1000:>8.2f}ms"
+            f" {t_sql * 1000:>9.2f}ms {t_chk * 1000:>9.2f}ms"
+        )
@@ -0,0 +1,102 @@
+"""
+Benchmark slow triggers of one change run one after another against the
+trigger engine, and check a trigger past its deadline rolls the write back.
+
+usage: python3 -m bench.bench_engine [n_triggers] [seconds]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import canfig
+import trigger_engine
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+from utils import TriggerException, compile_trigger
+
+
+def sync_body(seconds: float) -> str:
+    # stands for a trigger checking a local file
+    return f"""
+    import time
+    time.sleep({seconds})
+    if not GET("Server.port"):
+        CANFIG_WARN(msg="port not set")
+"""
+
+
+def async_body(seconds: float) -> str:
+    return f"""
+    import asyncio
+    await asyncio.sleep({seconds})
+    if not GET("Server.port"):
+        CANFIG_WARN(msg="port not set")
+"""
+
+
+def sequential(callbacks: dict):
+    # how triggers ran before the engine
+    for code, env in callbacks.values():
+        if trigger_engine._is_coroutine(code):
+            trigger_engine._run_blocking(eval(code, env))
+        else:
+            exec(code, env)
+
+
+if __name__ == "__main__":
+    n_triggers = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 0.02
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"))
+        migrate(db, cplan.tables, cplan.schema)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+        plan = canfig.final_plan["Server"]["port"]
+
+        print(f"{n_triggers} triggers of {seconds * 1000:.0f}ms on Server.port")
+        for kind, body in [("sync", sync_body), ("async", async_body)]:
+            callbacks = {
+                f"{kind}_{i}": (compile_trigger(f"{kind}_{i}", body(seconds)), canfig.trigger_globals())
+                for i in range(n_triggers)
+            }
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                sequential(callbacks)
+                t_seq = time.perf_counter() - start
+
+                start = time.perf_counter()
+                report = trigger_engine.ENGINE.run(callbacks)
+                t_engine = time.perf_counter() - start
+
+            print(f"{kind:>6} {'sequential':>12} {t_seq * 1000:>8.1f}ms")
+            print(f"{kind:>6} {'engine':>12} {t_engine * 1000:>8.1f}ms")
+            for outcome in report:
+                print(f"{'':>8} {outcome}")
+
+        # a trigger past its deadline fails the write
+        with contextlib.redirect_stdout(io.StringIO()):
+            plan.bind(1)
+            plan.execute(db)
+
+        plan.add_trigger("slow", compile_trigger("slow", sync_body(1.0)), canfig.trigger_globals())
+        trigger_engine.ENGINE.set_deadline("slow", 0.1)
+        plan.bind(2)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                plan.execute(db)
+        except TriggerException as e:
+            print(f"deadline: {e}")
+        assert plan.view(db) == [{"port": 1}]
+
+        db.close()
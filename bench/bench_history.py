@@ -0,0 +1,71 @@
+"""
+Benchmark the config history: a SET with the history off and on, and a
+rollback, for growing LIST sizes. A rollback points the config back at
+rows it had, its time should not grow with the list.
+
+usage: python3 -m bench.bench_history [list_size ...]
+"""
+
+import contextlib
+import io
+import itertools
+import os
+import sys
+import tempfile
+
+import canfig
+from bench.bench_lexer import best_of
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+
+
+def run(cplan, size: int, keep: int) -> tuple:
+    """
+    :return: (seconds per SET, seconds per rollback or None)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"), "fast-local", keep)
+        migrate(db, cplan.tables, cplan.schema)
+
+        canfig.final_plan.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+            canfig.apply(
+                {
+                    "Server.commands": [
+                        {"name": f"cmd{k}", "description": f"command number {k}"}
+                        for k in range(size)
+                    ]
+                }
+            )
+            good = db.write_version
+
+            ports = iter(range(8000, 9000))
+            t_set = best_of(lambda: canfig.SET("Server.port", next(ports)), 5)
+
+            t_rollback = None
+            if keep:
+                # back and forth between the list and the last port set
+                targets = itertools.cycle([good, db.write_version])
+                t_rollback = best_of(lambda: canfig.rollback(next(targets)), 6)
+                assert len(canfig.snapshot("Server")["commands"]) == size
+
+        db.close()
+        return t_set, t_rollback
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [10, 1000, 50000]
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    print(f"{'list':>8} {'SET':>10} {'SET hist':>10} {'rollback':>10}")
+    for size in sizes:
+        t_set, _ = run(cplan, size, 0)
+        t_hist, t_rollback = run(cplan, size, 100)
+        print(
+            f"{size:>8} {t_set * 1000:>8.2f}ms {t_hist * 1000:>8.2f}ms"
+            f" {t_rollback * 1000:>8.2f}ms"
+        )
@@ -0,0 +1,85 @@
+"""
+Benchmark the native lexer against the OCaml `./ast` path.
+
+usage: python3 -m bench.bench_lexer [n_configs ...]
+"""
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench.schema import generate_schema
+from common import Token, TokenType
+from lexer import lex
+from utils import check_file_exists, check_command_installed
+
+
+def ocaml_lexing(from_file) -> list:
+    """
+    the legacy path: fork ./ast, write a .cando file then read it back
+    """
+    ret = subprocess.run(["./ast", from_file, "-o", from_file.split(".")[0]])
+    if ret.returncode != 0:
+        raise Exception("lexing fails.")
+
+    def process_str_token(str_token):
+        pre_token = re.match(r"^([A-Z_]+)(?:\((.*)\))?$", str_token, re.DOTALL).groups()
+
+        if pre_token[1] is None:
+            return Token(getattr(TokenType, pre_token[0]))
+
+        return Token(getattr(TokenType, pre_token[0]), pre_token[1])
+
+    with open(cando_file := from_file.split(".")[0] + ".cando", "r") as fptr:
+        _tokens = list(map(process_str_token, fptr.read().split("[_!]")))
+
+    os.remove(cando_file)
+    return _tokens
+
+
+def ocaml_available() -> bool:
+    if check_file_exists("ast"):
+        return True
+    if not (check_command_installed("make") and check_command_installed("ocamlc")):
+        return False
+    return subprocess.run(["make", "exe"], capture_output=True).returncode == 0
+
+
+def best_of(fn, repeat=5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 5000]
+    use_ocaml = ocaml_available()
+    if not use_ocaml:
+        print("ocaml toolchain not found, only the native lexer is measured.")
+
+    print(f"{'configs':>8} {'bytes':>10} {'tokens':>8} {'native':>10} {'ocaml':>10}")
+    for n in sizes:
+        source = generate_schema(n)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            cand_file = os.path.join(tmp, "bench.cand")
+            with open(cand_file, "w") as f:
+                f.write(source)
+
+            n_tokens = len(list(lex(source)))
+            native = best_of(lambda: sum(1 for _ in lex(source)))
+
+            ocaml = None
+            if use_ocaml:
+                ocaml = best_of(lambda: ocaml_lexing(cand_file))
+
+        print(
+            f"{n:>8} {len(source):>10} {n_tokens:>8} {native * 1000:>8.2f}ms "
+            + (f"{ocaml * 1000:>8.2f}ms" if ocaml is not None else f"{'-':>10}")
+        )
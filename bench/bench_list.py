@@ -0,0 +1,85 @@
+"""
+Benchmark changing one element of a long LIST: rewriting the whole list
+against the element operations and the diff of replace().
+
+usage: python3 -m bench.bench_list [list_size]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import canfig
+from compiler import compile_source
+from evaluator import DB
+from migration import collect_garbage, migrate
+
+
+def element(k: int, tag: str = "") -> dict:
+    return {"name": f"cmd{k}{tag}", "description": f"command number {k}"}
+
+
+def rewrite(db, values: list):
+    # how a LIST was written before: unlink everything, insert everything
+    with db.lock, db.transaction():
+        db.execute("DELETE FROM COMMAND_Runner WHERE Runner_id = 1")
+        db.execute("SELECT COALESCE(MAX(COMMAND_id), 0) AS max_id FROM COMMAND")
+        first = db.fetchall()[0]["max_id"] + 1
+        db.executemany(
+            "INSERT INTO COMMAND (COMMAND_id, name, description) VALUES (?, ?, ?)",
+            [(first + i, v["name"], v["description"]) for i, v in enumerate(values)],
+        )
+        db.executemany(
+            "INSERT INTO COMMAND_Runner (COMMAND_id, Runner_id, pos) VALUES (?, 1, ?)",
+            [(first + i, (i + 1) << 16) for i in range(len(values))],
+        )
+
+
+def timed(fn) -> float:
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        fn()
+        return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"))
+        migrate(db, cplan.tables, cplan.schema)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+        plan = canfig.final_plan["Runner"]["commands"]
+
+        values = [element(k) for k in range(size)]
+        print(f"initial write of {size} elements {timed(lambda: plan.replace(db, values)) * 1000:>10.1f}ms")
+
+        changed = list(values)
+        changed[size // 2] = element(size // 2, "x")
+        inserted = values[: size // 2] + [element(size, "x")] + values[size // 2:]
+
+        cases = [
+            ("rewrite, 1 changed", lambda: rewrite(db, changed)),
+            ("replace, 1 changed", lambda: plan.replace(db, changed)),
+            ("replace, 1 inserted", lambda: plan.replace(db, inserted)),
+            ("append", lambda: plan.append(db, element(size + 1))),
+            ("update(index)", lambda: plan.update(db, size // 2, {"description": "changed description"})),
+            ("remove(index)", lambda: plan.remove(db, size // 2)),
+        ]
+        for name, fn in cases:
+            print(f"{name:>30} {timed(fn) * 1000:>10.1f}ms")
+
+        # the element operations leave no orphan, the rewrite left a whole list
+        print(f"{'orphans left by rewrite':>30} {collect_garbage(db, cplan.fields):>10}")
+        db.execute("SELECT COUNT(*) AS n FROM COMMAND")
+        assert db.fetchall()[0]["n"] == len(plan.view(db)) == size + 1
+
+        db.close()
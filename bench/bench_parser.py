@@ -0,0 +1,129 @@
+"""
+Micro-benchmark of the dispatch table parser against the `transitions` Machine.
+Without `transitions` installed only the table parser is timed.
+
+usage: python3 -m bench.bench_parser [n_configs ...]
+       python3 -m bench.bench_parser --golden tests/parser_golden.json
+
+--golden writes what the Machine parses from the sources of the parser tests,
+tests/test_parser.py checks the table parser against it.
+"""
+
+import json
+import logging
+import os
+import sys
+import time
+
+from bench.schema import generate_schema
+from compiler import Parser
+from lexer import lex
+from utils import CanfigException
+
+SAMPLE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "sample", "sample.cand")
+
+GOLDEN_ERRORS = [
+    "STRUCT {};",
+    "CONFIG Server Runner;",
+    "TRIGGER T WHEN CHANGE { x };",
+    '@version "1" "2";',
+]
+
+
+class MachineParser(Parser):
+    """
+    the legacy driver, same rules but dispatched by `transitions`
+    """
+
+    def __init__(self):
+        from transitions import Machine
+
+        super().__init__()
+        self.machine = Machine(model=self, states=Parser.states, initial="start")
+        for rule in Parser.transitions:
+            self.machine.add_transition(**rule)
+
+    def feed(self, token):
+        if token.value is not None:
+            self.state_buffer = token.value
+        getattr(self, token.type._name_)()
+
+
+def run(parser_cls, tokens) -> tuple:
+    start = time.perf_counter()
+    parser = parser_cls()
+    built = time.perf_counter()
+    for token in tokens:
+        parser.feed(token)
+    done = time.perf_counter()
+    result = (parser.meta_data, parser.sql_query, parser.triggers, parser.slices)
+    return built - start, done - built, result
+
+
+def parse(parser_cls, source: str):
+    """
+    :return: (meta_data, sql_query, triggers, slices), or ("error", message)
+    """
+    parser = parser_cls()
+    try:
+        for token in lex(source):
+            parser.feed(token)
+    except CanfigException as e:
+        return "error", str(e)
+    return parser.meta_data, parser.sql_query, parser.triggers, parser.slices
+
+
+def write_golden(path: str):
+    with open(SAMPLE) as f:
+        sources = [f.read(), generate_schema(5), *GOLDEN_ERRORS]
+
+    golden = [{"source": source, "expected": parse(MachineParser, source)} for source in sources]
+    with open(path, "w") as f:
+        json.dump(golden, f, indent=1)
+        f.write("\n")
+
+
+def has_machine() -> bool:
+    try:
+        import transitions  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    # the Machine warns about the ERROR method already bound on the model
+    logging.getLogger("transitions").setLevel(logging.ERROR)
+
+    if sys.argv[1:2] == ["--golden"]:
+        write_golden(sys.argv[2])
+        sys.exit(0)
+
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 5000]
+    machine = has_machine()
+    if not machine:
+        print("transitions is not installed, the Machine is not timed")
+
+    print(
+        f"{'configs':>8} {'tokens':>8} {'build(table)':>13} {'build(machine)':>15}"
+        f" {'tok/s(table)':>13} {'tok/s(machine)':>15}"
+    )
+    for n in sizes:
+        tokens = list(lex(generate_schema(n)))
+
+        table_build, table_run, table_ret = run(Parser, tokens)
+        if not machine:
+            print(
+                f"{n:>8} {len(tokens):>8} {table_build * 1e6:>11.1f}us {'-':>15}"
+                f" {len(tokens) / table_run:>13.0f} {'-':>15}"
+            )
+            continue
+
+        machine_build, machine_run, machine_ret = run(MachineParser, tokens)
+        assert table_ret == machine_ret, "parse result mismatch"
+
+        print(
+            f"{n:>8} {len(tokens):>8} {table_build * 1e6:>11.1f}us"
+            f" {machine_build * 1e6:>13.1f}us"
+            f" {len(tokens) / table_run:>13.0f} {len(tokens) / machine_run:>15.0f}"
+        )
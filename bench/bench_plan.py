@@ -0,0 +1,78 @@
+"""
+Benchmark a tight SET loop (bind + execute) on the sample config fields.
+
+usage: python3 -m bench.bench_plan [n_sets]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import canfig
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+
+
+def set_loop(plan, db, values, n) -> float:
+    """
+    :return: seconds per SET
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for i in range(n):
+            plan.bind(values(i))
+            plan.execute(db)
+        return (time.perf_counter() - start) / n
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    cases = [
+        ("Server.port", lambda i: 8000 + i),
+        ("Server.description", lambda i: f"it's server #{i}"),
+        ("Server.alive_time", lambda i: {"minute": i % 5, "second": 20}),
+        (
+            "Server.commands",
+            lambda i: [{"name": f"cmd{k}", "description": f"command number {k}"} for k in range(10)],
+        ),
+    ]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # on disk every commit syncs, in memory only the statements cost
+        for db_file in [os.path.join(tmp, "bench.sqlite3"), ":memory:"]:
+            db = canfig.db = DB(db_file)
+            migrate(db, cplan.tables, cplan.schema)
+
+            canfig.final_plan.clear()
+            with contextlib.redirect_stdout(io.StringIO()):
+                canfig.build_plans(cplan.fields)
+
+            print(f"{'disk' if db_file != ':memory:' else 'memory'}")
+            print(f"{'field':>20} {'per SET':>12} {'SET/s':>10}")
+            for field_dir, values in cases:
+                config_n, field_n = field_dir.split(".")
+                t = set_loop(canfig.final_plan[config_n][field_n], db, values, n)
+                print(f"{field_dir:>20} {t * 1e6:>10.1f}us {1 / t:>10.0f}")
+
+            # one SET of a long list
+            for size in [1000, 10000]:
+                t = set_loop(
+                    canfig.final_plan["Server"]["commands"],
+                    db,
+                    lambda i: [
+                        {"name": f"cmd{k}", "description": f"command number {k}"}
+                        for k in range(size)
+                    ],
+                    1,
+                )
+                print(f"{f'commands x{size}':>20} {t * 1e3:>10.1f}ms")
+
+            db.close()
@@ -0,0 +1,89 @@
+"""
+Benchmark decoding the rows of a 100k element LIST field per row mode,
+against the old per-row dict factory.
+
+usage: python3 -m bench.bench_rows [n_elements]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+import canfig
+from bench.bench_lexer import best_of
+from compiler import compile_source
+from evaluator import DB, RowMode
+from migration import migrate
+
+
+def dict_factory(cursor, row):
+    # the row factory DB used to install on the connection
+    d = {}
+    for idx, col in enumerate(cursor.description):
+        d[col[0]] = row[idx]
+    return d
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"))
+        migrate(db, cplan.tables, cplan.schema)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+            plan = canfig.final_plan["Server"]["commands"]
+            plan.bind(
+                [{"name": f"cmd{k}", "description": f"command number {k}"} for k in range(n)]
+            )
+            plan.execute(db)
+
+        # the read plan of the field, as view() runs it
+        sql = """
+            SELECT name, description FROM COMMAND
+            WHERE COMMAND_id IN (
+                SELECT COMMAND_id FROM COMMAND_Server WHERE Server_id = ?
+            )
+        """
+
+        def fetch(mode):
+            db.execute(sql, (1,))
+            return db.fetchall(mode)
+
+        def fetch_dict_factory():
+            db.cursor.row_factory = dict_factory
+            try:
+                db.execute(sql, (1,))
+                return db.cursor.fetchall()
+            finally:
+                db.cursor.row_factory = None
+
+        def view_miss(mode):
+            db.view_cache.clear()
+            return plan.view(db, mode)
+
+        assert fetch(RowMode.DICT) == fetch_dict_factory() == plan.view(db)
+        assert len(plan.view(db)) == n
+
+        cases = [
+            ("dict factory (old)", fetch_dict_factory),
+            ("fetch TUPLE", lambda: fetch(RowMode.TUPLE)),
+            ("fetch ROW", lambda: fetch(RowMode.ROW)),
+            ("fetch DICT", lambda: fetch(RowMode.DICT)),
+            ("view DICT, miss", lambda: view_miss(RowMode.DICT)),
+            ("view TUPLE, miss", lambda: view_miss(RowMode.TUPLE)),
+            ("view DICT, hit", lambda: plan.view(db, RowMode.DICT)),
+            ("view TUPLE, hit", lambda: plan.view(db, RowMode.TUPLE)),
+        ]
+
+        print(f"{n} rows")
+        for name, fn in cases:
+            print(f"{name:>20} {best_of(fn, 5) * 1000:>10.1f}ms")
+
+        db.close()
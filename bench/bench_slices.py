@@ -0,0 +1,45 @@
+"""
+Benchmark resolving, loading and using per-role slices.
+
+usage: python3 -m bench.bench_slices [n_configs ...]
+"""
+
+import sys
+import time
+
+from bench.bench_lexer import best_of
+from bench.schema import generate_schema
+from compiler import compile_source
+from slices import SliceRegistry, compile_slices
+
+if __name__ == "__main__":
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 300, 1000]
+
+    print(
+        f"{'slices':>8} {'fields':>8} {'resolve':>10} {'load':>10}"
+        f" {'member':>10} {'fields()':>10} {'compose':>10}"
+    )
+    for n in sizes:
+        cplan = compile_source(generate_schema(n))
+        plans = [{"name": p["name"], "cmd": p["cmd"]} for p in cplan.slices]
+
+        t_resolve = best_of(lambda: compile_slices(plans, cplan.fields), 3)
+        t_load = best_of(lambda: SliceRegistry(cplan.field_index, cplan.slices), 3)
+
+        registry = SliceRegistry(cplan.field_index, cplan.slices)
+        names = list(registry.slices)
+        role = registry[names[n // 2]]
+        probes = cplan.field_index * 10
+
+        start = time.perf_counter()
+        for field_dir in probes:
+            field_dir in role
+        t_member = (time.perf_counter() - start) / len(probes)
+
+        t_fields = best_of(role.fields, 3)
+        t_compose = best_of(lambda: registry[names[0]] + registry[names[-1]] - role, 3)
+
+        print(
+            f"{n:>8} {len(cplan.field_index):>8} {t_resolve * 1000:>8.2f}ms {t_load * 1000:>8.2f}ms"
+            f" {t_member * 1e9:>8.0f}ns {t_fields * 1e6:>8.1f}us {t_compose * 1e6:>8.1f}us"
+        )
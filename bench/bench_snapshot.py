@@ -0,0 +1,72 @@
+"""
+Benchmark reading a whole config, and a slice over every config, with one
+view() per field against a single snapshot query.
+
+usage: python3 -m bench.bench_snapshot [n_configs]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+import canfig
+from bench.bench_lexer import best_of
+from bench.schema import generate_schema
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+
+
+def per_field(config_names: list) -> dict:
+    # reading at boot, nothing is cached yet. run and description are never
+    # written, they are read like the other fields
+    canfig.db.view_cache.clear()
+    return {
+        cfg: {field: plan.view(canfig.db) for field, plan in canfig.final_plan[cfg].items()}
+        for cfg in config_names
+    }
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+
+    cplan = compile_source(generate_schema(n))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"))
+        migrate(db, cplan.tables, cplan.schema)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+            canfig.load_slices(cplan.field_index, cplan.slices)
+
+            config_names = list(cplan.fields)
+            for i, cfg in enumerate(config_names):
+                canfig.apply(
+                    {
+                        f"{cfg}.port": 8000 + i,
+                        f"{cfg}.name": {"NAME": cfg},
+                        f"{cfg}.alive_time": {"minute": i % 60, "second": 30},
+                        f"{cfg}.commands": [
+                            {"name": f"cmd{k}", "description": f"command number {k}"}
+                            for k in range(10)
+                        ],
+                    }
+                )
+
+        cfg = config_names[0]
+        assert canfig.snapshot(cfg)["commands"] == per_field([cfg])[cfg]["commands"]
+
+        everything = canfig.scope("ALL")
+        cases = [
+            ("1 config, per field", lambda: per_field([cfg])),
+            ("1 config, snapshot", lambda: canfig.snapshot(cfg)),
+            (f"{n} configs, per field", lambda: per_field(config_names)),
+            (f"{n} configs, snapshot", everything.snapshot),
+        ]
+        for name, fn in cases:
+            print(f"{name:>24} {best_of(fn, 5) * 1000:>10.3f}ms")
+
+        db.close()
@@ -0,0 +1,82 @@
+"""
+Benchmark readers beside one writer under each storage profile: the readers
+take a snapshot of a config in a loop while the writer sets a field.
+
+usage: python3 -m bench.bench_storage [n_readers] [seconds]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import canfig
+from compiler import compile_source
+from evaluator import DB, STORAGE_PROFILES
+from migration import migrate
+
+
+def run(profile: str, cplan, n_readers: int, seconds: float) -> tuple:
+    """
+    :return: (snapshots/s, SET/s)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"), profile)
+        migrate(db, cplan.tables, cplan.schema)
+
+        canfig.final_plan.clear()
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+            canfig.apply(
+                {
+                    "Server.commands": [
+                        {"name": f"cmd{k}", "description": f"command number {k}"}
+                        for k in range(100)
+                    ]
+                }
+            )
+        plan = canfig.final_plan["Server"]["port"]
+
+        stop = threading.Event()
+        counts = [0] * (n_readers + 1)
+
+        def reader(i):
+            while not stop.is_set():
+                canfig.snapshot("Server")
+                counts[i] += 1
+
+        def writer():
+            while not stop.is_set():
+                plan.bind(8000 + counts[-1] % 1000)
+                plan.execute(db)
+                counts[-1] += 1
+
+        threads = [threading.Thread(target=reader, args=(i,)) for i in range(n_readers)]
+        threads.append(threading.Thread(target=writer))
+        with contextlib.redirect_stdout(io.StringIO()):
+            for t in threads:
+                t.start()
+            time.sleep(seconds)
+            stop.set()
+            for t in threads:
+                t.join()
+
+        db.close()
+        return sum(counts[:-1]) / seconds, counts[-1] / seconds
+
+
+if __name__ == "__main__":
+    n_readers = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        cplan = compile_source(f.read())
+
+    print(f"{n_readers} readers, 1 writer, {seconds:.0f}s")
+    print(f"{'profile':>12} {'snapshot/s':>12} {'SET/s':>10}")
+    for profile in STORAGE_PROFILES:
+        reads, writes = run(profile, cplan, n_readers, seconds)
+        print(f"{profile:>12} {reads:>12.0f} {writes:>10.0f}")
@@ -0,0 +1,81 @@
+"""
+Benchmark a SET on a config with several triggers, running the trigger
+source strings (as before) against code objects compiled once.
+
+usage: python3 -m bench.bench_trigger [n_triggers] [n_sets]
+"""
+
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+import canfig
+from bench.bench_plan import set_loop
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+from utils import format_code
+
+
+def trigger_source(cfg: str, i: int) -> str:
+    return f"""
+TRIGGER Check_{chr(65 + i)} WHEN CHANGE {cfg} {{
+    port = GET("{cfg}.port")
+    if port and ASSERT_EQUAL(target=port[0]['port'], dest=-{i}):
+        CANFIG_ERR(msg="invalid port")
+
+    if err_msg := ASSERT_UNIQUE(list=GET("{cfg}.commands"),
+                                getter=lambda obj: obj['name']):
+        CANFIG_ERR(msg=err_msg)
+
+    if err_msg := ASSERT_REGEX(target=GET("{cfg}.description")[0]['description'],
+                               pattern=r"[a-z ]+"):
+        CANFIG_WARN(msg=err_msg)
+}};
+"""
+
+
+if __name__ == "__main__":
+    n_triggers = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    with open(os.path.join("sample", "sample.cand")) as f:
+        source = f.read()
+    # only the generated triggers
+    source = source[: source.index("(* TRIGGER *)")] + "".join(
+        trigger_source("Server", i) for i in range(n_triggers)
+    )
+    cplan = compile_source(source)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = canfig.db = DB(os.path.join(tmp, "bench.sqlite3"))
+        migrate(db, cplan.tables, cplan.schema)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.build_plans(cplan.fields)
+        plan = canfig.final_plan["Server"]["port"]
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            canfig.final_plan["Server"]["description"].bind("bench server")
+            canfig.final_plan["Server"]["description"].execute(db)
+
+        print(f"{n_triggers} triggers on Server")
+        print(f"{'':>20} {'per SET':>12}")
+
+        # source strings with the module globals, as registered before
+        for trigger_info in cplan.triggers:
+            plan.add_trigger(trigger_info["name"], format_code(trigger_info["cmd"]), vars(canfig))
+        t = set_loop(plan, db, lambda i: 8000 + i, n)
+        print(f"{'source':>20} {t * 1e6:>10.1f}us")
+
+        # code objects compiled once at load, one minimal globals per trigger
+        for trigger_info in cplan.triggers:
+            plan.add_trigger(
+                trigger_info["name"], canfig.trigger_code(trigger_info), canfig.trigger_globals()
+            )
+        t = set_loop(plan, db, lambda i: 8000 + i, n)
+        print(f"{'code object':>20} {t * 1e6:>10.1f}us")
+
+        db.close()
@@ -0,0 +1,104 @@
+"""
+Load test of server.py: clients poll one path with and without If-None-Match
+and report the throughput and latency of the 200 and the 304 responses.
+
+usage: python3 -m bench.load_server [--url URL] [--spawn] [--clients N]
+                                    [--seconds S] [--path PATH]
+
+--spawn starts a local instance on the sample candy and a scratch database,
+otherwise the server at --url is used.
+"""
+
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+
+from compiler import compile_file
+
+
+def poll(url: str, conditional: bool, stop: threading.Event, latencies: list, statuses: dict):
+    with httpx.Client() as client:
+        etag = client.get(url).headers.get("etag")
+        headers = {"If-None-Match": etag} if conditional and etag else {}
+        while not stop.is_set():
+            start = time.perf_counter()
+            status = client.get(url, headers=headers).status_code
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+
+
+def load(url: str, conditional: bool, clients: int, seconds: float) -> tuple:
+    """
+    :return: (requests/s, p50, p99, statuses)
+    """
+    stop = threading.Event()
+    latencies, statuses = [], {}
+    threads = [
+        threading.Thread(target=poll, args=(url, conditional, stop, latencies, statuses))
+        for _ in range(clients)
+    ]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+
+    latencies.sort()
+    return (
+        len(latencies) / seconds,
+        latencies[len(latencies) // 2],
+        latencies[int(len(latencies) * 0.99)],
+        statuses,
+    )
+
+
+@contextlib.contextmanager
+def spawn(port: int):
+    candy_file, _ = compile_file(os.path.join("sample", "sample.cand"))
+    with tempfile.TemporaryDirectory() as tmp:
+        env = {
+            **os.environ,
+            "CANFIG_CANDY": candy_file,
+            "CANFIG_DB": os.path.join(tmp, "server.sqlite3"),
+        }
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+        )
+        try:
+            url = f"http://127.0.0.1:{port}"
+            for _ in range(100):
+                with contextlib.suppress(httpx.TransportError):
+                    httpx.get(url)
+                    break
+                time.sleep(0.1)
+            yield url
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--url", default="http://127.0.0.1:8000")
+    arg_parser.add_argument("--spawn", action="store_true", help="start a local instance")
+    arg_parser.add_argument("--clients", type=int, default=8)
+    arg_parser.add_argument("--seconds", type=float, default=5.0)
+    arg_parser.add_argument("--path", default="/config/Server")
+    args = arg_parser.parse_args()
+
+    with spawn(int(args.url.rsplit(":", 1)[1])) if args.spawn else contextlib.nullcontext(args.url) as url:
+        print(f"{args.clients} clients on {args.path} for {args.seconds:.0f}s")
+        print(f"{'':>14} {'req/s':>10} {'p50':>10} {'p99':>10}  status")
+        for name, conditional in [("full read", False), ("If-None-Match", True)]:
+            rate, p50, p99, statuses = load(url + args.path, conditional, args.clients, args.seconds)
+            print(f"{name:>14} {rate:>10.0f} {p50 * 1000:>8.2f}ms {p99 * 1000:>8.2f}ms  {statuses}")
@@ -0,0 +1,51 @@
+"""
+generate large .cand definitions for benchmarking
+"""
+
+
+def generate_schema(n_configs: int = 500) -> str:
+    parts = [
+        '@version       "1.0.0";',
+        '@author        "bench";',
+        '@help          "generated \\\n        schema";',
+        "",
+        "(* STRUCT *)",
+        "STRUCT COMMAND {",
+        "    name            TEXT,",
+        "    description     TEXT       CHECK(LENGTH(description) > 10)",
+        "};",
+        "",
+        "STRUCT TIME_S(max_minute:int = 1000) {",
+        "    minute          INT,",
+        "    second          INT,",
+        "    CONSTRAINT CHK_Time CHECK (second>=18 AND minute<max_minute)",
+        "};",
+        "",
+        "STRUCT NAME         TEXT;",
+        "",
+    ]
+
+    for i in range(n_configs):
+        cfg = f"Cfg_{chr(65 + i % 26)}_{'_'.join(chr(97 + int(d)) for d in str(i))}"
+        parts += [
+            f"(* config number {i} *)",
+            f"CONFIG {cfg} {{",
+            "    run             BOOLEAN DEFAULT 1,",
+            "    name            NAME,",
+            "    port            INT,",
+            "    description     TEXT    DEFAULT 'default description',",
+            "    commands        LIST(COMMAND),",
+            "    alive_time      TIME_S",
+            "};",
+            "",
+            f"TRIGGER Check_{cfg} WHEN CHANGE {cfg} {{",
+            f'    if err_msg := ASSERT_UNIQUE(list=GET("{cfg}.commands"),',
+            "                                getter=lambda obj: obj['name']):",
+            "        CANFIG_ERR(msg=err_msg)",
+            "};",
+            "",
+            f"SLICE View_{cfg} = ({cfg} - <{cfg}.commands>) + <{cfg}.name>;",
+            "",
+        ]
+
+    return "\n".join(parts)
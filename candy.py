@@ -0,0 +1,419 @@
+"""
+Binary .candy format.
+
+layout (little endian):
+    header      magic, format version, flags, md5 of the source, section count
+    index       (name, offset, length) of every section
+    sections    meta_data, structs, configs, triggers, slices, ...
+    strings     string table, every str in the sections is an index into it
+
+a section holding a list is stored with a record offset table, so a single
+record can be decoded without touching the others. Lengths, ints and string
+indexes are varints, and a list, dict or bytes equal to one written before
+in the file is stored as a reference to it, every reference to a value is
+decoded into the same object. Nothing in the file is executed on load,
+unlike pickle.
+
+trust: a candy is data, not code. The decoder only builds str, int, float,
+bytes, list and dict, and canfig compiles the triggers from the source they
+are stored as, so what runs is what the file shows. The md5 in the header
+only tells whether the candy is fresh against its .cand, it is no
+signature: an edited candy runs the triggers it was edited to hold, as an
+edited .cand would.
+"""
+
+import mmap
+import os
+import struct
+import tempfile
+
+from utils import CanfigException
+
+MAGIC = b"CANDY\0"
+FORMAT_VERSION = 2
+
+_HEADER = struct.Struct("<6sHH16sI")
+_INDEX_ENTRY = struct.Struct("<16sQQ")
+_U32 = struct.Struct("<I")
+_F64 = struct.Struct("<d")
+
+# value tags
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _BYTES, _LIST, _DICT, _RECORDS, _REF = range(11)
+
+STRING_SECTION = "strings"
+
+# a value encoded shorter than this is never replaced by a reference
+_MIN_SHARED = 6
+
+
+def _varint(n: int) -> bytes:
+    ret = bytearray()
+    while n >= 0x80:
+        ret.append(n & 0x7F | 0x80)
+        n >>= 7
+    ret.append(n)
+    return bytes(ret)
+
+
+def _read_varint(mm, at: int) -> tuple:
+    n = shift = 0
+    while True:
+        b = mm[at]
+        at += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, at
+        shift += 7
+
+
+class _Encoder:
+    def __init__(self):
+        self.strings: dict = {}
+        # encoded value -> file offset it is first written at
+        self.shared: dict = {}
+
+    def string(self, value: str) -> bytes:
+        if (idx := self.strings.get(value)) is None:
+            idx = self.strings[value] = len(self.strings)
+        return _varint(idx)
+
+    def encode(self, value, buf: bytearray, base: int):
+        """
+        :param base: file offset buf starts at
+        """
+        if value is None:
+            buf.append(_NONE)
+        elif value is True:
+            buf.append(_TRUE)
+        elif value is False:
+            buf.append(_FALSE)
+        elif isinstance(value, int):
+            buf.append(_INT)
+            # zigzag, a small negative int stays short
+            buf += _varint(value << 1 if value >= 0 else (-value << 1) - 1)
+        elif isinstance(value, float):
+            buf.append(_FLOAT)
+            buf += _F64.pack(value)
+        elif isinstance(value, str):
+            buf.append(_STR)
+            buf += self.string(value)
+        else:
+            start = len(buf)
+            if isinstance(value, (bytes, bytearray)):
+                buf.append(_BYTES)
+                buf += _varint(len(value))
+                buf += value
+            elif isinstance(value, (list, tuple)):
+                buf.append(_LIST)
+                buf += _varint(len(value))
+                for item in value:
+                    self.encode(item, buf, base)
+            elif isinstance(value, dict):
+                buf.append(_DICT)
+                buf += _varint(len(value))
+                for k, v in value.items():
+                    buf += self.string(k)
+                    self.encode(v, buf, base)
+            else:
+                raise CanfigException(f"cannot store {type(value).__name__} in candy")
+
+            if len(buf) - start >= _MIN_SHARED:
+                # a reference is an absolute offset, equal bytes are always an
+                # equal value
+                encoded = bytes(buf[start:])
+                if (at := self.shared.get(encoded)) is None:
+                    self.shared[encoded] = base + start
+                elif len(ref := bytes([_REF]) + _varint(at)) < len(encoded):
+                    del buf[start:]
+                    buf += ref
+
+    def section(self, value, base: int) -> bytes:
+        """
+        :param base: file offset the section is written at
+        """
+        if not isinstance(value, list):
+            buf = bytearray()
+            self.encode(value, buf, base)
+            return bytes(buf)
+
+        # record list: tag, count, offset of each record from section start
+        head_size = 1 + _U32.size * (len(value) + 1)
+        offsets = []
+        body = bytearray()
+        for record in value:
+            offsets.append(head_size + len(body))
+            self.encode(record, body, base + head_size)
+
+        head = bytearray([_RECORDS])
+        head += _U32.pack(len(value))
+        for offset in offsets:
+            head += _U32.pack(offset)
+        return bytes(head + body)
+
+    def string_table(self) -> bytes:
+        blobs = [s.encode() for s in self.strings]
+        head = bytearray(_U32.pack(len(blobs)))
+        offset = 0
+        for blob in blobs:
+            head += _U32.pack(offset)
+            offset += len(blob)
+        head += _U32.pack(offset)
+        return bytes(head) + b"".join(blobs)
+
+
+def dump(cplan_file: str, md5: str, sections: dict):
+    """
+    :param md5: hex md5 of the source the plan is compiled from
+    :param sections: section name -> value made of None/bool/int/float/str/
+                     bytes/list/dict, a list value is stored as records
+    """
+    assert all(len(name.encode()) <= 16 for name in sections), "section name too long"
+
+    encoder = _Encoder()
+    # the index has an entry for the string table, written after the sections
+    offset = _HEADER.size + _INDEX_ENTRY.size * (len(sections) + 1)
+    payloads = []
+    for name, value in sections.items():
+        payloads.append((name, encoder.section(value, offset)))
+        offset += len(payloads[-1][1])
+    payloads.append((STRING_SECTION, encoder.string_table()))
+
+    offset = _HEADER.size + _INDEX_ENTRY.size * len(payloads)
+    index = bytearray()
+    for name, payload in payloads:
+        index += _INDEX_ENTRY.pack(name.encode(), offset, len(payload))
+        offset += len(payload)
+
+    # readers mmap the candy, it is replaced by a complete new file instead
+    # of being rewritten under their mapping
+    directory, name = os.path.split(os.path.abspath(cplan_file))
+    with tempfile.NamedTemporaryFile(
+        "wb", dir=directory, prefix=f".{name}.", suffix=".tmp", delete=False
+    ) as f:
+        try:
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, 0, bytes.fromhex(md5), len(payloads)))
+            f.write(index)
+            for _, payload in payloads:
+                f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        except BaseException:
+            f.close()
+            os.unlink(f.name)
+            raise
+    try:
+        os.replace(f.name, cplan_file)
+    except BaseException:
+        os.unlink(f.name)
+        raise
+
+
+def _read_header(head: bytes) -> tuple:
+    if len(head) < _HEADER.size:
+        raise CanfigException("not a candy file")
+
+    magic, version, _, md5, n_sections = _HEADER.unpack_from(head)
+    if magic != MAGIC:
+        raise CanfigException("not a candy file")
+    if version != FORMAT_VERSION:
+        raise CanfigException(
+            f"candy format version {version} is not supported, expect {FORMAT_VERSION}"
+        )
+    return md5.hex(), n_sections
+
+
+def read_md5(cplan_file: str) -> str | None:
+    """
+    :return: md5 of the source stored in the header, None if not a valid candy
+    """
+    try:
+        with open(cplan_file, "rb") as f:
+            return _read_header(f.read(_HEADER.size))[0]
+    except (OSError, CanfigException):
+        return None
+
+
+class CandyReader:
+    """
+    mmap a candy, sections are decoded on first access then kept
+
+    the references to a value are decoded into one object, the decoded plan
+    is read only
+    """
+
+    def __init__(self, cplan_file: str):
+        self.__file = open(cplan_file, "rb")
+        try:
+            self.__mm = mmap.mmap(self.__file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self.__file.close()
+            raise CanfigException(f"'{cplan_file}' is empty")
+
+        try:
+            self.__read_index()
+        except BaseException as e:
+            self.close()
+            if isinstance(e, (struct.error, KeyError)):
+                raise CanfigException(f"'{cplan_file}' is a corrupted candy")
+            raise
+
+        self.__sections: dict = {}
+        # file offset -> value decoded there, of the referenced values
+        self.__shared: dict = {}
+
+    def __read_index(self):
+        self.md5, n_sections = _read_header(self.__mm[: _HEADER.size])
+
+        self.__index: dict = {}
+        for i in range(n_sections):
+            name, offset, length = _INDEX_ENTRY.unpack_from(
+                self.__mm, _HEADER.size + i * _INDEX_ENTRY.size
+            )
+            self.__index[name.rstrip(b"\0").decode()] = (offset, length)
+
+        self.__strings_at, _ = self.__index[STRING_SECTION]
+        (n_strings,) = _U32.unpack_from(self.__mm, self.__strings_at)
+        self.__strings: list = [None] * n_strings
+        self.__blob_at = self.__strings_at + _U32.size * (n_strings + 2)
+
+    def sections(self) -> list:
+        return [name for name in self.__index if name != STRING_SECTION]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.__index and name != STRING_SECTION
+
+    def __getitem__(self, name: str):
+        if name not in self.__sections:
+            self.__sections[name] = self.__decode(self.__section_at(name))[0]
+        return self.__sections[name]
+
+    def get(self, name: str, default=None):
+        return self[name] if name in self else default
+
+    def record_count(self, name: str) -> int:
+        at = self.__section_at(name)
+        if self.__mm[at] != _RECORDS:
+            raise CanfigException(f"section '{name}' is not a record list")
+        return _U32.unpack_from(self.__mm, at + 1)[0]
+
+    def record(self, name: str, i: int):
+        """
+        decode only the i-th record of a record list section
+        """
+        at = self.__section_at(name)
+        if not 0 <= i < self.record_count(name):
+            raise IndexError(f"record {i} out of range in section '{name}'")
+        (offset,) = _U32.unpack_from(self.__mm, at + 1 + _U32.size * (i + 1))
+        return self.__decode(at + offset)[0]
+
+    def close(self):
+        self.__mm.close()
+        self.__file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __section_at(self, name: str) -> int:
+        if name not in self:
+            raise KeyError(name)
+        return self.__index[name][0]
+
+    def __string(self, i: int) -> str:
+        if (value := self.__strings[i]) is None:
+            start, end = struct.unpack_from(
+                "<II", self.__mm, self.__strings_at + _U32.size * (i + 1)
+            )
+            value = self.__strings[i] = str(
+                self.__mm[self.__blob_at + start : self.__blob_at + end], "utf-8"
+            )
+        return value
+
+    def __decode(self, at: int) -> tuple:
+        mm = self.__mm
+        tag = mm[at]
+        at += 1
+
+        # a varint of one or two bytes is read inline
+        if tag == _STR:
+            if (i := mm[at]) < 0x80:
+                return self.__string(i), at + 1
+            if (j := mm[at + 1]) < 0x80:
+                return self.__string(i & 0x7F | j << 7), at + 2
+            i, at = _read_varint(mm, at)
+            return self.__string(i), at
+        elif tag == _REF:
+            target, at = _read_varint(mm, at)
+            if (value := self.__shared.get(target)) is None:
+                value = self.__shared[target] = self.__decode(target)[0]
+            return value, at
+        elif tag == _DICT:
+            n, at = _read_varint(mm, at)
+            ret = {}
+            string = self.__string
+            decode = self.__decode
+            for _ in range(n):
+                if (i := mm[at]) < 0x80:
+                    at += 1
+                elif (j := mm[at + 1]) < 0x80:
+                    i = i & 0x7F | j << 7
+                    at += 2
+                else:
+                    i, at = _read_varint(mm, at)
+                # inline the most common value, a string
+                if mm[at] == _STR and (j := mm[at + 1]) < 0x80:
+                    ret[string(i)] = string(j)
+                    at += 2
+                elif mm[at] == _STR and (k := mm[at + 2]) < 0x80:
+                    ret[string(i)] = string(j & 0x7F | k << 7)
+                    at += 3
+                else:
+                    ret[string(i)], at = decode(at)
+            return ret, at
+        elif tag == _LIST:
+            n, at = _read_varint(mm, at)
+            ret = []
+            string = self.__string
+            decode = self.__decode
+            for _ in range(n):
+                # inline a string item, as in a dict
+                if mm[at] == _STR and (j := mm[at + 1]) < 0x80:
+                    ret.append(string(j))
+                    at += 2
+                elif mm[at] == _STR and (k := mm[at + 2]) < 0x80:
+                    ret.append(string(j & 0x7F | k << 7))
+                    at += 3
+                else:
+                    item, at = decode(at)
+                    ret.append(item)
+            return ret, at
+        elif tag == _RECORDS:
+            (n,) = _U32.unpack_from(mm, at)
+            at += 4 * (n + 1)
+            ret = []
+            for _ in range(n):
+                item, at = self.__decode(at)
+                ret.append(item)
+            return ret, at
+        elif tag == _NONE:
+            return None, at
+        elif tag == _TRUE:
+            return True, at
+        elif tag == _FALSE:
+            return False, at
+        elif tag == _INT:
+            n, at = _read_varint(mm, at)
+            return n >> 1 if not n & 1 else -((n + 1) >> 1), at
+        elif tag == _FLOAT:
+            return _F64.unpack_from(mm, at)[0], at + 8
+        elif tag == _BYTES:
+            n, at = _read_varint(mm, at)
+            return mm[at : at + n], at + n
+
+        raise CanfigException(f"corrupted candy, unknown tag {tag}")
+
+
+def load(cplan_file: str) -> CandyReader:
+    return CandyReader(cplan_file)
@@ -1,17 +1,43 @@
+import os
 import sys
-import pickle
-import subprocess
+import argparse
+import threading
+import collections
 
+import candy
+import trigger_engine
 from evaluator import *
-from utils import TriggerException
+from history import PRUNE_INTERVAL
+from migration import migrate, collect_garbage
+from query_plan import verify_read_plans
+from slices import Slice, SliceRegistry, index_fields
+from snapshot import SnapshotQuery
+from changefeed import ChangeFeed, Subscription
+from memory_backend import MemoryBackend
+from utils import TriggerException, compile_trigger
 
 # struct that hold IO plan for each config
 final_plan: Dict[str, Dict[str, Plan]] = dict()
 
+# slices of the candy, loaded by load_slices
+slices = SliceRegistry([], [])
+
+# config -> field -> spec, set by build_plans
+schema_fields: dict = {}
+
+# snapshot queries, planned once per config or slice. Slice expressions come
+# from clients, only the most recently used are kept
+SNAPSHOT_CACHE_SIZE = 256
+snapshot_queries: collections.OrderedDict = collections.OrderedDict()
+snapshot_queries_lock = threading.Lock()
+
+# change feed of db, opened by the first watch()
+feed: Optional[ChangeFeed] = None
+
 cur_trigger_name = None
 
 
-def GET(field_dir: str) -> list:
+def GET(field_dir: str, version: Optional[int] = None) -> list:
     config_n, field_n = field_dir.split('.')
 
     try:
@@ -19,7 +45,7 @@ def GET(field_dir: str) -> list:
     except KeyError:
         raise CanfigException(f"trigger '{cur_trigger_name}' fail due to field '{field_dir}' not exist")
 
-    return field_plan.view(db)
+    return field_plan.view(db, version=version)
 
 
 def SET(field_dir: str, values) -> None:
@@ -34,11 +60,241 @@ def SET(field_dir: str, values) -> None:
     field_plan.execute(db)
 
 
+def apply(changes: Dict[str, object]) -> list:
+    """
+    write many fields, possibly of several configs, in one transaction. The
+    triggers of the changed fields run once, concurrently, after all the
+    writes.
+
+    :param changes: "Config.field" -> value, as for SET
+    :return: TriggerOutcome of the triggers run
+    """
+    by_config: Dict[str, list] = {}
+    for field_dir, values in changes.items():
+        config_n, field_n = field_dir.split('.')
+
+        try:
+            field_plan = final_plan[config_n][field_n]
+        except KeyError:
+            raise CanfigException(f"fail to apply due to field '{field_dir}' not exist")
+
+        by_config.setdefault(config_n, []).append((field_plan, values))
+
+    # bind everything first, a bad value fails before any write
+    for field_plans in by_config.values():
+        for field_plan, values in field_plans:
+            field_plan.bind(values)
+
+    with db.transaction():
+        for field_plans in by_config.values():
+            for field_plan, _ in field_plans:
+                field_plan.write(db)
+
+        triggers = {}
+        for field_plans in by_config.values():
+            for field_plan, _ in field_plans:
+                triggers.update(field_plan.triggers)
+        report = run_triggers(triggers, db)
+
+    print(f"apply {len(changes)} change(s) on {len(by_config)} config(s) success!")
+    return report
+
+
+class SliceScope:
+    """
+    reads and writes limited to the fields of a slice
+    """
+
+    def __init__(self, slice_: Slice):
+        self.slice = slice_
+
+    def __check(self, field_dir: str):
+        if field_dir not in self.slice:
+            raise CanfigException(f"field '{field_dir}' is not in slice '{self.slice.name}'")
+
+    def fields(self) -> list:
+        return self.slice.fields()
+
+    def get(self, field_dir: str) -> list:
+        self.__check(field_dir)
+        return GET(field_dir)
+
+    def set(self, field_dir: str, values) -> None:
+        self.__check(field_dir)
+        SET(field_dir, values)
+
+    def apply(self, changes: Dict[str, object]) -> list:
+        for field_dir in changes:
+            self.__check(field_dir)
+        return apply(changes)
+
+    def read(self) -> dict:
+        """
+        :return: "Config.field" -> view of every field of the slice
+        """
+        return {field_dir: GET(field_dir) for field_dir in self.slice.fields()}
+
+    def snapshot(self, version: Optional[int] = None) -> dict:
+        """
+        :param version: committed version to read, needs the history on
+        :return: config -> field -> value of every field of the slice, read
+                 in one query
+        """
+        def plan() -> SnapshotQuery:
+            selection: Dict[str, list] = {}
+            for field_dir in self.slice.fields():
+                config_n, field_n = field_dir.split('.')
+                selection.setdefault(config_n, []).append(field_n)
+            return SnapshotQuery(schema_fields, selection)
+
+        return db.snapshot(snapshot_query(("slice", self.slice.name), plan), version)
+
+
+def snapshot_query(key: tuple, plan) -> SnapshotQuery:
+    """
+    :param key: ("config", name), ("field", "Config.field") or ("slice", name
+                or expression)
+    :param plan: builds the query on a miss
+    :return: the cached snapshot query of key
+    """
+    with snapshot_queries_lock:
+        if (query := snapshot_queries.get(key)) is not None:
+            snapshot_queries.move_to_end(key)
+            return query
+
+    query = plan()
+    with snapshot_queries_lock:
+        snapshot_queries[key] = query
+        if len(snapshot_queries) > SNAPSHOT_CACHE_SIZE:
+            snapshot_queries.popitem(last=False)
+    return query
+
+
+def snapshot(config_n: str, version: Optional[int] = None) -> dict:
+    """
+    :param version: committed version to read, needs the history on
+    :return: field -> value of every field of the config, read in one query.
+             a struct field is a dict, a LIST field a list of dicts
+    """
+    if config_n not in schema_fields:
+        raise CanfigException(f"config '{config_n}' not exist")
+    query = snapshot_query(
+        ("config", config_n),
+        lambda: SnapshotQuery(schema_fields, {config_n: list(schema_fields[config_n])}),
+    )
+
+    return db.snapshot(query, version)[config_n]
+
+
+def snapshot_field(field_dir: str, version: Optional[int] = None):
+    """
+    :param field_dir: "Config.field"
+    :param version: committed version to read, needs the history on
+    :return: value of the field as in snapshot(), its query is cached
+    """
+    config_n, _, field_n = field_dir.partition('.')
+    if field_n not in schema_fields.get(config_n, {}):
+        raise CanfigException(f"field '{field_dir}' not exist")
+    query = snapshot_query(
+        ("field", field_dir), lambda: SnapshotQuery(schema_fields, {config_n: [field_n]})
+    )
+
+    return db.snapshot(query, version)[config_n][field_n]
+
+
+def rollback(version: int) -> list:
+    """
+    bring every config back to what it was at version, as a new version. The
+    rows of version are linked again, nothing is rewritten and no trigger
+    runs.
+
+    :return: configs rolled back
+    """
+    with db.transaction():
+        moved = db.restore(version)
+        for config_n in moved:
+            for field_n in final_plan.get(config_n, {}):
+                db.record_change(f"{config_n}.{field_n}")
+
+    print(f"rollback {len(moved)} config(s) to version {version} success!")
+    return moved
+
+
+def changed_values(changes: Dict[str, list]) -> dict:
+    """
+    :param changes: config -> names of the changed fields
+    :return: config -> field -> value of the changed fields, read in one query
+    """
+    return db.snapshot(SnapshotQuery(schema_fields, changes))
+
+
+def record_values(enabled: bool = True):
+    """
+    record the new values of the changed fields with every change event,
+    they are read by the committing transaction
+    """
+    db.change_values = changed_values if enabled else None
+
+
+def watch(since: Optional[int] = None) -> Subscription:
+    """
+    :param since: last version the watcher has seen, the events after it are
+                  replayed from the changelog. None for the events to come
+    :return: subscription to the change events of db
+    """
+    global feed
+    if feed is None or feed.db is not db:
+        feed = ChangeFeed(db)
+    return feed.subscribe(since)
+
+
+def scope(slice_expr: str) -> SliceScope:
+    """
+    :param slice_expr: name of a slice, or a slice expression over the
+                       slices and configs, like "UserConfig - <Server.port>"
+    """
+    if slice_expr in slices:
+        return SliceScope(slices[slice_expr])
+    return SliceScope(slices.compose(slice_expr))
+
+
+def verify_plans() -> int:
+    """
+    run EXPLAIN QUERY PLAN on the read plans of every field and the snapshot
+    query of every config
+
+    :return: number of reads checked
+    """
+    reads = {}
+    for config_n, field_plans in final_plan.items():
+        for field_n, field_plan in field_plans.items():
+            for i, read in enumerate(field_plan.read_plans):
+                reads[f"{config_n}.{field_n} #{i + 1}"] = read
+        query = SnapshotQuery(schema_fields, {config_n: list(schema_fields[config_n])})
+        reads[f"snapshot {config_n}"] = (
+            query.sql,
+            (Plan.CONFIG_ROW_ID,) * len(query.column_configs),
+        )
+
+    if failed := verify_read_plans(db, reads):
+        for name, scans in failed.items():
+            print(f"{name}: {'; '.join(scans)}")
+        raise CanfigException(f"{len(failed)} read plan(s) scan a whole table")
+    return len(reads)
+
+
+def load_slices(field_index: list, slice_plans: list):
+    global slices
+    slices = SliceRegistry(field_index, slice_plans)
+    print(f"load {len(slices.slices)} slice(s)")
+
+
 def CANFIG_ERR(msg: str):
     raise TriggerException(msg)
 
 
 def CANFIG_WARN(msg: str):
+    trigger_engine.warn(msg)
     print(f"Trigger Warning: {msg}")
 
 
@@ -66,180 +322,195 @@ def ASSERT_UNIQUE(list, getter):
     return None
 
 
-def format_code(code_string):
-    # Split the code string into lines
-    lines = code_string.split('\n')
+# names a trigger body can use
+TRIGGER_API = (
+    "GET", "SET", "CANFIG_ERR", "CANFIG_WARN", "ASSERT_REGEX", "ASSERT_EQUAL", "ASSERT_UNIQUE"
+)
 
-    # Remove 2 spaces of indentation from each line
-    unindented_lines = [line[4:] if line.startswith('    ') else line for line in lines]
 
-    # Join the lines back into a single string
-    return '\n'.join(unindented_lines)
+def trigger_globals() -> dict:
+    """
+    :return: globals a trigger body runs with, the trigger API and builtins
+    """
+    env = {name: globals()[name] for name in TRIGGER_API}
+    env["__builtins__"] = __builtins__
+    return env
 
 
-if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <input_file>")
-        exit(1)
-
-    assert sys.argv[1].endswith(".candy"), "input file must be .candy"
-
-    with open(cplan_file := sys.argv[1], "rb") as f:
-        cplan_data = pickle.load(f)
-
-    subprocess.run(["rm", DB_FILE])
-
-    db = DB(DB_FILE)
-    print("load db instance.")
-
-    # structs that already been created
-    struct_set: set = set()
-
-    # evaluate STRUCT
-    for plan in cplan_data["sql_query"]:
-        if plan["type"] == "STRUCT":
-            if not plan["pre"]:
-                db.execute(CREATE_TABLE_plan(table_name=plan["name"], sql=plan["sql"]))
-                struct_set.add(plan["name"])
-                print(f"evaluate struct: {plan['name']}")
-
-            elif "arg" in plan:
-                plan_rule = re.match(r"(\w+):(\w+)\s*=\s*(\d+)", plan["arg"]).groups()
-                pre_plan = PreSQL(
-                    table_name=f"{plan['name']}",
-                    pre_sql=plan["sql"],
-                    arg_rule=plan_rule,
-                )
-                plan["pre_plan"] = pre_plan
-                db.execute(pre_plan.make(None))
-                struct_set.add(plan["name"])
-                print(f"evaluate struct: {plan['name']}")
-
-    # evaluate CONFIG
-    for plan in cplan_data["sql_query"]:
-        if plan["type"] == "CONFIG":
-            # print(plan['sql'])
-            print(f"\nevaluate config: {plan['name']}")
-
-            m2m_plans = []
-            m2m_tables = []
-
-            if list_matches := re.findall(
-                    r"(\w+)\s+LIST\(([^()]*(?:\([^)]*\))?[^()]*)\)", plan["sql"]
-            ):
-                # Evaluate LIST, basically create many-to-many relation with the
-                # list argument.
-                for field_pair in list_matches:
-                    config_name, req_struct = field_pair
-                    if req_struct not in struct_set:
-                        # create missing struct
-                        if not bool(re.fullmatch(r"\w+\([^()]*\)", req_struct)):
-                            # case 1: not pre-sql type, that is build-in-type
-                            assert (
-                                    req_struct in SQLITE3_BUILD_IN_TYPE
-                            ), f"invalid type LIST{req_struct}"
-                            db.execute(CREATE_BUILD_IN_plan(req_struct))
-                            print(f"evaluate build-in struct: {req_struct}")
-                        else:
-                            # case 2: pre-sql type, need create PreSQL instance
-                            pre_sql_struct = re.search(r"(\w+)\(", req_struct).groups()[
-                                0
-                            ]
-                            assert pre_sql_struct in struct_set, (
-                                f"Fail to build LIST({req_struct}) "
-                                f"due to struct {req_struct} not exist"
-                            )
-                            # db.execute(cplan_data['sql_query'])
-                            for i in cplan_data["sql_query"]:
-                                if i["name"] == pre_sql_struct:
-                                    db.execute(
-                                        i["pre_plan"].make(
-                                            re.search(
-                                                r"\((.*?)\)", req_struct
-                                            ).groups()[0]
-                                        )
-                                    )
-                                    break
-                            print(f"evaluate {req_struct}")
-
-                    post_struct = PreSQL.format_struct_to_name(req_struct)
-                    m2m_plans.append(
-                        CREATE_M2M_plan(tname_1=post_struct, tname_2=plan["name"])
-                    )
-
-                    plan_ptr = assign_plan(
-                        _final_plan=final_plan, _plan=plan, _for=config_name
-                    )
-
-                    plan_ptr.init_list_plan(
-                        table_name=plan["name"],
-                        ext_table_name=post_struct,
-                    )
-
-                    # should be consistent on how CREATE_M2M_plan create m2m table name
-                    m2m_tables.append(f"{post_struct}_{plan['name']}")
-                    struct_set.add(post_struct)
-
-                # replace LIST to be NULL type
-                plan["sql"] = re.sub(
-                    r"LIST\(([^()]*(?:\([^()]*\)[^()]*)*)\)", "NULL", plan["sql"]
-                )
-
-            # Evaluate struct referencing
-            struct_ref_fks = []
-            struct_ref = pre_sql_get_args(plan["sql"], struct_set)
-            for ref in struct_ref:
-                plan_ptr = assign_plan(final_plan, plan, ref[0])
-                plan_ptr.init_ext_plan(
-                    table_name=plan["name"],
-                    ext_table_name=PreSQL.format_struct_to_name(ref[1]),
-                    _config_name=ref[0],
-                )
-
-                struct_ref_fks.append((ref[0], PreSQL.format_struct_to_name(ref[1])))
-
-            # print(plan['sql'])
-            # print(pre_sql_get_args(plan['sql'], struct_set))
-            # print(pre_sql_get_args(plan['sql'], struct_set, True))
-
-            for ref in pre_sql_get_args(plan["sql"], struct_set, True):
-                if ref[1] != "NULL":
-                    plan_ptr = assign_plan(final_plan, plan, ref[0])
-                    plan_ptr.init_std_plan(table_name=plan["name"], _config_name=ref[0])
-
-            # create db
-            db_query = CREATE_TABLE_plan(
-                table_name=plan["name"], sql=plan["sql"], FKs=struct_ref_fks
-            )
-            db.execute(db_query)
-
-            # create m2m relation
-            for p in m2m_plans:
-                db.execute(p)
-
-            # init config tables
-            db.execute(CREATE_CONFIG_INIT_plan(plan["name"]))
-
-            db.commit()
-
-            print(f"finish evaluate config: {plan['name']}")
+def trigger_code(trigger_info: dict):
+    """
+    :return: code object of the trigger, compiled from its source in the
+             candy, code shipped next to it is never run
+    """
+    return compile_trigger(trigger_info['name'], trigger_info['cmd'])
 
-    # Registering Phase
-    for trigger_info in cplan_data['triggers']:
+
+def build_plans(fields: dict):
+    """
+    assign the IO plan of every config field into final_plan
+
+    :param fields: config -> field -> spec, resolved by the compiler
+    """
+    schema_fields.update(fields)
+    with snapshot_queries_lock:
+        snapshot_queries.clear()
+
+    for config_name, config_fields in fields.items():
+        for field_name, spec in config_fields.items():
+            init_plan(assign_plan(final_plan, config_name, field_name), config_name, field_name, spec)
+
+
+def register_triggers(triggers: list, trigger_index: Optional[dict] = None):
+    """
+    add every trigger to the plans of the fields it reads
+
+    :param trigger_index: "Config.field" -> names of the triggers reading it,
+                          None to add a trigger to every field of the config
+                          it watches
+    """
+    compiled = {}
+    for trigger_info in triggers:
         assert trigger_info[
                    'condition'] in final_plan, f"fail to register Trigger '{trigger_info['name']} " \
                                                f"" \
                                                f"due to Config {trigger_info['condition']}' not exist"
 
-        for field_name, field_plan in final_plan[trigger_info['condition']].items():
-            # TODO: buggy, globals shouldn't be pass to add_trigger, but need to dynamically get in evaluator
-            field_plan.add_trigger(trigger_info['name'], format_code(trigger_info['cmd']), globals())
-            print(f"register trigger '{trigger_info['name']}' for '{field_name}'")
+        # one code object and globals, shared by every field it is added to
+        compiled[trigger_info['name']] = (trigger_code(trigger_info), trigger_globals())
+
+    if trigger_index is None:
+        trigger_index = {}
+        for trigger_info in triggers:
+            for field_name in final_plan[trigger_info['condition']]:
+                trigger_index.setdefault(
+                    f"{trigger_info['condition']}.{field_name}", []
+                ).append(trigger_info['name'])
+
+    for field_dir, trigger_names in trigger_index.items():
+        config_n, field_n = field_dir.split('.')
+        if field_n not in final_plan.get(config_n, {}):
+            print(f"Warning: trigger {trigger_names} read field '{field_dir}' not exist")
+            continue
+
+        for trigger_name in trigger_names:
+            final_plan[config_n][field_n].add_trigger(trigger_name, *compiled[trigger_name])
+            print(f"register trigger '{trigger_name}' for '{field_dir}'")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("input_file", help=".candy plan")
+    arg_parser.add_argument("--db", default=DB_FILE, help="sqlite3 database file")
+    arg_parser.add_argument(
+        "--persist",
+        action="store_true",
+        help="keep the existing database and only migrate the schema delta",
+    )
+    arg_parser.add_argument(
+        "--trigger-deadline",
+        type=float,
+        default=trigger_engine.DEFAULT_DEADLINE,
+        help="seconds a trigger may run before the write is rolled back",
+    )
+    arg_parser.add_argument(
+        "--storage",
+        choices=list(STORAGE_PROFILES),
+        help="storage profile of the database, overrides the @storage of the candy",
+    )
+    arg_parser.add_argument(
+        "--backend",
+        choices=["sqlite", "memory"],
+        default="sqlite",
+        help="keep the fields in sqlite, or in memory persisted to sqlite behind the writes",
+    )
+    arg_parser.add_argument(
+        "--history",
+        type=int,
+        default=0,
+        metavar="KEEP",
+        help="keep the last KEEP versions of the configs, 0 writes them in place",
+    )
+    arg_parser.add_argument(
+        "--prune-every",
+        type=int,
+        default=PRUNE_INTERVAL,
+        metavar="N",
+        help="prune the versions older than the last KEEP every N versions",
+    )
+    arg_parser.add_argument(
+        "--rollback",
+        type=int,
+        metavar="VERSION",
+        help="roll the configs of the database back to VERSION, then exit",
+    )
+    arg_parser.add_argument(
+        "--verify-plans",
+        action="store_true",
+        help="check no read plan scans a whole table, then exit",
+    )
+    args = arg_parser.parse_args()
+    if args.rollback is not None and not args.persist:
+        arg_parser.error("--rollback needs the database kept by --persist")
+    if args.prune_every < 1:
+        arg_parser.error("--prune-every needs a positive number of versions")
+
+    trigger_engine.ENGINE.default_deadline = args.trigger_deadline
+
+    assert args.input_file.endswith(".candy"), "input file must be .candy"
+
+    cplan_data = candy.load(cplan_file := args.input_file)
+
+    if not args.persist:
+        # a WAL profile leaves a -wal and -shm next to the database, a stale
+        # pair would be applied to the new one
+        for path in (args.db, args.db + "-wal", args.db + "-shm"):
+            if os.path.exists(path):
+                os.remove(path)
+
+    profile = args.storage or cplan_data["meta_data"].get("STORAGE", DEFAULT_STORAGE_PROFILE)
+    db = DB(args.db, profile, args.history, args.prune_every)
+    print(f"load db instance, storage profile '{profile}'.")
+
+    # the tables are only decoded when the database is not on the schema
+    if applied := migrate(db, lambda: cplan_data["tables"], cplan_data["schema"]):
+        print(f"schema migrated with {len(applied)} statement(s).")
+    else:
+        print("schema up to date.")
+
+    build_plans(cplan_data["fields"])
+
+    if args.verify_plans:
+        print(f"verify {verify_plans()} read plan(s): no full scan.")
+        db.close()
+        cplan_data.close()
+        sys.exit(0)
+
+    if args.rollback is not None:
+        rollback(args.rollback)
+        for version, _, configs in db.history.versions(db, 5):
+            print(f"version {version}: {', '.join(configs)}")
+        db.close()
+        cplan_data.close()
+        sys.exit(0)
+
+    if args.persist and (collected := collect_garbage(db, cplan_data["fields"])):
+        print(f"collect {collected} orphan struct row(s).")
+
+    if args.backend == "memory":
+        db = MemoryBackend(db, cplan_data["fields"])
+        print(f"warm memory backend with {len(db.values)} field(s).")
+
+    # Registering Phase
+    register_triggers(cplan_data['triggers'], cplan_data.get('trigger_index'))
+
+    if "slices" in cplan_data:
+        load_slices(index_fields(cplan_data["fields"]), cplan_data["slices"])
 
     # # # TEST CASE
     final_plan["Server"]["port"].bind(8128)
     # print(final_plan['Server']['port'])
-    final_plan["Server"]["port"].execute(db)
+    for outcome in final_plan["Server"]["port"].execute(db):
+        print(outcome)
 
     print(final_plan["Server"]["port"].view(db))
 
@@ -276,3 +547,4 @@ if __name__ == '__main__':
     # print(final_plan["Server"]["alive_time"])
 
     db.close()
+    cplan_data.close()
@@ -0,0 +1,225 @@
+"""
+Change feed: every committed write is published as a ChangeEvent, with the
+configs and fields it changed and the write version it committed as.
+
+the events are also recorded in _canfig_changelog by the transaction that
+makes them, so a watcher can resume from the last version it saw and the
+writes of other processes are picked up by ChangeFeed.poll().
+"""
+
+import asyncio
+import collections
+import contextlib
+import json
+import threading
+import time
+
+# events a slow subscription holds before it falls back to the changelog
+SUBSCRIPTION_QUEUE_SIZE = 1024
+
+_CHANGELOG_SQL = """
+    SELECT version, committed_at, changes, field_values FROM _canfig_changelog
+    WHERE version > ? ORDER BY version
+"""
+_OLDEST_SQL = "SELECT MIN(version) FROM _canfig_changelog"
+
+
+class ChangeEvent:
+    __slots__ = ("version", "committed_at", "changes", "values")
+
+    def __init__(self, version: int, committed_at: float, changes: dict | None, values: dict | None = None):
+        """
+        :param changes: config -> names of the changed fields, None when the
+                        changelog no longer holds the versions asked for and
+                        the watcher must read everything again
+        :param values: config -> field -> new value, when recorded
+        """
+        self.version = version
+        self.committed_at = committed_at
+        self.changes = changes
+        self.values = values
+
+    @property
+    def reset(self) -> bool:
+        return self.changes is None
+
+    def to_dict(self) -> dict:
+        ret = {"version": self.version, "committed_at": self.committed_at}
+        if self.reset:
+            ret["reset"] = True
+        else:
+            ret["changes"] = self.changes
+            if self.values is not None:
+                ret["values"] = self.values
+        return ret
+
+    def __repr__(self):
+        return f"ChangeEvent({self.version}, {'reset' if self.reset else self.changes})"
+
+
+class Subscription:
+    """
+    events of a feed from a version on, in version order and without gap.
+    get() waits from a thread, aget() from an event loop.
+    """
+
+    def __init__(self, feed: "ChangeFeed", since: int | None):
+        self.feed = feed
+        # version of the last event handed out
+        self.version = feed.version if since is None else since
+
+        self.__events = collections.deque()
+        self.__cond = threading.Condition()
+        # the events from self.version on are read from the changelog first
+        self.__replay = since is not None and since < feed.version
+        self.__loop = None
+        self.__wakeup = None
+
+    def _push(self, event: ChangeEvent):
+        with self.__cond:
+            if self.__events and event.version <= self.__events[-1].version:
+                return
+            if len(self.__events) >= SUBSCRIPTION_QUEUE_SIZE:
+                self.__events.clear()
+                self.__replay = True
+            else:
+                self.__events.append(event)
+            self.__cond.notify_all()
+        if self.__loop is not None:
+            self.__loop.call_soon_threadsafe(self.__wakeup.set)
+
+    def __fill(self):
+        with self.__cond:
+            if not self.__replay:
+                return
+            self.__replay = False
+            since = self.version
+
+        backlog = self.feed.changelog(since)
+        with self.__cond:
+            last = backlog[-1].version if backlog else since
+            newer = [event for event in self.__events if event.version > last]
+            self.__events = collections.deque(backlog + newer)
+
+    def __next(self) -> ChangeEvent | None:
+        with self.__cond:
+            while self.__events:
+                if (event := self.__events.popleft()).version > self.version:
+                    self.version = event.version
+                    return event
+            return None
+
+    def get(self, timeout: float | None = None) -> ChangeEvent | None:
+        """
+        :return: the next event, None after timeout seconds without one
+        """
+        self.__fill()
+        with self.__cond:
+            self.__cond.wait_for(lambda: self.__events or self.__replay, timeout)
+        self.__fill()
+        return self.__next()
+
+    async def aget(self, timeout: float | None = None) -> ChangeEvent | None:
+        """
+        as get(), without blocking the event loop
+        """
+        if self.__loop is None:
+            self.__loop = asyncio.get_running_loop()
+            self.__wakeup = asyncio.Event()
+
+        self.__wakeup.clear()
+        if self.__replay:
+            await asyncio.to_thread(self.__fill)
+        if (event := self.__next()) is not None:
+            return event
+
+        try:
+            await asyncio.wait_for(self.__wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if self.__replay:
+            await asyncio.to_thread(self.__fill)
+        return self.__next()
+
+    def close(self):
+        self.feed.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ChangeFeed:
+    """
+    fan out the events of a database to its subscriptions
+    """
+
+    def __init__(self, _db):
+        self.db = _db
+        # version of the last event published
+        self.version = _db.read_write_version() or 0
+        self.__subscriptions: set = set()
+        self.__lock = threading.Lock()
+        _db.commit_listeners.append(self.publish)
+
+    def publish(self, event: ChangeEvent):
+        with self.__lock:
+            if event.version <= self.version or event.changes == {}:
+                return
+            self.version = event.version
+            subscriptions = list(self.__subscriptions)
+        for subscription in subscriptions:
+            subscription._push(event)
+
+    def poll(self):
+        """
+        publish the events other processes recorded since the last one
+        """
+        with self.db.lock:
+            for event in self.changelog(self.version):
+                self.publish(event)
+
+    def changelog(self, since: int) -> list:
+        """
+        :return: recorded events after version since, a single reset event
+                 when some of them are already pruned
+        """
+        if not self.db.keeps_changelog:
+            return [ChangeEvent(self.version, time.time(), None)] if since < self.version else []
+
+        with self.db.reader() as cursor:
+            rows = cursor.execute(_CHANGELOG_SQL, (since,)).fetchall()
+            oldest = cursor.execute(_OLDEST_SQL).fetchone()[0]
+
+        # every commit has a row until it is pruned
+        if rows and oldest > since + 1:
+            return [ChangeEvent(rows[-1][0], rows[-1][1], None)]
+        return [
+            ChangeEvent(
+                version,
+                committed_at,
+                json.loads(changes),
+                json.loads(values) if values is not None else None,
+            )
+            for version, committed_at, changes, values in rows
+            if changes != "{}"
+        ]
+
+    def subscribe(self, since: int | None = None) -> Subscription:
+        """
+        :param since: version the watcher has seen, None for the events to come
+        """
+        with self.__lock:
+            subscription = Subscription(self, since)
+            self.__subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.__lock:
+            self.__subscriptions.discard(subscription)
+
+    def close(self):
+        with contextlib.suppress(ValueError):
+            self.db.commit_listeners.remove(self.publish)
@@ -0,0 +1,745 @@
+"""
+CHECK constraints as Python validators: the compiler translates the CHECK
+expressions of every table it can, Plan.bind runs them on the whole value,
+every element of a LIST in one call, before any SQL. SQLite still checks
+the rows it writes.
+
+    expr        := and ("OR" and)*
+    and         := not ("AND" not)*
+    not         := "NOT" not | equality
+    equality    := relation (("=" | "==" | "!=" | "<>") relation
+                   | "IS" ["NOT"] "NULL" | ["NOT"] "IN" "(" literal ("," literal)* ")"
+                   | ["NOT"] "BETWEEN" relation "AND" relation)*
+    relation    := sum (("<" | "<=" | ">" | ">=") sum)*
+    sum         := product (("+" | "-") product)*
+    product     := unary (("*" | "/") unary)*
+    unary       := "-" unary | "+" unary | primary
+    primary     := literal | column | function "(" expr ")" | "(" expr ")"
+    function    := LENGTH | ABS | LOWER | UPPER
+
+a CHECK outside this subset is left to SQLite. The expression is stored in
+the candy as a tree of lists, the validator code is generated from it at
+load:
+
+    ["column", name]  ["literal", value]  ["call", function, arg]
+    ["unary", "-" | "not", arg]  ["binary", op, left, right]
+    ["in", arg, [literal, ...]]  ["is_null", arg]
+
+a validator only rejects a row SQLite would reject. Values are converted
+as the column affinity stores them, and whatever the validator cannot tell
+for sure, a comparison of a number with a text or a column the write
+leaves to its old value, is UNKNOWN: like NULL it passes the check.
+"""
+
+import operator
+import re
+from typing import Callable
+
+from utils import CanfigException
+
+_TOKEN_RE = re.compile(
+    r"""\s*(?:
+        (?P<comment>--[^\n]*|/\*.*?\*/)
+        | (?P<string>'(?:[^']|'')*')
+        | (?P<quoted>"(?:[^"]|"")*"|`[^`]*`|\[[^\]]*\])
+        | (?P<number>0[xX][0-9a-fA-F]+|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+        | (?P<ident>[A-Za-z_][\w$]*)
+        | (?P<op><>|<=|>=|==|!=|\|\||<<|>>|[-+*/%<>=(),;.&|~])
+        | (?P<other>\S)
+    )""",
+    re.VERBOSE | re.DOTALL,
+)
+
+FUNCTIONS = ("LENGTH", "ABS", "LOWER", "UPPER")
+
+_EQUALITY = {"=": "=", "==": "=", "!=": "!=", "<>": "!="}
+_RELATION = ("<", "<=", ">", ">=")
+
+# text SQLite stores as a number in a column of numeric affinity
+_NUMERIC_TEXT_RE = re.compile(r"\s*[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?\s*")
+_INTEGER_TEXT_RE = re.compile(r"\s*[+-]?\d+\s*")
+
+_INT64 = 1 << 63
+
+# values of these types are compared as python compares them
+_PLAIN = (int, str, bytes)
+
+
+class _Unknown:
+    def __repr__(self):
+        return "UNKNOWN"
+
+
+# a value the validator cannot tell, it neither passes nor fails a check
+UNKNOWN = _Unknown()
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def _tokens(sql: str) -> list:
+    """
+    :return: (kind, text, start, end) of the tokens of sql, without comments
+    """
+    ret = []
+    pos = 0
+    sql = sql.rstrip()
+    while pos < len(sql):
+        match = _TOKEN_RE.match(sql, pos)
+        if match.lastgroup != "comment":
+            ret.append((match.lastgroup, match.group(match.lastgroup), match.start(match.lastgroup), match.end()))
+        pos = match.end()
+    return ret
+
+
+def _keyword(token: tuple | None, *words: str) -> bool:
+    return token is not None and token[0] == "ident" and token[1].upper() in words
+
+
+def _literal(token: tuple):
+    kind, text = token[0], token[1]
+    if kind == "string":
+        return text[1:-1].replace("''", "'")
+    if text[:2] in ("0x", "0X"):
+        return int(text, 16)
+    if re.fullmatch(r"\d+", text):
+        return int(text)
+    return float(text)
+
+
+def parse(tokens: list, columns: list) -> list:
+    """
+    :param tokens: tokens of an expression, from _tokens
+    :param columns: columns the expression may read
+    :return: expression tree
+    :raise _Unsupported: for an expression outside the subset
+    """
+    by_name = {c.lower(): c for c in columns}
+    cursor = 0
+
+    def peek(offset: int = 0):
+        return tokens[cursor + offset] if cursor + offset < len(tokens) else None
+
+    def take():
+        nonlocal cursor
+        if (token := peek()) is None:
+            raise _Unsupported("unexpected end of expression")
+        cursor += 1
+        return token
+
+    def expect(text: str):
+        if (token := take())[1] != text:
+            raise _Unsupported(f"expect '{text}' instead of '{token[1]}'")
+
+    def expr() -> list:
+        node = conjunction()
+        while _keyword(peek(), "OR"):
+            take()
+            node = ["binary", "or", node, conjunction()]
+        return node
+
+    def conjunction() -> list:
+        node = negation()
+        while _keyword(peek(), "AND"):
+            take()
+            node = ["binary", "and", node, negation()]
+        return node
+
+    def negation() -> list:
+        if _keyword(peek(), "NOT"):
+            take()
+            return ["unary", "not", negation()]
+        return equality()
+
+    def equality() -> list:
+        node = relation()
+        while (token := peek()) is not None:
+            if token[0] == "op" and token[1] in _EQUALITY:
+                take()
+                node = ["binary", _EQUALITY[token[1]], node, relation()]
+            elif _keyword(token, "IS"):
+                take()
+                negated = _keyword(peek(), "NOT") and take()
+                if not _keyword(take(), "NULL"):
+                    raise _Unsupported("only IS NULL and IS NOT NULL")
+                node = ["is_null", node]
+                node = ["unary", "not", node] if negated else node
+            elif _keyword(token, "IN", "BETWEEN") or (
+                _keyword(token, "NOT") and _keyword(peek(1), "IN", "BETWEEN")
+            ):
+                negated = _keyword(token, "NOT") and take()
+                node = membership(node) if _keyword(take(), "IN") else between(node)
+                node = ["unary", "not", node] if negated else node
+            else:
+                break
+        return node
+
+    def membership(node: list) -> list:
+        expect("(")
+        items = []
+        while True:
+            if (item := unary())[0] != "literal":
+                raise _Unsupported("IN takes a list of literals")
+            items.append(item[1])
+            if (token := take())[1] == ")":
+                return ["in", node, items]
+            if token[1] != ",":
+                raise _Unsupported(f"unexpected '{token[1]}' in IN")
+
+    def between(node: list) -> list:
+        low = relation()
+        if not _keyword(take(), "AND"):
+            raise _Unsupported("expect AND in BETWEEN")
+        high = relation()
+        return ["binary", "and", ["binary", ">=", node, low], ["binary", "<=", node, high]]
+
+    def relation() -> list:
+        node = total()
+        while (token := peek()) is not None and token[0] == "op" and token[1] in _RELATION:
+            take()
+            node = ["binary", token[1], node, total()]
+        return node
+
+    def total() -> list:
+        node = product()
+        while (token := peek()) is not None and token[0] == "op" and token[1] in "+-":
+            take()
+            node = ["binary", token[1], node, product()]
+        return node
+
+    def product() -> list:
+        node = unary()
+        while (token := peek()) is not None and token[0] == "op" and token[1] in ("*", "/"):
+            take()
+            node = ["binary", token[1], node, unary()]
+        return node
+
+    def unary() -> list:
+        if (token := peek()) is not None and token[0] == "op" and token[1] in "+-":
+            take()
+            arg = unary()
+            if token[1] == "+":
+                return arg
+            if arg[0] == "literal" and isinstance(arg[1], (int, float)):
+                return ["literal", -arg[1]]
+            return ["unary", "-", arg]
+        return primary()
+
+    def primary() -> list:
+        kind, text = (token := take())[:2]
+        if kind in ("string", "number"):
+            return ["literal", _literal(token)]
+        if kind == "op" and text == "(":
+            node = expr()
+            expect(")")
+            return node
+        if kind == "quoted":
+            if (column := by_name.get(text[1:-1].lower())) is None:
+                raise _Unsupported(f"unknown column {text}")
+            return ["column", column]
+        if kind == "ident":
+            if (peek() or (None, None))[1] == "(":
+                if text.upper() not in FUNCTIONS:
+                    raise _Unsupported(f"function {text}")
+                take()
+                node = ["call", text.upper(), expr()]
+                expect(")")
+                return node
+            if text.upper() == "NULL":
+                return ["literal", None]
+            if text.upper() in ("TRUE", "FALSE"):
+                return ["literal", int(text.upper() == "TRUE")]
+            if (column := by_name.get(text.lower())) is None:
+                raise _Unsupported(f"unknown column {text}")
+            return ["column", column]
+        raise _Unsupported(f"unexpected '{text}'")
+
+    ret = expr()
+    if cursor != len(tokens):
+        raise _Unsupported(f"unexpected '{tokens[cursor][1]}'")
+    return ret
+
+
+def affinity(declared: str) -> str:
+    """
+    :return: affinity of a column of the declared type, by the rules of SQLite
+    """
+    declared = declared.upper()
+    if "INT" in declared:
+        return "INTEGER"
+    if any(word in declared for word in ("CHAR", "CLOB", "TEXT")):
+        return "TEXT"
+    if not declared or "BLOB" in declared:
+        return "BLOB"
+    if any(word in declared for word in ("REAL", "FLOA", "DOUB")):
+        return "REAL"
+    return "NUMERIC"
+
+
+def literal_default(text: str | None):
+    """
+    :param text: DEFAULT of a column as PRAGMA table_info gives it
+    :return: value of the DEFAULT, UNKNOWN unless it is a literal
+    """
+    if text is None:
+        return None
+    try:
+        node = parse(_tokens(text), [])
+    except _Unsupported:
+        return UNKNOWN
+    return node[1] if node[0] == "literal" else UNKNOWN
+
+
+def _check_clauses(tokens: list) -> list:
+    """
+    :return: (constraint name or None, tokens of the expression) of every
+             CHECK of a CREATE TABLE
+    """
+    ret = []
+    i = 0
+    while i < len(tokens):
+        if _keyword(tokens[i], "CHECK") and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+            name = None
+            if i >= 2 and _keyword(tokens[i - 2], "CONSTRAINT"):
+                name = tokens[i - 1][1].strip('"`[]')
+            depth, j = 0, i + 1
+            while j < len(tokens):
+                depth += {"(": 1, ")": -1}.get(tokens[j][1], 0) if tokens[j][0] == "op" else 0
+                if depth == 0:
+                    break
+                j += 1
+            ret.append((name, tokens[i + 2: j]))
+            i = j
+        i += 1
+    return ret
+
+
+def compile_checks(create_sql: str, table_info: list) -> list:
+    """
+    :param create_sql: CREATE TABLE statement, as sqlite_master keeps it
+    :param table_info: rows of PRAGMA table_info of the table
+    :return: every CHECK of the table in the subset, as stored in the candy:
+             {"name", "columns", "affinity", "defaults", "expr"}
+    """
+    columns = [row[1] for row in table_info]
+    types = {row[1]: row[2] for row in table_info}
+    defaults = {row[1]: literal_default(row[4]) for row in table_info}
+
+    ret = []
+    for name, tokens in _check_clauses(_tokens(create_sql)):
+        if not tokens:
+            continue
+        text = create_sql[tokens[0][2]: tokens[-1][3]].strip()
+        try:
+            expr = parse(tokens, columns)
+        except _Unsupported:
+            # left to SQLite
+            continue
+
+        used = _columns(expr)
+        ret.append(
+            {
+                "name": name or text,
+                "columns": used,
+                "affinity": [affinity(types[c]) for c in used],
+                # a column without a literal DEFAULT is UNKNOWN when left out
+                "defaults": {c: defaults[c] for c in used if defaults[c] is not UNKNOWN},
+                "expr": expr,
+            }
+        )
+    return ret
+
+
+def _columns(node: list, ret: list | None = None) -> list:
+    """
+    :return: columns read by an expression tree, in order of appearance
+    """
+    ret = [] if ret is None else ret
+    kind = node[0]
+    if kind == "column":
+        if node[1] not in ret:
+            ret.append(node[1])
+    elif kind == "call":
+        _columns(node[2], ret)
+    elif kind in ("unary", "binary"):
+        for arg in node[2:]:
+            _columns(arg, ret)
+    elif kind in ("in", "is_null"):
+        _columns(node[1], ret)
+    return ret
+
+
+# values as a column of each affinity stores them
+
+def _kind(v) -> int | None:
+    """
+    :return: storage class of a value, None when it has none
+    """
+    if isinstance(v, (int, float)):
+        return 0 if v == v else None
+    if isinstance(v, str):
+        return 1
+    if isinstance(v, bytes):
+        return 2
+    return None
+
+
+def _numeric_text(v: str, real: bool):
+    if not _NUMERIC_TEXT_RE.fullmatch(v):
+        # kept as a text, SQLite compares it to a number by other rules
+        return UNKNOWN
+    if not real and _INTEGER_TEXT_RE.fullmatch(v):
+        n = int(v)
+        return n if -_INT64 <= n < _INT64 else UNKNOWN
+    n = float(v)
+    if abs(n) >= 1 << 53:
+        # SQLite may round it another way
+        return UNKNOWN
+    return n if real or not n.is_integer() else int(n)
+
+
+def _as_numeric(v):
+    if type(v) is int or v is None or v is UNKNOWN:
+        return v
+    if isinstance(v, int):
+        return int(v)
+    if isinstance(v, float):
+        if v != v:
+            return None
+        return int(v) if v.is_integer() and abs(v) < _INT64 else v
+    if isinstance(v, str):
+        return _numeric_text(v, False)
+    return v if isinstance(v, bytes) else UNKNOWN
+
+
+def _as_real(v):
+    if v is None or v is UNKNOWN:
+        return v
+    if isinstance(v, (int, float)):
+        return float(v) if v == v else None
+    if isinstance(v, str):
+        return _numeric_text(v, True)
+    return v if isinstance(v, bytes) else UNKNOWN
+
+
+def _as_text(v):
+    if type(v) is str or v is None or v is UNKNOWN or isinstance(v, bytes):
+        return v
+    if isinstance(v, int):
+        return str(int(v))
+    # a float is written as SQLite formats it
+    return UNKNOWN
+
+
+def _as_blob(v):
+    if v is None or v is UNKNOWN or isinstance(v, (str, bytes)):
+        return v
+    if isinstance(v, int):
+        return int(v)
+    if isinstance(v, float):
+        return v if v == v else None
+    return UNKNOWN
+
+
+_AFFINITY = {
+    "INTEGER": "_as_numeric",
+    "NUMERIC": "_as_numeric",
+    "REAL": "_as_real",
+    "TEXT": "_as_text",
+    "BLOB": "_as_blob",
+}
+
+
+def stored(aff: str, v):
+    """
+    :param aff: affinity of the column, from affinity()
+    :return: v as a column of this affinity stores it, UNKNOWN when the
+             validator cannot tell
+    """
+    return _HELPERS[_AFFINITY[aff]](v)
+
+
+# operators of three valued logic, a NULL or UNKNOWN operand gives NULL or
+# UNKNOWN unless the result does not depend on it
+
+def _compare(op: Callable) -> Callable:
+    def compare(a, b):
+        if type(a) is type(b) and type(a) in _PLAIN:
+            return op(a, b)
+        if a is UNKNOWN or b is UNKNOWN:
+            return UNKNOWN
+        if a is None or b is None:
+            return None
+        if (kind := _kind(a)) is None or kind != _kind(b):
+            # SQLite may convert one of them first
+            return UNKNOWN
+        return op(a, b)
+
+    return compare
+
+
+def _arithmetic(op: Callable) -> Callable:
+    def arithmetic(a, b):
+        if type(a) is float and type(b) is float:
+            return op(a, b)
+        if a is UNKNOWN or b is UNKNOWN:
+            return UNKNOWN
+        if a is None or b is None:
+            return None
+        if _kind(a) != 0 or _kind(b) != 0:
+            return UNKNOWN
+        ret = op(a, b)
+        return ret if not isinstance(ret, int) or -_INT64 <= ret < _INT64 else UNKNOWN
+
+    return arithmetic
+
+
+def _divide(a, b):
+    if b == 0:
+        return None
+    if isinstance(a, int) and isinstance(b, int):
+        quotient = abs(a) // abs(b)
+        return quotient if (a < 0) == (b < 0) else -quotient
+    return a / b
+
+
+def _neg(a):
+    if a is None or a is UNKNOWN:
+        return a
+    return -a if _kind(a) == 0 else UNKNOWN
+
+
+def _truth(v):
+    if v is None or v is UNKNOWN or isinstance(v, bool):
+        return v
+    if _kind(v) == 0:
+        return v != 0
+    # a text is converted to a number first
+    return UNKNOWN
+
+
+def _not(v):
+    return not v if isinstance(v, bool) else v
+
+
+def _and(a, b):
+    if a is False or b is False:
+        return False
+    if a is True and b is True:
+        return True
+    return UNKNOWN if a is UNKNOWN or b is UNKNOWN else None
+
+
+def _or(a, b):
+    if a is True or b is True:
+        return True
+    if a is False and b is False:
+        return False
+    return UNKNOWN if a is UNKNOWN or b is UNKNOWN else None
+
+
+def _in(a, items: tuple):
+    if a is UNKNOWN or a is None:
+        return a if items else False
+    if (kind := _kind(a)) is None:
+        return UNKNOWN
+    ret = False
+    for item in items:
+        if item is None:
+            ret = None if ret is False else ret
+        elif _kind(item) != kind:
+            ret = UNKNOWN
+        elif item == a:
+            return True
+    return ret
+
+
+def _is_null(a):
+    return a if a is UNKNOWN else a is None
+
+
+def _scalar(fn: Callable, kinds: tuple) -> Callable:
+    def scalar(a):
+        if type(a) is str and 1 in kinds:
+            return fn(a)
+        if a is None or a is UNKNOWN:
+            return a
+        return fn(a) if _kind(a) in kinds else UNKNOWN
+
+    return scalar
+
+
+def _length(a):
+    if isinstance(a, int):
+        return len(str(a))
+    if isinstance(a, float):
+        return UNKNOWN
+    return len(a)
+
+
+def _ascii(fn: Callable) -> Callable:
+    # SQLite only folds the case of ASCII letters
+    return lambda a: fn(a) if a.isascii() else UNKNOWN
+
+
+_HELPERS = {
+    "_as_numeric": _as_numeric,
+    "_as_real": _as_real,
+    "_as_text": _as_text,
+    "_as_blob": _as_blob,
+    "_truth": _truth,
+    "_not": _not,
+    "_and": _and,
+    "_or": _or,
+    "_in": _in,
+    "_is_null": _is_null,
+    "_neg": _neg,
+    "_length": _scalar(_length, (0, 1, 2)),
+    "_abs": _scalar(abs, (0,)),
+    "_lower": _scalar(_ascii(str.lower), (1,)),
+    "_upper": _scalar(_ascii(str.upper), (1,)),
+}
+
+_BINARY = {
+    "and": "_and",
+    "or": "_or",
+    "=": "_eq",
+    "!=": "_ne",
+    "<": "_lt",
+    "<=": "_le",
+    ">": "_gt",
+    ">=": "_ge",
+    "+": "_add",
+    "-": "_sub",
+    "*": "_mul",
+    "/": "_div",
+}
+_HELPERS.update(
+    _eq=_compare(operator.eq),
+    _ne=_compare(operator.ne),
+    _lt=_compare(operator.lt),
+    _le=_compare(operator.le),
+    _gt=_compare(operator.gt),
+    _ge=_compare(operator.ge),
+    _add=_arithmetic(operator.add),
+    _sub=_arithmetic(operator.sub),
+    _mul=_arithmetic(operator.mul),
+    _div=_arithmetic(_divide),
+)
+
+# nodes giving a truth value, the others are converted by _truth
+_LOGICAL = ("and", "or", "=", "!=", "<", "<=", ">", ">=")
+
+
+def _is_logical(node: list) -> bool:
+    return (
+        node[0] in ("in", "is_null")
+        or node[0] == "unary" and node[1] == "not"
+        or node[0] == "binary" and node[1] in _LOGICAL
+    )
+
+
+def _source(node: list, names: dict) -> str:
+    """
+    :return: python expression of an expression tree, names maps a column to
+             its local variable
+    """
+    kind = node[0]
+    if kind == "column":
+        return names[node[1]]
+    if kind == "literal":
+        return repr(_checked_literal(node[1]))
+    if kind == "call":
+        if node[1] not in FUNCTIONS:
+            raise CanfigException(f"invalid CHECK function {node[1]}")
+        return f"_{node[1].lower()}({_source(node[2], names)})"
+    if kind == "unary":
+        if node[1] == "not":
+            return f"_not({_condition(node[2], names)})"
+        return f"_neg({_source(node[2], names)})"
+    if kind == "binary":
+        if node[1] in ("and", "or"):
+            args = (_condition(node[2], names), _condition(node[3], names))
+        else:
+            args = (_source(node[2], names), _source(node[3], names))
+        return f"{_BINARY[node[1]]}({args[0]}, {args[1]})"
+    if kind == "in":
+        items = tuple(_checked_literal(item) for item in node[2])
+        return f"_in({_source(node[1], names)}, {items!r})"
+    if kind == "is_null":
+        return f"_is_null({_source(node[1], names)})"
+    raise CanfigException(f"invalid CHECK expression node {kind}")
+
+
+def _condition(node: list, names: dict) -> str:
+    source = _source(node, names)
+    return source if _is_logical(node) else f"_truth({source})"
+
+
+def _checked_literal(value):
+    if value is not None and type(value) not in (int, float, str):
+        raise CanfigException(f"invalid CHECK literal {value!r}")
+    return value
+
+
+def validator(check: dict) -> Callable:
+    """
+    :param check: a CHECK from compile_checks
+    :return: function of a list of row dicts and the value of every column
+             left out of a row, to the index of the first row failing the
+             check or -1
+
+    the function loops over the rows, converting and checking one row at a
+    time: taking a column over the whole list first makes the same helper
+    calls, and the loop stops at the first failing row
+    """
+    names = {column: f"c{i}" for i, column in enumerate(check["columns"])}
+    fills = "".join(f", f{i}" for i in range(len(names)))
+    convert = "".join(
+        f"        c{i} = {_AFFINITY[aff]}(row.get({column!r}, f{i}))\n"
+        for i, (column, aff) in enumerate(zip(names, check["affinity"]))
+    )
+    source = (
+        f"def check(rows{fills}):\n"
+        "    for i, row in enumerate(rows):\n"
+        f"{convert}"
+        f"        if {_condition(check['expr'], names)} is False:\n"
+        "            return i\n"
+        "    return -1\n"
+    )
+    namespace = dict(_HELPERS)
+    exec(compile(source, f"<CHECK {check['name']}>", "exec"), namespace)
+    return namespace["check"]
+
+
+class Checks:
+    """
+    validators of the CHECKs a field is written under
+    """
+
+    def __init__(self, checks: list):
+        """
+        :param checks: CHECKs from compile_checks
+        """
+        self.__checks = [
+            (check["name"], tuple(check["columns"]), check["defaults"], validator(check))
+            for check in checks
+        ]
+
+    def __bool__(self):
+        return bool(self.__checks)
+
+    def validate(self, field_dir: str, rows: list, defaults: bool = True, is_list: bool = False):
+        """
+        :param rows: dicts of the rows to write
+        :param defaults: a column left out takes its DEFAULT, else it keeps a
+                         value the validator does not know
+        :param is_list: rows are the elements of a LIST
+        :raise CanfigException: on the first row failing a CHECK
+        """
+        for name, columns, column_defaults, check in self.__checks:
+            fills = [column_defaults.get(c, UNKNOWN) if defaults else UNKNOWN for c in columns]
+            if (i := check(rows, *fills)) >= 0:
+                where = f"element {i} of {field_dir}" if is_list else field_dir
+                raise CanfigException(f"CHECK constraint failed: {name}, {where} is {rows[i]}")
@@ -8,6 +8,7 @@ type token =
   | LOG
   | DOC
   | HELP
+  | STORAGE
   | SEMI
 
   | STRING of string
@@ -9,6 +9,7 @@ class TokenType(Enum):
     LOG = auto()
     DOC = auto()
     HELP = auto()
+    STORAGE = auto()
     SEMI = auto()
     STRING = auto()
     IDENT = auto()
@@ -35,6 +36,7 @@ class TagTokenType(Enum):
     LOG = auto()
     DOC = auto()
     HELP = auto()
+    STORAGE = auto()
 
 
 class Token:
@@ -0,0 +1,114 @@
+"""
+Per declaration cache of parse results and of what is derived from them,
+so a recompile only lex, parse and resolve the top level declarations that
+changed.
+"""
+
+import os
+import marshal
+import hashlib
+import tempfile
+
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CANFIG_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "canfig")
+)
+
+CACHE_FORMAT = 3
+
+
+class DeclarationCache:
+    """
+    parse fragments of one source, keyed by the hash of the declaration text,
+    and the compile results derived from a declaration, e.g. the columns of
+    a table, keyed by the hash of the text they are derived from
+    """
+
+    def __init__(self, cache_dir: str, name: str):
+        """
+        :param cache_dir: directory holding the cache files
+        :param name: identity of the source, usually its absolute path
+        """
+        self.cache_file = os.path.join(
+            cache_dir, hashlib.sha1(name.encode()).hexdigest() + ".cache"
+        )
+
+        self.hits = 0
+        self.misses = 0
+
+        self.__entries: dict = {}
+        self.__used: dict = {}
+        self.__derived: dict = {}
+        self.__derived_used: dict = {}
+        self.__derived_missed = False
+
+        try:
+            with open(self.cache_file, "rb") as f:
+                data = marshal.loads(f.read())
+            if data["format"] == CACHE_FORMAT:
+                self.__entries = data["decls"]
+                self.__derived = data["derived"]
+        except (OSError, ValueError, EOFError, TypeError, KeyError):
+            pass
+
+    @staticmethod
+    def key(decl: str) -> str:
+        return hashlib.sha1(decl.encode(), usedforsecurity=False).hexdigest()
+
+    def get(self, key: str) -> dict | None:
+        if (fragment := self.__entries.get(key)) is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.__used[key] = fragment
+        return fragment
+
+    def put(self, key: str, fragment: dict):
+        self.__used[key] = fragment
+
+    def get_derived(self, kind: str, text: str):
+        """
+        :param kind: what is derived, results of different kinds never mix
+        :param text: what the result is derived from
+        :return: the cached result, None if there is none
+        """
+        key = self.key(f"{kind}:{text}")
+        if (value := self.__derived.get(key)) is None:
+            self.__derived_missed = True
+            return None
+
+        self.__derived_used[key] = value
+        return value
+
+    def put_derived(self, kind: str, text: str, value):
+        """
+        :param value: a result marshal can write, never None
+        """
+        self.__derived_used[self.key(f"{kind}:{text}")] = value
+
+    def save(self):
+        # only keep the fragments of the latest compile
+        if (
+            self.misses == 0
+            and not self.__derived_missed
+            and self.__used.keys() == self.__entries.keys()
+            and self.__derived_used.keys() == self.__derived.keys()
+        ):
+            return
+
+        cache_dir = os.path.dirname(self.cache_file)
+        os.makedirs(cache_dir, exist_ok=True)
+        # a unique temp file, threads of one process save concurrently
+        with tempfile.NamedTemporaryFile(
+            "wb", dir=cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            f.write(
+                marshal.dumps(
+                    {
+                        "format": CACHE_FORMAT,
+                        "decls": self.__used,
+                        "derived": self.__derived_used,
+                    }
+                )
+            )
+        os.replace(f.name, self.cache_file)
@@ -5,30 +5,26 @@ In the future, I'll put the parsing and evaluating process in OCaml
 
 """
 
-import sys
 import os
-import subprocess
-from typing import List
-import re
-import pickle
+import sys
+import time
 import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
+import candy
 from common import Token, TokenType, TagTokenType
+from storage import STORAGE_PROFILES
+from compile_cache import DeclarationCache, DEFAULT_CACHE_DIR
+from dependency import trigger_index
+from lexer import lex, split_declarations
+from migration import schema_fingerprint
+from schema import resolve_schema
+from slices import compile_slices
 from utils import *
 
-from transitions import Machine
 from enum import Enum, auto
 
-BUF_SIZE = 65536  # file read buf
-md5 = hashlib.md5()
-
-# parse result
-meta_data: dict = {}
-sql_query: list = []
-triggers: list = []
-slices: list = []
-
-
 class HandleFlag(Enum):
     STRUCT = auto()
     CONFIG = auto()
@@ -37,95 +33,179 @@ class HandleFlag(Enum):
     NONE = auto()
 
 
-class Parser(object):
-    states = (
-        [token._name_ for token in TokenType]
-        + ["start", "error"]
-        + ["do_push_kv", "do_sql", "do_pre_sql", "do_slice"]
-    )
-
-    def __init__(self):
-        self.kv_prev_state = ""
-        self.state_buffer = ""
-
-        self.ident_buffer = ""
-        self.arg_buffer = ""
-
-        self.err_msg = ""
-
-        self.cur_handling = HandleFlag.NONE
+def _transition_spec(states: list) -> list:
+    """
+    ordered transition rules of the parser, for the same (source, trigger)
+    the rule registered first wins
 
-        self.machine = Machine(model=self, states=Parser.states, initial="start")
+    :param states: all parser states
+    :return: list of rules in `Machine.add_transition` keyword form
+    """
+    spec = []
 
-        # start state -> *
-        for state in self.states:
-            self.machine.add_transition(trigger=state, source="start", dest=state)
+    # start state -> *
+    for state in states:
+        spec.append(dict(trigger=state, source="start", dest=state))
 
-        # next command
-        self.machine.add_transition(trigger="SEMI", source="*", dest="start")
+    # next command
+    spec.append(dict(trigger="SEMI", source="*", dest="start"))
 
-        # tag token handling
-        for tag_state in [token._name_ for token in TagTokenType]:
-            self.machine.add_transition(
+    # tag token handling
+    for tag_state in [token._name_ for token in TagTokenType]:
+        spec.append(
+            dict(
                 trigger="STRING",
                 source=tag_state,
                 dest="do_push_kv",
                 before="push_kv",
                 after="push_kv",
             )
-
-        # struct handling
-        self.machine.add_transition(
-            trigger="IDENT", source="STRUCT", dest="IDENT", after="struct_handler"
         )
-        self.machine.add_transition(
-            trigger="IDENT", source="IDENT", dest="IDENT", after="edge_case_handler"
-        )  # edge case
 
-        # argument handling
-        self.machine.add_transition(
-            trigger="ARGUMENT", source="IDENT", dest="ARGUMENT", after="arg_handler"
-        )
+    # struct handling
+    spec.append(
+        dict(trigger="IDENT", source="STRUCT", dest="IDENT", after="struct_handler")
+    )
+    spec.append(
+        dict(trigger="IDENT", source="IDENT", dest="IDENT", after="edge_case_handler")
+    )  # edge case
 
-        # config handling
-        self.machine.add_transition(
-            trigger="IDENT", source="CONFIG", dest="IDENT", after="config_handler"
-        )
+    # argument handling
+    spec.append(
+        dict(trigger="ARGUMENT", source="IDENT", dest="ARGUMENT", after="arg_handler")
+    )
 
-        # trigger handling
-        self.machine.add_transition(
-            trigger="IDENT", source="TRIGGER", dest="IDENT", after="trigger_handler"
-        )
-        self.machine.add_transition(trigger="TRICOND", source="IDENT", dest="TRICOND")
-        self.machine.add_transition(
-            trigger="IDENT", source="TRICOND", dest="IDENT", before="trigger_handler"
-        )
+    # config handling
+    spec.append(
+        dict(trigger="IDENT", source="CONFIG", dest="IDENT", after="config_handler")
+    )
 
-        # slice handling
-        self.machine.add_transition(
-            trigger="IDENT", source="SLICE", dest="IDENT", after="slice_handler"
-        )
+    # trigger handling
+    spec.append(
+        dict(trigger="IDENT", source="TRIGGER", dest="IDENT", after="trigger_handler")
+    )
+    spec.append(dict(trigger="TRICOND", source="IDENT", dest="TRICOND"))
+    spec.append(
+        dict(trigger="IDENT", source="TRICOND", dest="IDENT", before="trigger_handler")
+    )
 
-        # command handling
-        self.machine.add_transition(
-            trigger="COMMAND", source="IDENT", dest="COMMAND", before="command_handler"
-        )
-        self.machine.add_transition(
+    # slice handling
+    spec.append(
+        dict(trigger="IDENT", source="SLICE", dest="IDENT", after="slice_handler")
+    )
+
+    # command handling
+    spec.append(
+        dict(trigger="COMMAND", source="IDENT", dest="COMMAND", before="command_handler")
+    )
+    spec.append(
+        dict(
             trigger="COMMAND",
             source="ARGUMENT",
             dest="COMMAND",
             before="command_handler",
         )
+    )
 
-        # reject all unexpected state
-        for state in self.states:
-            self.machine.add_transition(
-                trigger=state, source="*", dest="error", before="raise_err"
-            )
+    # reject all unexpected state
+    for state in states:
+        spec.append(dict(trigger=state, source="*", dest="error", before="raise_err"))
+
+    spec.append(dict(trigger="ERROR", source="*", dest="error", before="raise_err"))
+
+    return spec
+
+
+def _dispatch_table(cls) -> dict:
+    """
+    resolve the transition rules into (state, TokenType) -> (dest, before, after)
+    once, callbacks are resolved to plain functions of `cls`
+    """
+    table = {}
+
+    for rule in cls.transitions:
+        if rule["trigger"] not in TokenType.__members__:
+            continue
+
+        token_type = TokenType[rule["trigger"]]
+        sources = cls.states if rule["source"] == "*" else [rule["source"]]
+        before = getattr(cls, rule["before"]) if "before" in rule else None
+        after = getattr(cls, rule["after"]) if "after" in rule else None
+
+        for source in sources:
+            table.setdefault((source, token_type), (rule["dest"], before, after))
+
+    return table
 
-        self.machine.add_transition(
-            trigger="ERROR", source="*", dest="error", before="raise_err"
-        )
+
+class Parser(object):
+    states = (
+        [token._name_ for token in TokenType]
+        + ["start", "error"]
+        + ["do_push_kv", "do_sql", "do_pre_sql", "do_slice"]
+    )
+
+    transitions = _transition_spec(states)
+
+    # (state, TokenType) -> (dest, before, after), filled after class creation
+    dispatch: dict = {}
+
+    def __init__(self):
+        self.state = "start"
+
+        self.kv_prev_state = ""
+        self.state_buffer = ""
+
+        self.ident_buffer = ""
+        self.arg_buffer = ""
+
+        self.err_msg = ""
+
+        self.cur_handling = HandleFlag.NONE
+
+        # parse result
+        self.meta_data: dict = {}
+        self.sql_query: list = []
+        self.triggers: list = []
+        self.slices: list = []
+
+    def feed(self, token: Token):
+        if token.value is not None:
+            self.state_buffer = token.value
+
+        dest, before, after = self.dispatch[(self.state, token.type)]
+
+        if before is not None:
+            before(self)
+        self.state = dest
+        if after is not None:
+            after(self)
+
+    def ERROR(self):
+        self.raise_err()
+
+    def save_state(self) -> list:
+        return [
+            self.state,
+            self.kv_prev_state,
+            self.state_buffer,
+            self.ident_buffer,
+            self.arg_buffer,
+            self.err_msg,
+            self.cur_handling.name,
+        ]
+
+    def load_state(self, saved: list):
+        (
+            self.state,
+            self.kv_prev_state,
+            self.state_buffer,
+            self.ident_buffer,
+            self.arg_buffer,
+            self.err_msg,
+            cur_handling,
+        ) = saved
+        self.cur_handling = HandleFlag[cur_handling]
 
     def slice_handler(self):
         self.cur_handling = HandleFlag.SLICE
@@ -164,7 +244,7 @@ class Parser(object):
             self.err_msg = "identifier cannot follow identifier"
             self.ERROR()
         else:
-            sql_query.append(
+            self.sql_query.append(
                 {
                     "name": self.ident_buffer,
                     "sql": f"{self.ident_buffer} {self.state_buffer}",
@@ -180,7 +260,7 @@ class Parser(object):
             self.ERROR()
 
         elif self.cur_handling == HandleFlag.STRUCT and self.state == "IDENT":
-            sql_query.append(
+            self.sql_query.append(
                 {
                     "name": self.ident_buffer,
                     "sql": self.state_buffer,
@@ -190,7 +270,7 @@ class Parser(object):
             )
 
         elif self.cur_handling == HandleFlag.STRUCT and self.state == "ARGUMENT":
-            sql_query.append(
+            self.sql_query.append(
                 {
                     "name": self.ident_buffer,
                     "sql": self.state_buffer,
@@ -201,7 +281,7 @@ class Parser(object):
             )
 
         elif self.cur_handling == HandleFlag.CONFIG:
-            sql_query.append(
+            self.sql_query.append(
                 {
                     "name": self.ident_buffer,
                     "sql": self.state_buffer,
@@ -212,12 +292,12 @@ class Parser(object):
 
         elif self.cur_handling == HandleFlag.TRIGGER:
             name, condition = self.ident_buffer.split("|")
-            triggers.append(
+            self.triggers.append(
                 {"name": name, "condition": condition, "cmd": self.state_buffer}
             )
 
         elif self.cur_handling == HandleFlag.SLICE:
-            slices.append({"name": self.ident_buffer, "cmd": self.state_buffer})
+            self.slices.append({"name": self.ident_buffer, "cmd": self.state_buffer})
         else:
             self.ERROR()
 
@@ -231,106 +311,344 @@ class Parser(object):
             self.kv_prev_state = self.state
         else:
             assert self.kv_prev_state != ""
-            meta_data[self.kv_prev_state] = self.state_buffer
+            self.meta_data[self.kv_prev_state] = self.state_buffer
             self.kv_prev_state = ""
 
     def update_str_buffer(self, buf):
         self.state_buffer = buf
 
     def raise_err(self):
-        raise Exception(f"parse error in state {self.state}! {self.err_msg}")
+        raise CanfigException(f"parse error in state {self.state}! {self.err_msg}")
+
+
+Parser.dispatch = _dispatch_table(Parser)
+
+
+class CompiledPlan:
+    """
+    self-contained result of compiling one .cand source
+    """
+
+    def __init__(
+        self,
+        md5: str,
+        meta_data: dict,
+        sql_query: list,
+        triggers: list,
+        slices: list,
+        cache: DeclarationCache | None = None,
+    ):
+        """
+        :param cache: DeclarationCache, what is derived from an unchanged
+                      declaration is taken from it instead of computed again
+        """
+        self.md5 = md5
+        self.meta_data = meta_data
+        self.sql_query = sql_query
+
+        if (profile := meta_data.get("STORAGE")) is not None and profile not in STORAGE_PROFILES:
+            raise CanfigException(
+                f"@storage '{profile}' not exist, use one of {list(STORAGE_PROFILES)}"
+            )
+
+        # a trigger body that is not valid python fails the compile, the code
+        # itself is compiled again from the source at load, never shipped
+        for trigger in triggers:
+            self.__check_trigger(trigger, cache)
+        self.triggers = triggers
+
+        # final schema, resolved once here instead of at every evaluator start
+        self.tables, self.fields = resolve_schema(
+            [p for p in sql_query if p["type"] == "STRUCT"],
+            [p for p in sql_query if p["type"] == "CONFIG"],
+            cache,
+        )
+        self.schema = {"fingerprint": schema_fingerprint(self.tables)}
+
+        # field -> triggers reading it
+        self.trigger_index = trigger_index(self.triggers, self.fields, cache)
+
+        # every slice as a bitmap over the field index
+        self.field_index, self.slices = compile_slices(slices, self.fields)
+
+    @staticmethod
+    def __check_trigger(trigger: dict, cache: DeclarationCache | None):
+        # what is valid python depends on the python, told by the cache tag
+        text = f"{sys.implementation.cache_tag}:{trigger['name']}:{trigger['cmd']}"
+        if cache is not None and cache.get_derived("trigger", text):
+            return
+        compile_trigger(trigger["name"], trigger["cmd"])
+        if cache is not None:
+            cache.put_derived("trigger", text, True)
+
+    def to_dict(self) -> dict:
+        return {
+            "md5": self.md5,
+            "meta_data": self.meta_data,
+            "sql_query": self.sql_query,
+            "triggers": self.triggers,
+            "slices": self.slices,
+            "tables": self.tables,
+            "fields": self.fields,
+            "schema": self.schema,
+            "trigger_index": self.trigger_index,
+            "field_index": self.field_index,
+        }
+
+    def sections(self) -> dict:
+        """
+        :return: section name -> value, as the candy stores them
+        """
+        return {
+            "meta_data": self.meta_data,
+            "structs": [p for p in self.sql_query if p["type"] == "STRUCT"],
+            "configs": [p for p in self.sql_query if p["type"] == "CONFIG"],
+            "triggers": self.triggers,
+            # a bitmap is read back padded, the zero bytes it ends with
+            # are left out
+            "slices": [{**s, "bitmap": s["bitmap"].rstrip(b"\0")} for s in self.slices],
+            "tables": self.tables,
+            # the field index is not stored, slices.index_fields gives it
+            # back from the fields
+            "fields": self.fields,
+            "schema": self.schema,
+            "trigger_index": self.trigger_index,
+        }
+
+    def dump(self, cplan_file: str):
+        candy.dump(cplan_file, self.md5, self.sections())
+
+    def __str__(self):
+        return (
+            f"meta data: {len(self.meta_data)}, struct/config: {len(self.sql_query)}, "
+            f"trigger: {len(self.triggers)}, slice: {len(self.slices)}, "
+            f"table: {len(self.tables)}"
+        )
 
 
-def lexing(from_file, to_file):
-    if not check_file_exists("ast"):
-        if not check_command_installed("make"):
-            raise Exception("'make' not installed.")
-        if not check_command_installed("ocamlc"):
-            raise Exception("'ocamlc' not installed.")
+def _parse_incremental(source: str, cache: DeclarationCache) -> Parser:
+    """
+    parse declaration by declaration, reuse the cached fragment of every
+    declaration whose text is unchanged
+
+    every declaration is parsed from the start state, one that does not end
+    in it is left to the full compile to report
+    """
+    result = Parser()
+
+    for decl in split_declarations(source):
+        key = cache.key(decl)
+
+        if (fragment := cache.get(key)) is None:
+            parser = Parser()
+            for token in lex(decl):
+                parser.feed(token)
+            if parser.state != "start":
+                raise CanfigException("declaration does not end in the start state")
+
+            fragment = {
+                "meta_data": parser.meta_data,
+                "sql_query": parser.sql_query,
+                "triggers": parser.triggers,
+                "slices": parser.slices,
+            }
+            cache.put(key, fragment)
+
+        result.meta_data.update(fragment["meta_data"])
+        result.sql_query.extend(fragment["sql_query"])
+        result.triggers.extend(fragment["triggers"])
+        result.slices.extend(fragment["slices"])
+
+    return result
+
+
+def compile_source(
+    source: str | bytes | None = None,
+    *,
+    path: str | None = None,
+    cache_dir: str | None = None,
+    cache_name: str | None = None,
+) -> CompiledPlan:
+    """
+    compile a Canfig definition, safe to call from many threads at once
+
+    :param source: content of a .cand file
+    :param path: path of a .cand file, used when source is not given
+    :param cache_dir: directory of the per declaration cache, None to disable
+    :param cache_name: identity of the source in the cache, defaults to the
+                       absolute path, a source given as text is only cached
+                       when it is named
+    """
+    assert (source is None) != (path is None), "give either source or path"
+
+    if path is not None:
+        with open(path, "rb") as f:
+            source = f.read()
+
+    if isinstance(source, str):
+        source = source.encode()
+
+    if cache_name is None and path is not None:
+        cache_name = os.path.abspath(path)
+
+    parser = None
+    cache = None
+    if cache_dir is not None and cache_name is not None:
+        cache = DeclarationCache(cache_dir, cache_name)
+        try:
+            parser = _parse_incremental(source.decode(), cache)
+        except CanfigException:
+            # compile again from scratch to report the error with its real position
+            parser = cache = None
+
+    if parser is None:
+        # lexing & parsing, tokens are streamed from the lexer to the parser
+        parser = Parser()
+        for token in lex(source.decode()):
+            # print(parser.state, "   ", parser.cur_handling)
+            parser.feed(token)
+
+    cplan = CompiledPlan(
+        md5=hashlib.md5(source).hexdigest(),
+        meta_data=parser.meta_data,
+        sql_query=parser.sql_query,
+        triggers=parser.triggers,
+        slices=parser.slices,
+        cache=cache,
+    )
+    if cache is not None:
+        cache.save()
+    return cplan
 
-        subprocess.run(["make", "exe"])
 
-    ret = subprocess.run(["./ast", from_file, "-o", to_file])
-    if ret.returncode != 0:
-        raise Exception("lexing fails.")
-    print("lexing done.")
+def candy_path(input_file: str) -> str:
+    return os.path.splitext(input_file)[0] + ".candy"
 
 
-def tokenize(from_file) -> List[Token]:
-    def process_str_token(str_token):
-        pre_token = re.match(r"^([A-Z_]+)(?:\((.*)\))?$", str_token, re.DOTALL).groups()
+def compile_file(
+    input_file: str, force: bool = False, cache_dir: str | None = None
+) -> tuple[str, bool]:
+    """
+    compile input_file to the .candy next to it, skip when the candy is fresh
 
-        if pre_token[1] is None:
-            return Token(getattr(TokenType, pre_token[0]))
+    :return: (candy file, whether it is recompiled)
+    """
+    if not check_file_exists(input_file):
+        raise FileNotFoundError(f"'{input_file}' no found.")
 
-        return Token(getattr(TokenType, pre_token[0]), pre_token[1])
+    with open(input_file, "rb") as f:
+        source = f.read()
+
+    cplan_file = candy_path(input_file)
+    if not force and candy.read_md5(cplan_file) == hashlib.md5(source).hexdigest():
+        return cplan_file, False
+
+    # compiled from the bytes hashed above, an edit made meanwhile leaves the
+    # candy stale instead of recording the md5 of another version
+    compile_source(
+        source, cache_dir=cache_dir, cache_name=os.path.abspath(input_file)
+    ).dump(cplan_file)
+    return cplan_file, True
+
+
+def _compile_job(input_file: str, force: bool, cache_dir: str | None) -> tuple:
+    start = time.perf_counter()
+    try:
+        _, compiled = compile_file(input_file, force, cache_dir)
+        status, err = ("compiled" if compiled else "fresh"), None
+    except Exception as e:
+        status, err = "failed", str(e)
+    return input_file, status, time.perf_counter() - start, err
+
+
+def compile_many(
+    directory: str,
+    jobs: int | None = None,
+    force: bool = False,
+    cache_dir: str | None = None,
+) -> int:
+    """
+    compile every .cand file under directory over a process pool
+
+    :return: number of failed files
+    """
+    input_files = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.endswith(".cand")
+    )
 
-    with open(from_file, "r") as fptr:
-        _tokens = fptr.read().split("[_!]")
-        _tokens = list(map(process_str_token, _tokens))
+    start = time.perf_counter()
+    failed = 0
+    busy = 0.0
 
-        print(f"processing {len(_tokens)} tokens.")
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_compile_job, f, force, cache_dir) for f in input_files]
+        for future in as_completed(futures):
+            input_file, status, elapsed, err = future.result()
+            busy += elapsed
+            print(f"{status:>8} {elapsed * 1000:>9.2f}ms  {input_file}")
+            if err is not None:
+                failed += 1
+                print(f"         {err}")
 
-        return _tokens
+    print(
+        f"{len(input_files)} file(s), {failed} failed, "
+        f"{busy * 1000:.2f}ms compile time, {(time.perf_counter() - start) * 1000:.2f}ms wall"
+    )
+    return failed
+
+
+def _add_cache_args(arg_parser: argparse.ArgumentParser):
+    arg_parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="per declaration cache directory (env CANFIG_CACHE_DIR)",
+    )
+    arg_parser.add_argument("--no-cache", action="store_true")
 
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print(f"Usage: {sys.argv[0]} <input_file>")
-        exit(1)
+    if len(sys.argv) >= 2 and sys.argv[1] == "compile-many":
+        arg_parser = argparse.ArgumentParser(prog=f"{sys.argv[0]} compile-many")
+        arg_parser.add_argument("directory")
+        arg_parser.add_argument("-j", "--jobs", type=int, default=None)
+        arg_parser.add_argument("-f", "--force", action="store_true")
+        _add_cache_args(arg_parser)
+        args = arg_parser.parse_args(sys.argv[2:])
+
+        cache_dir = None if args.no_cache else args.cache_dir
+        exit(1 if compile_many(args.directory, args.jobs, args.force, cache_dir) else 0)
+
+    arg_parser = argparse.ArgumentParser(
+        epilog=f"batch mode: {sys.argv[0]} compile-many <directory> [-j JOBS] [-f]"
+    )
+    arg_parser.add_argument("input_file")
+    _add_cache_args(arg_parser)
+    args = arg_parser.parse_args()
 
-    if not check_file_exists(input_file := sys.argv[1]):
+    if not check_file_exists(input_file := args.input_file):
         raise FileNotFoundError(f"'{input_file}' no found.")
 
     with open(input_file, "rb") as f:
-        while True:
-            data = f.read(BUF_SIZE)
-            if not data:
-                break
-            md5.update(data)
+        source = f.read()
 
     # try to load candy
-    if check_file_exists(cplan_file := input_file.split(".")[0] + ".candy"):
-        try:
-            with open(cplan_file, "rb") as f:
-                cdata = pickle.load(f)
-
-            if md5.hexdigest() == cdata["md5"]:
-                print(f"find fresh candy '{cplan_file}'! No need to compile")
-                exit(0)
-            else:
-                print(f"candy '{cplan_file}' find but out of date, recompile...")
-        except Exception as e:
-            print(f"candy '{cplan_file}' find but fail to load: {str(e)}, recompile...")
-
-    # lexing
-    lexing(input_file, input_file.split(".")[0])
-    tokens = tokenize(cando_file := input_file.split(".")[0] + ".cando")
-    subprocess.run(["rm", cando_file])
-
-    # parsing
-    parser = Parser()
-    for token in tokens:
-        # print(parser.state, "   ", parser.cur_handling)
-        if token.value is not None:
-            parser.update_str_buffer(token.value)
-        getattr(parser, token.type._name_)()
+    if (cdata_md5 := candy.read_md5(cplan_file := candy_path(input_file))) is not None:
+        if hashlib.md5(source).hexdigest() == cdata_md5:
+            print(f"find fresh candy '{cplan_file}'! No need to compile")
+            exit(0)
+        else:
+            print(f"candy '{cplan_file}' find but out of date, recompile...")
 
-    print("parsing done.")
-    print(
-        f"meta data: {len(meta_data)}, struct/config: {len(sql_query)}, trigger: {len(triggers)}, slice: {len(slices)}"
+    cplan = compile_source(
+        path=input_file, cache_dir=None if args.no_cache else args.cache_dir
     )
 
-    with open(cplan_file, "wb") as f:
-        pickle.dump(
-            {
-                "md5": md5.hexdigest(),
-                "meta_data": meta_data,
-                "sql_query": sql_query,
-                "triggers": triggers,
-                "slices": slices,
-            },
-            file=f,
-        )
+    print("parsing done.")
+    print(cplan)
+
+    cplan.dump(cplan_file)
 
     print(f"dump '{input_file}' to plan '{cplan_file}'")
@@ -0,0 +1,80 @@
+"""
+Static analysis of trigger bodies: which fields a trigger reads through
+GET("Config.field"), so a write only runs the triggers that read the field.
+"""
+
+import ast
+import re
+
+from utils import format_code, CanfigException
+
+_FIELD_RE = re.compile(r"\w+\.\w+")
+
+
+def trigger_reads(name: str, cmd: str) -> list | None:
+    """
+    :param cmd: trigger body as written in the .cand
+    :return: "Config.field" read by the trigger in order, None if it cannot
+             be told, e.g. GET called with a computed field or passed around
+    """
+    try:
+        tree = ast.parse(format_code(cmd))
+    except SyntaxError as e:
+        raise CanfigException(f"Trigger '{name}' is not valid python: {e}")
+
+    reads = {}
+    calls = set()
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)):
+            continue
+        if node.func.id != "GET":
+            continue
+
+        calls.add(id(node.func))
+        args = [*node.args, *(kw.value for kw in node.keywords if kw.arg == "field_dir")]
+        if not (
+            len(args) == 1
+            and isinstance(args[0], ast.Constant)
+            and isinstance(args[0].value, str)
+            and _FIELD_RE.fullmatch(args[0].value)
+        ):
+            return None
+
+        reads.setdefault(args[0].value, (node.lineno, node.col_offset))
+
+    # GET used other than called with a literal
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id == "GET" and id(node) not in calls:
+            return None
+
+    return sorted(reads, key=reads.get)
+
+
+def trigger_index(triggers: list, fields: dict, cache=None) -> dict:
+    """
+    :param triggers: TRIGGER declarations from the parser
+    :param fields: config -> field -> spec, from resolve_schema
+    :param cache: DeclarationCache to reuse the reads of unchanged triggers
+    :return: "Config.field" -> names of the triggers to run when it is
+             written. A trigger runs on the fields it reads of the config it
+             watches, WHEN CHANGE Config. When it cannot be analyzed or reads
+             none of them, it runs on every field of that config.
+    """
+    index: dict = {}
+    for trigger in triggers:
+        watched = [f"{trigger['condition']}.{f}" for f in fields.get(trigger["condition"], {})]
+        if cache is None:
+            reads = trigger_reads(trigger["name"], trigger["cmd"])
+        elif (cached := cache.get_derived("reads", trigger["cmd"])) is not None:
+            reads = cached["reads"]
+        else:
+            reads = trigger_reads(trigger["name"], trigger["cmd"])
+            cache.put_derived("reads", trigger["cmd"], {"reads": reads})
+        # the reads of other configs never run the trigger
+        if not (reads := [field_dir for field_dir in reads or [] if field_dir in watched]):
+            reads = watched
+
+        for field_dir in reads:
+            index.setdefault(field_dir, []).append(trigger["name"])
+
+    return index
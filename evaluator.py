@@ -1,51 +1,664 @@
+import abc
 import sqlite3
 import re
+import pathlib
+import contextlib
+import threading
+import difflib
+import queue
+import json
+import time
 
 from typing import Dict, Optional, Callable
 from enum import Enum, auto
 
-from utils import CanfigException, TriggerException
+from storage import STORAGE_PROFILES, DEFAULT_STORAGE_PROFILE
+from utils import CanfigException
+from checks import Checks
+from view_cache import ViewCache
+from changefeed import ChangeEvent
+from history import History, CONFIG_ROW_ID, PRUNE_INTERVAL, links_of
+from trigger_engine import ENGINE
 
 DB_FILE = "canfig.sqlite3"
 
 SQLITE3_BUILD_IN_TYPE = ["INTEGER", "REAL", "TEXT", "BLOB"]
 
+STATEMENT_CACHE_SIZE = 1024
 
-class DB:
-    @staticmethod
-    def __dict_factory(cursor, row):
-        d = {}
-        for idx, col in enumerate(cursor.description):
-            d[col[0]] = row[idx]
-        return d
-
-    def __init__(self, db_dir):
-        self.connection = sqlite3.connect(db_dir)
-        self.connection.row_factory = self.__dict_factory
+# every committed transaction bumps the write version, kept in the database
+# so it grows across restarts and processes. The table is created by migrate
+_WRITE_VERSION_SQL = "SELECT version FROM _canfig_version WHERE _canfig_version_id = 1"
+_BUMP_WRITE_VERSION_SQL = """
+    INSERT INTO _canfig_version (_canfig_version_id, version) VALUES (1, 1)
+    ON CONFLICT (_canfig_version_id) DO UPDATE SET version = version + 1
+    RETURNING version
+"""
+
+# every commit is recorded in the changelog with the fields it changed, the
+# last CHANGELOG_SIZE are kept for the watchers resuming from a version
+CHANGELOG_SIZE = 100000
+_CHANGELOG_INSERT_SQL = """
+    INSERT INTO _canfig_changelog (version, committed_at, changes, field_values)
+    VALUES (?, ?, ?, ?)
+"""
+_CHANGELOG_PRUNE_SQL = "DELETE FROM _canfig_changelog WHERE version <= ?"
+
+# statements that can change the columns a query returns
+_DDL_RE = re.compile(r"\s*(CREATE|DROP|ALTER)\b", re.IGNORECASE)
+
+
+def _dict_rows_builder(columns: tuple) -> Callable:
+    """
+    :return: function turning row tuples into dicts with these columns, the
+             dict display is generated so no per row loop over the columns
+    """
+    items = ", ".join(f"{col!r}: r[{i}]" for i, col in enumerate(columns))
+    return eval(f"lambda rows: [{{{items}}} for r in rows]")
+
+
+# cursors whose description only names columns, sqlite3.Row reads the
+# column names from a cursor
+_ROW_DESCRIPTIONS = sqlite3.connect(":memory:", check_same_thread=False)
+_ROW_DESCRIPTIONS_LOCK = threading.Lock()
+
+
+def _row_cursor(columns: tuple) -> sqlite3.Cursor:
+    """
+    :return: cursor described by columns, to build sqlite3.Row of row tuples
+    """
+    names = ", ".join(f'NULL AS "{col.replace(chr(34), chr(34) * 2)}"' for col in columns)
+    with _ROW_DESCRIPTIONS_LOCK:
+        cursor = _ROW_DESCRIPTIONS.cursor()
+        cursor.execute(f"SELECT {names}" if columns else "SELECT 1 WHERE 0")
+        cursor.fetchall()
+    return cursor
+
+
+class RowMode(Enum):
+    TUPLE = auto()  # raw tuples from sqlite3
+    ROW = auto()  # sqlite3.Row, index by position or column name
+    DICT = auto()  # column name -> value
+
+
+class Backend(abc.ABC):
+    """
+    storage of the config fields, plans read and write through it. DB keeps
+    them in sqlite, memory_backend.MemoryBackend in memory in front of a DB
+    """
+
+    # the change events are recorded, a watcher resumes from its version
+    keeps_changelog = True
+
+    def __init__(self):
+        self.__dict_builders: Dict[tuple, Callable] = {}
+        self.__row_cursors: Dict[tuple, sqlite3.Cursor] = {}
+        # bumped by every commit
+        self.write_version = 0
+        # identifies the outer transaction open, the triggers it runs carry it
+        self.trigger_token = None
+
+    def runs_transaction(self, owner: Optional[int]) -> bool:
+        """
+        :param owner: thread of the outer transaction open
+        :return: the current thread is owner, or runs a trigger of its
+                 transaction
+        """
+        if owner == threading.get_ident():
+            return True
+        return ENGINE.in_trigger() and ENGINE.run_token() is self.trigger_token
+
+    def check_trigger(self):
+        """
+        :raise CanfigException: the current thread runs a trigger of a
+                                transaction that has ended, a sync trigger
+                                past its deadline keeps running
+        """
+        if ENGINE.in_trigger() and ENGINE.run_token() is not self.trigger_token:
+            raise CanfigException(
+                "the transaction that ran the trigger has ended, its write is refused"
+            )
+
+    @property
+    @abc.abstractmethod
+    def in_transaction(self) -> bool:
+        """
+        :return: a transaction is open
+        """
+
+    @abc.abstractmethod
+    def transaction(self):
+        """
+        context manager of a transaction, nested ones are savepoints
+        """
+
+    @abc.abstractmethod
+    def read_field(self, plan: "Plan", version: Optional[int] = None) -> tuple:
+        """
+        :return: (column names, row tuples) of the field of plan
+        """
+
+    @abc.abstractmethod
+    def write_field(self, plan: "Plan"):
+        """
+        write the bound value of plan in the open transaction
+        """
+
+    @abc.abstractmethod
+    def edit_field(self, plan: "Plan", edit: str, *args):
+        """
+        run an element operation of the LIST of plan in the open transaction
+        """
+
+    @abc.abstractmethod
+    def snapshot(self, query, version: Optional[int] = None) -> dict:
+        """
+        :param query: snapshot.SnapshotQuery of the fields to read
+        :return: config -> field -> value
+        """
+
+    @abc.abstractmethod
+    def restore(self, version: int) -> list:
+        """
+        bring every config back to version in the open transaction
+
+        :return: configs moved
+        """
+
+    @abc.abstractmethod
+    def read_write_version(self) -> int | None:
+        """
+        :return: the last version committed, a change feed starts from it
+        """
+
+    def dict_rows(self, columns: tuple, rows: list) -> list:
+        if (builder := self.__dict_builders.get(columns)) is None:
+            builder = self.__dict_builders[columns] = _dict_rows_builder(columns)
+        return builder(rows)
+
+    def sqlite_rows(self, columns: tuple, rows: list) -> list:
+        """
+        :return: sqlite3.Row of every row tuple, as RowMode.ROW fetches them
+        """
+        if (cursor := self.__row_cursors.get(columns)) is None:
+            cursor = self.__row_cursors[columns] = _row_cursor(columns)
+        return [sqlite3.Row(cursor, row) for row in rows]
+
+    @abc.abstractmethod
+    def close(self):
+        """
+        release the storage, the backend is not used after
+        """
+
+
+class DB(Backend):
+    def __init__(
+            self,
+            db_dir,
+            profile: str = DEFAULT_STORAGE_PROFILE,
+            history: int = 0,
+            prune_every: int = PRUNE_INTERVAL,
+    ):
+        """
+        :param profile: name of a STORAGE_PROFILES entry
+        :param history: versions of the configs kept, 0 writes them in place
+        :param prune_every: versions committed between two prunes of the
+                            history
+        """
+        super().__init__()
+        if profile not in STORAGE_PROFILES:
+            raise CanfigException(
+                f"storage profile '{profile}' not exist, use one of {list(STORAGE_PROFILES)}"
+            )
+        self.profile = profile
+        self.__settings = STORAGE_PROFILES[profile]
+
+        # plans keep their sql fixed, let sqlite3 keep all of them prepared.
+        # triggers use the connection from the threads of the trigger engine,
+        # every access goes through self.lock
+        self.db_dir = db_dir
+        self.connection = self.__connect(db_dir)
+        self.__set_journal_mode(self.__settings["journal_mode"])
+        self.connection.execute(f"PRAGMA synchronous = {self.__settings['synchronous']}")
         self.cursor = self.connection.cursor()
+        self.lock = threading.RLock()
+
+        # read-only connections, opened on demand. An in-memory database is
+        # private to its connection, it has no pool
+        self.__pool_size = 0 if db_dir == ":memory:" else self.__settings["read_pool"]
+        self.__readers: queue.SimpleQueue = queue.SimpleQueue()
+        self.__opened_readers = 0
+        self.__pool_lock = threading.Lock()
+
+        # column names of each query, for DICT rows
+        self.__columns: Dict[str, tuple] = {}
+        self.__last_sql = None
+
+        # depth of nested transaction(), and the thread that opened it. A
+        # transaction at a time: the outer one holds the writer lock, a
+        # transaction() of another thread waits for it to end
+        self.__depth = 0
+        self.__owner = None
+        # rows changed on the connection when the outer transaction began
+        self.__total_changes = 0
+        self.__writer = threading.Lock()
+
+        self.view_cache = ViewCache()
+        self.__version_cursor = self.connection.cursor()
+
+        # write_version is the last one committed by this connection or read
+        # back by read_write_version(), 0 until the version table exists
+        self.__versioned = False
+
+        # fields written by the open transaction, one set per savepoint level
+        self.__changes: list = []
+        # config -> row written by the open transaction, one dict per level
+        self.__rows: list = []
+        self.history = History(history, prune_every)
+        # called with the ChangeEvent of every commit that changed a field
+        self.commit_listeners: list = []
+        # changes -> config -> field -> value, recorded with the changes when
+        # set, it reads inside the committing transaction
+        self.change_values: Optional[Callable] = None
+
+    def __set_journal_mode(self, journal_mode: str):
+        # the journal mode is kept in the database file, it only changes while
+        # no other connection uses the database
+        current = self.connection.execute("PRAGMA journal_mode").fetchone()[0]
+        if current.upper() == journal_mode or current == "memory":
+            return
+
+        busy_timeout = self.connection.execute("PRAGMA busy_timeout").fetchone()[0]
+        self.connection.execute("PRAGMA busy_timeout = 0")
+        try:
+            self.connection.execute(f"PRAGMA journal_mode = {journal_mode}")
+        except sqlite3.OperationalError:
+            print(
+                f"Warning: database in use, keep journal_mode {current} "
+                f"instead of {journal_mode}"
+            )
+        finally:
+            self.connection.execute(f"PRAGMA busy_timeout = {busy_timeout}")
+
+    def __connect(self, db_dir, read_only: bool = False) -> sqlite3.Connection:
+        if read_only:
+            connection = sqlite3.connect(
+                f"{pathlib.Path(db_dir).resolve().as_uri()}?mode=ro",
+                uri=True,
+                cached_statements=STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+            )
+            connection.execute("PRAGMA query_only = ON")
+        else:
+            connection = sqlite3.connect(
+                db_dir, cached_statements=STATEMENT_CACHE_SIZE, check_same_thread=False
+            )
+        connection.execute(f"PRAGMA mmap_size = {self.__settings['mmap_size']}")
+        connection.execute(f"PRAGMA cache_size = {self.__settings['cache_size']}")
+        return connection
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.__depth > 0
+
+    def uses_pool(self) -> bool:
+        """
+        :return: the reads of the current thread go to the read-only pool
+        """
+        if not self.__pool_size:
+            return False
+        return not self.__depth or not self.runs_transaction(self.__owner)
+
+    @contextlib.contextmanager
+    def reader(self):
+        """
+        cursor of a read-only connection of the pool, readers neither wait on
+        each other nor on self.lock. The reads of the thread running a
+        transaction, or of its triggers, go to the write connection under
+        self.lock to see its writes.
+        """
+        if not self.uses_pool():
+            with self.lock:
+                try:
+                    yield self.cursor
+                except sqlite3.Error as e:
+                    raise CanfigException(e)
+            return
 
-    def execute(self, sql_command, args=None):
         try:
-            if args:
-                self.cursor.execute(sql_command, args)
-            else:
-                self.cursor.execute(sql_command)
-        except Exception as e:
+            connection = self.__readers.get_nowait()
+        except queue.Empty:
+            with self.__pool_lock:
+                connection = None
+                if self.__opened_readers < self.__pool_size:
+                    connection = self.__connect(self.db_dir, read_only=True)
+                    self.__opened_readers += 1
+            if connection is None:
+                connection = self.__readers.get()
+
+        try:
+            yield connection.cursor()
+        except sqlite3.Error as e:
             raise CanfigException(e)
+        finally:
+            self.__readers.put(connection)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+        run the block in one transaction, commit when it ends or roll back
+        if it raises. Nested blocks are savepoints of the outer transaction,
+        a failed one only undoes its own writes.
+
+        only the thread of the outer block and its triggers nest, any other
+        thread waits until the outer transaction commits or rolls back. A
+        trigger whose transaction has ended cannot write.
+
+        a nested block holds self.lock until it ends, the outer one does not
+        so the triggers it runs on other threads can use the connection.
+        """
+        self.check_trigger()
+        outer = not (self.__depth and self.runs_transaction(self.__owner))
+        if outer:
+            self.__writer.acquire()
+        self.lock.acquire()
+        savepoint = f"canfig_{self.__depth}"
+        try:
+            # the transaction may have ended while the trigger waited
+            if not outer:
+                self.check_trigger()
+            self.execute("BEGIN IMMEDIATE" if outer else f"SAVEPOINT {savepoint}")
+        except BaseException:
+            self.lock.release()
+            if outer:
+                self.__writer.release()
+            raise
+
+        self.__depth += 1
+        self.__changes.append(set())
+        self.__rows.append({})
+        if outer:
+            self.__owner = threading.get_ident()
+            self.trigger_token = object()
+            self.__total_changes = self.connection.total_changes
+            self.lock.release()
+
+        try:
+            yield self
+        except BaseException:
+            if outer:
+                self.lock.acquire()
+            try:
+                self.__depth -= 1
+                self.__changes.pop()
+                self.__rows.pop()
+                if outer:
+                    self.__owner = self.trigger_token = None
+                    self.rollback()
+                else:
+                    self.execute(f"ROLLBACK TO {savepoint}")
+                    self.execute(f"RELEASE {savepoint}")
+                    # views read inside the savepoint may be undone
+                    self.view_cache.clear()
+            finally:
+                self.lock.release()
+                if outer:
+                    self.__writer.release()
+            raise
+
+        if outer:
+            self.lock.acquire()
+        try:
+            if outer:
+                # recorded while the transaction is still open and its own. A
+                # transaction that wrote nothing keeps the version, the view
+                # caches, tags and watchers stay valid
+                try:
+                    event = None
+                    if (
+                        self.__changes[-1]
+                        or self.__rows[-1]
+                        or self.connection.total_changes != self.__total_changes
+                    ):
+                        event = self.__record_changes(self.__changes[-1], self.__rows[-1])
+                except BaseException:
+                    self.__depth -= 1
+                    self.__changes.pop()
+                    self.__rows.pop()
+                    self.__owner = self.trigger_token = None
+                    self.rollback()
+                    raise
+            self.__depth -= 1
+            changes = self.__changes.pop()
+            rows = self.__rows.pop()
+            if outer:
+                self.__owner = self.trigger_token = None
+                self.commit()
+                self.history.committed(rows)
+                if event is not None:
+                    self.write_version = event.version
+                    if event.changes:
+                        for listener in self.commit_listeners:
+                            listener(event)
+            else:
+                self.__changes[-1] |= changes
+                self.__rows[-1].update(rows)
+                self.execute(f"RELEASE {savepoint}")
+        finally:
+            self.lock.release()
+            if outer:
+                self.__writer.release()
+
+    def record_change(self, field_dir: str):
+        """
+        :param field_dir: "Config.field" written by the open transaction
+        """
+        with self.lock:
+            if self.__changes:
+                self.__changes[-1].add(field_dir)
+
+    def config_row(self, config: str, write: bool = False) -> int:
+        """
+        :param write: the row is written by the open transaction, with history
+                      on its first write copies the committed row
+        :return: id of the config row the current thread reads or writes
+        """
+        with self.lock:
+            # the thread of the transaction sees the rows it writes
+            if write or not self.uses_pool():
+                for rows in reversed(self.__rows):
+                    if (row_id := rows.get(config)) is not None:
+                        return row_id
+
+            row_id = self.history.live_rows(self).get(config, CONFIG_ROW_ID)
+            if write and self.history.enabled:
+                assert self.__rows, "write a config inside a transaction"
+                row_id = self.__rows[-1][config] = self.history.copy(self, config, row_id)
+            return row_id
+
+    def list_row(self, config: str, link: str) -> int:
+        """
+        :param link: link table of the LIST written
+        :return: id of the config row the open transaction writes, it owns
+                 the links of the LIST
+        """
+        with self.lock:
+            row_id = self.config_row(config, write=True)
+            if self.history.enabled:
+                self.history.own_links(self, link, f"{config}_id", row_id)
+            return row_id
+
+    def config_rows(self, configs: list, version: Optional[int] = None) -> tuple:
+        """
+        :param version: committed version to read, the current one by default
+        :return: row id of every config
+        """
+        if version is None:
+            with self.lock:
+                return tuple(self.config_row(config) for config in configs)
+
+        rows = self.history.rows_at(self, version)
+        return tuple(rows.get(config, CONFIG_ROW_ID) for config in configs)
+
+    def restore(self, version: int) -> list:
+        """
+        point every config back at its row at version, in the open
+        transaction. No row is copied, the commit records the new version.
+
+        :return: configs moved
+        """
+        if not self.history.enabled:
+            raise CanfigException("history is off, no version to roll back to")
+        assert self.__depth, "restore a version inside a transaction"
+
+        target = self.history.rows_at(self, version)
+        moved = []
+        with self.lock:
+            for config in sorted(set(target) | set(self.history.live_rows(self))):
+                row_id = target.get(config, CONFIG_ROW_ID)
+                if self.config_row(config) != row_id:
+                    self.__rows[-1][config] = row_id
+                    moved.append(config)
+            self.view_cache.clear()
+        return moved
+
+    def __record_changes(self, field_dirs: set, rows: dict) -> ChangeEvent | None:
+        """
+        bump the write version and record the changes in the changelog, and
+        the rows written in the history
+
+        :return: the event of the commit, None without a version table
+        """
+        if (version := self.__bump_write_version()) is None:
+            return None
+        if rows:
+            self.history.record(self, version, rows)
+
+        changes: Dict[str, list] = {}
+        for field_dir in sorted(field_dirs):
+            config_n, field_n = field_dir.split(".")
+            changes.setdefault(config_n, []).append(field_n)
+        values = self.change_values(changes) if changes and self.change_values else None
+
+        event = ChangeEvent(version, time.time(), changes, values)
+        self.execute(
+            _CHANGELOG_INSERT_SQL,
+            (version, event.committed_at, json.dumps(changes), None if values is None else json.dumps(values)),
+        )
+        if version > CHANGELOG_SIZE:
+            self.execute(_CHANGELOG_PRUNE_SQL, (version - CHANGELOG_SIZE,))
+        return event
+
+    def execute(self, sql_command, args=None):
+        with self.lock:
+            self.__last_sql = sql_command
+            if _DDL_RE.match(sql_command):
+                self.__columns.clear()
+                self.history.schema_changed()
+
+            try:
+                if args:
+                    self.cursor.execute(sql_command, args)
+                else:
+                    self.cursor.execute(sql_command)
+            except Exception as e:
+                raise CanfigException(e)
+
+    def executemany(self, sql_command, seq_of_args):
+        with self.lock:
+            try:
+                self.cursor.executemany(sql_command, seq_of_args)
+            except Exception as e:
+                raise CanfigException(e)
+
+    def executescript(self, sql_script):
+        with self.lock:
+            self.__columns.clear()
+            self.history.schema_changed()
+            try:
+                self.cursor.executescript(sql_script)
+            except Exception as e:
+                raise CanfigException(e)
 
     def get_lastrowid(self):
         return self.cursor.lastrowid
 
     def commit(self):
-        self.connection.commit()
+        with self.lock:
+            self.connection.commit()
 
     def rollback(self):
-        self.connection.rollback()
+        with self.lock:
+            self.connection.rollback()
+            self.view_cache.clear()
+
+    def __bump_write_version(self) -> int | None:
+        if not self.__versioned and self.read_write_version() is None:
+            return None
+        return self.cursor.execute(_BUMP_WRITE_VERSION_SQL).fetchone()[0]
+
+    def read_write_version(self) -> int | None:
+        """
+        read back the write version, it moves when any connection commits
+
+        :return: the write version, None when the database has no version
+                 table yet
+        """
+        with self.lock:
+            try:
+                row = self.__version_cursor.execute(_WRITE_VERSION_SQL).fetchone()
+            except sqlite3.OperationalError:
+                return None
+            self.__versioned = True
+            self.write_version = row[0] if row else 0
+            return self.write_version
+
+    def data_version(self) -> int:
+        # changes when another connection commits to the database
+        with self.lock:
+            return self.__version_cursor.execute("PRAGMA data_version").fetchone()[0]
+
+    def columns(self, cursor: Optional[sqlite3.Cursor] = None, sql: str = None) -> tuple:
+        """
+        :param cursor: cursor that ran sql, the last query of self.cursor by
+                       default
+        :return: column names of the query, cached per statement
+        """
+        if cursor is None:
+            cursor, sql = self.cursor, self.__last_sql
+        if (columns := self.__columns.get(sql)) is None:
+            columns = self.__columns[sql] = tuple(col[0] for col in cursor.description)
+        return columns
+
+    def fetchall(self, mode: RowMode = RowMode.DICT) -> list:
+        with self.lock:
+            if mode == RowMode.TUPLE:
+                return self.cursor.fetchall()
+
+            if mode == RowMode.ROW:
+                self.cursor.row_factory = sqlite3.Row
+                try:
+                    return self.cursor.fetchall()
+                finally:
+                    self.cursor.row_factory = None
 
-    def fetchall(self) -> list:
-        return self.cursor.fetchall()
+            return self.dict_rows(self.columns(), self.cursor.fetchall())
+
+    def read_field(self, plan: "Plan", version: Optional[int] = None) -> tuple:
+        return plan.read_rows(self, version)
+
+    def write_field(self, plan: "Plan"):
+        plan.write_rows(self)
+
+    def edit_field(self, plan: "Plan", edit: str, *args):
+        plan.edit_rows(self, edit, *args)
+
+    def snapshot(self, query, version: Optional[int] = None) -> dict:
+        return query.read(self, version)
 
     def close(self):
+        while not self.__readers.empty():
+            self.__readers.get_nowait().close()
         self.connection.close()
 
 
@@ -79,16 +692,28 @@ def CREATE_BUILD_IN_plan(build_in_type: str):
 
 
 def CREATE_M2M_plan(tname_1: str, tname_2: str):
+    # pos orders the elements of a LIST, see Plan.LIST_POS_GAP. The key leads
+    # with the element so unlinking one is a key lookup, reading a list in
+    # order goes through the ({tname_2}_id, pos) index
     return f"""
     CREATE TABLE IF NOT EXISTS {tname_1}_{tname_2} (
         {tname_1}_id INTEGER,
         {tname_2}_id INTEGER,
+        pos INTEGER,
+        PRIMARY KEY ({tname_1}_id, {tname_2}_id),
         FOREIGN KEY ({tname_1}_id) REFERENCES {tname_1}({tname_1}_id),
         FOREIGN KEY ({tname_2}_id) REFERENCES {tname_2}({tname_2}_id)
-    );
+    ) WITHOUT ROWID;
     """
 
 
+def CREATE_INDEX_plan(table_name: str, columns: list):
+    return (
+        f"CREATE INDEX IF NOT EXISTS {table_name}_{'_'.join(columns)}_idx "
+        f"ON {table_name} ({', '.join(columns)})"
+    )
+
+
 def CREATE_CONFIG_INIT_plan(tname: str):
     return f"INSERT INTO {tname} DEFAULT VALUES"
 
@@ -113,253 +738,791 @@ def pre_sql_get_args(pre_sql, patterns: set, neg=False):
     return ret
 
 
-class Plan:
-    __write_plans = []
-    __write_taps = []
-    __read_plans = []
-    __read_taps = []
+class LastRow:
+    """
+    stands for a row id in the parameters of a write plan: the last row
+    state of the plan, the last INSERT or a reserved id range, plus offset
+    """
+
+    __slots__ = ("offset",)
+
+    def __init__(self, offset: int = 0):
+        self.offset = offset
+
+    def __repr__(self):
+        return f"LR_VAL+{self.offset}" if self.offset else "LR_VAL"
+
+
+LR_VAL = LastRow()
 
-    __init_flag = False
 
-    __LR_state = "LR_VAL"
+class ConfigRow:
+    """
+    stands for the config row in the parameters of a write plan, the row a
+    write goes to is known when it runs
+    """
+
+    __slots__ = ()
 
-    __plan_callback = None
-    __build_flag = False
+    def __repr__(self):
+        return "CONFIG_ROW"
 
-    __write_callbacks: Dict[str, tuple] = {}
+
+CONFIG_ROW = ConfigRow()
+
+
+class Plan:
+    # row of a config written in place, with history on see DB.config_row
+    CONFIG_ROW_ID = CONFIG_ROW_ID
+
+    # LIST elements are ordered by pos, spaced so an element inserted between
+    # two others takes a free pos instead of moving the following ones
+    LIST_POS_GAP = 1 << 16
 
     class Operation(Enum):
         EXECUTE = auto()  # execute plan buffer
         UP_LR_STATE = auto()  # update last row state
+        REPLACE_LIST = auto()  # diff the bound elements against the stored ones
+        DROP_REPLACED = auto()  # execute plan buffer unless the history keeps the row
 
-    def __init__(self):
-        pass
-
-    def __plan_closure_maker(self, sql_template: str) -> Callable:
+    def __init__(self, field_dir: Optional[str] = None):
         """
-
-        :param sql_template: sql command with __LR_VAL__ template field
-        :return: ready-to-go sql command function closure
+        :param field_dir: "Config.field" of the plan, its writes are recorded
+                          as changes of it
         """
+        self.field_dir = field_dir
+
+        # sql templates, compiled once by init_*_plan
+        self.__read_sql = None
+        self.__update_sql = None
+        self.__link_sql = None
+        self.__max_id_sql = None
+        self.__unlink_sql = None
+        self.__delete_sql = None
+        self.__elements_sql = None
+        self.__max_pos_sql = None
+        self.__count_sql = None
+        self.__element_id_sql = None
+        self.__unlink_all_sql = None
+        self.__relink_sql = None
+        self.__copy_sql = None
+        self.__insert_sqls: Dict[tuple, str] = {}
+        self.__update_sqls: Dict[tuple, str] = {}
+
+        self.__config_name = None
+        self.__ext_table_name = None
+        # link table of a LIST plan
+        self.__link_table = None
+        self.__columns: tuple = ()
+        # struct column -> literal DEFAULT, what an insert stores for a
+        # column the element leaves out
+        self.__defaults: dict = {}
+
+        # bound by bind(): the templates to run and their parameters
+        self.__write_taps = []
+        self.__write_plans = []
+        self.__LR_state = None
+        # config row written by the running write
+        self.__row_id = None
+        # value given to the last bind()
+        self.__bound = None
+        # columns of the rows read, the field itself for a std plan
+        self.__read_columns: tuple = ()
+
+        self.__plan_callback = None
+        self.__build_flag = False
+
+        # triggers of the config this field belongs to
+        self.__write_callbacks: Dict[str, tuple] = {}
+
+        # CHECKs of the rows the field writes, validated by bind()
+        self.__checks = Checks([])
+
+    def __check_columns(self, columns: tuple):
+        for col in columns:
+            if col not in self.__columns:
+                raise CanfigException(
+                    f"'{col}' is not a field of {self.__ext_table_name}"
+                )
 
-        def closure():
-            return sql_template.replace("__LR_VAL__", str(self.__LR_state))
+    def __insert_sql(self, columns: tuple, with_id: bool = False) -> str:
+        """
+        :param columns: columns given by the bound value, in its order
+        :param with_id: the row id is given as the first parameter
+        :return: INSERT template of the struct table for these columns
+        """
+        if (sql := self.__insert_sqls.get(key := (columns, with_id))) is None:
+            self.__check_columns(columns)
+            if with_id:
+                columns = (f"{self.__ext_table_name}_id",) + columns
+            if not columns:
+                sql = f"INSERT INTO {self.__ext_table_name} DEFAULT VALUES"
+            else:
+                sql = (
+                    f"INSERT INTO {self.__ext_table_name} ({','.join(columns)}) "
+                    f"VALUES ({','.join('?' * len(columns))})"
+                )
+            self.__insert_sqls[key] = sql
+        return sql
 
-        return closure
+    def __element_update_sql(self, columns: tuple) -> str:
+        """
+        :return: UPDATE template of one struct row for these columns, the row
+                 id is the last parameter
+        """
+        if (sql := self.__update_sqls.get(columns)) is None:
+            self.__check_columns(columns)
+            sql = self.__update_sqls[columns] = (
+                f"UPDATE {self.__ext_table_name} SET "
+                f"{', '.join(f'{col} = ?' for col in columns)} "
+                f"WHERE {self.__ext_table_name}_id = ?"
+            )
+        return sql
 
-    def __init_std_plan(self, table_name: str, _config_name: str, value: str | int):
-        assert not self.__init_flag, "plan already initialized."
+    def __bind_std(self, value: str | int):
         assert isinstance(value, str) or isinstance(
             value, int
         ), "standard plan value must be a string or int"
 
-        self.__write_plans.append(
-            self.__plan_closure_maker(
-                f"""
-                    UPDATE {table_name} SET 
-                    {_config_name} = {"'" + value + "'" if isinstance(value, str) else value}
-                    WHERE {table_name}_id = 1;
-                """
-            )
-        )
-        self.__write_taps.append(self.Operation.EXECUTE)
-        self.__init_flag = True
-
-        # make read plan
-        self.__read_plans.append(
-            self.__plan_closure_maker(
-                f"""
-                    SELECT {_config_name} FROM {table_name} WHERE {table_name}_id = 1;
-                """
-            )
-        )
-
-        self.__read_taps.append(self.Operation.EXECUTE)
+        self.__write_taps = [self.Operation.EXECUTE]
+        self.__write_plans = [(self.__update_sql, (value, CONFIG_ROW))]
 
-    def __init_ext_plan(
-            self, table_name: str, ext_table_name: str, _config_name: str, values: dict
-    ):
-        assert not self.__init_flag, "plan already initialized."
+    def __bind_ext(self, values: dict):
         assert isinstance(values, dict), "values must be a dict"
+        insert_sql = self.__insert_sql(tuple(values))
 
-        values_f = [
-            f"'{value}'" if isinstance(value, str) else str(value)
-            for value in values.values()
+        self.__write_taps = [
+            self.Operation.EXECUTE,
+            self.Operation.UP_LR_STATE,
+            self.Operation.DROP_REPLACED,
+            self.Operation.EXECUTE,
+        ]
+        self.__write_plans = [
+            (insert_sql, tuple(values.values())),
+            # the replaced struct row belongs to this field only
+            (self.__delete_sql, (CONFIG_ROW,)),
+            (self.__update_sql, (LR_VAL, CONFIG_ROW)),
         ]
 
-        self.__write_plans.append(
-            self.__plan_closure_maker(
-                f"""
-                    INSERT INTO {ext_table_name} ({",".join(values.keys())})
-                    VALUES ({",".join(values_f)});
-                """
-            )
-        )
-        self.__write_taps.append(self.Operation.EXECUTE)
-        self.__write_taps.append(self.Operation.UP_LR_STATE)
-
-        self.__write_plans.append(
-            self.__plan_closure_maker(
-                f"""
-                    UPDATE {table_name} SET {_config_name} = __LR_VAL__
-                    WHERE {table_name}_id = 1
-                """
-            )
+    def __bind_list(self, values: list[Dict]):
+        assert isinstance(values, list), "list plan values must be a list"
+        for config in values:
+            assert isinstance(config, dict), "list elements must be dicts"
+        for columns in {tuple(config) for config in values}:
+            self.__check_columns(columns)
+
+        self.__write_taps = [self.Operation.REPLACE_LIST]
+        self.__write_plans = [(self.__elements_sql, values)]
+
+    # stands for a column left out whose DEFAULT is not known, it equals no
+    # stored value
+    __NO_DEFAULT = object()
+
+    def __element_key(self, config: dict) -> tuple:
+        """
+        :return: column values of the element as an insert stores them
+        """
+        return tuple(
+            config[col] if col in config else self.__defaults.get(col, self.__NO_DEFAULT)
+            for col in self.__columns
         )
-        self.__write_taps.append(self.Operation.EXECUTE)
-        self.__init_flag = True
-
-        self.__read_plans.append(
-            self.__plan_closure_maker(
-                f"""
-                    SELECT {",".join(values.keys())} FROM {ext_table_name}
-                    WHERE {ext_table_name}_id = (
-                        SELECT {_config_name} FROM {table_name} WHERE {table_name}_id = 1
-                    )
-                """
-            )
+
+    def __stored_elements(self, _db: DB) -> list:
+        """
+        :return: (struct row id, pos, column values) of the elements in order
+        """
+        _db.execute(self.__elements_sql, (self.__row_id,))
+        return [(row[0], row[1], row[2:]) for row in _db.fetchall(RowMode.TUPLE)]
+
+    def __insert_elements(self, _db: DB, values: list, positions: list):
+        """
+        insert and link new elements, they take the contiguous ids after the
+        largest one so no row id is read back
+        """
+        _db.execute(self.__max_id_sql)
+        first_id = _db.fetchall()[0]["max_id"] + 1
+
+        # one bulk INSERT per run of elements with the same columns
+        run_columns, run_rows = None, []
+        for i, config in enumerate(values):
+            if (columns := tuple(config)) != run_columns:
+                if run_rows:
+                    _db.executemany(self.__insert_sql(run_columns, True), run_rows)
+                run_columns, run_rows = columns, []
+            run_rows.append((first_id + i, *config.values()))
+        if run_rows:
+            _db.executemany(self.__insert_sql(run_columns, True), run_rows)
+
+        _db.executemany(
+            self.__link_sql,
+            [(first_id + i, self.__row_id, pos) for i, pos in enumerate(positions)],
         )
 
-        self.__read_taps.append(self.Operation.EXECUTE)
+    def __delete_elements(self, _db: DB, row_ids: list):
+        # struct rows of a LIST belong to one element, unlinked they are garbage
+        # unless an older version of the config still links them
+        _db.executemany(self.__unlink_sql, [(i, self.__row_id) for i in row_ids])
+        if not _db.history.enabled:
+            _db.executemany(self.__delete_sql, [(i,) for i in row_ids])
 
-    def __init_list_plan(
-            self, table_name: str, ext_table_name: str, values: list[Dict]
-    ):
-        assert not self.__init_flag, "plan already initialized."
-        assert isinstance(values, list), "list plan values must be a list"
+    def __copy_elements(self, _db: DB, updates: list) -> list:
+        """
+        copy the struct rows about to be updated and link the copies in their
+        place, the rows stay as the older versions of the config have them
 
-        self.__write_plans.extend(
-            [
-                self.__plan_closure_maker(
-                    f"""
-                        DELETE FROM {table_name};
-                """
-                ),
-                self.__plan_closure_maker(
-                    f"""
-                        DELETE FROM {ext_table_name}_{table_name};
-                    """
-                ),
-            ]
-        )
+        :return: updates on the copies
+        """
+        _db.execute(self.__max_id_sql)
+        first_id = _db.fetchall()[0]["max_id"] + 1
 
-        self.__write_taps.append(self.Operation.EXECUTE)
-        self.__write_taps.append(self.Operation.EXECUTE)
+        _db.executemany(
+            self.__copy_sql, [(first_id + i, row_id) for i, (row_id, _) in enumerate(updates)]
+        )
+        _db.executemany(
+            self.__relink_sql,
+            [(first_id + i, row_id, self.__row_id) for i, (row_id, _) in enumerate(updates)],
+        )
+        return [(first_id + i, config) for i, (_, config) in enumerate(updates)]
 
-        for config in values:
-            values_f = [
-                f"'{value}'" if isinstance(value, str) else str(value)
-                for value in config.values()
-            ]
+    def __update_elements(self, _db: DB, updates: list):
+        """
+        :param updates: (struct row id, values) pairs
+        """
+        if updates and _db.history.enabled:
+            updates = self.__copy_elements(_db, updates)
+
+        by_columns: Dict[tuple, list] = {}
+        for row_id, config in updates:
+            by_columns.setdefault(tuple(config), []).append((*config.values(), row_id))
+        for columns, rows in by_columns.items():
+            if columns:
+                _db.executemany(self.__element_update_sql(columns), rows)
+
+    @classmethod
+    def _list_positions(cls, slots: list) -> list | None:
+        """
+        :param slots: (struct row id, pos) per element in the new order, id
+                      and pos are None for a new element
+        :return: pos of every element, None when the kept elements leave no
+                 free pos for the new ones
+        """
+        ret = [pos for _, pos in slots]
+        if any(pos is None for row_id, pos in slots if row_id is not None):
+            return None
+
+        i = 0
+        while i < len(slots):
+            if slots[i][0] is not None:
+                i += 1
+                continue
+
+            j = i
+            while j < len(slots) and slots[j][0] is None:
+                j += 1
+            k = j - i
+            before = ret[i - 1] if i else None
+            after = ret[j] if j < len(slots) else None
+
+            if after is None:
+                start = 0 if before is None else before
+                ret[i:j] = [start + cls.LIST_POS_GAP * (m + 1) for m in range(k)]
+            elif before is None:
+                ret[i:j] = [after - cls.LIST_POS_GAP * (k - m) for m in range(k)]
+            elif after - before > k:
+                ret[i:j] = [before + (after - before) * (m + 1) // (k + 1) for m in range(k)]
+            else:
+                return None
+            i = j
 
-            self.__write_plans.append(
-                self.__plan_closure_maker(
-                    f"""
-                        INSERT INTO {ext_table_name} ({",".join(config.keys())})
-                        VALUES ({",".join(values_f)});
-                    """
-                )
-            )
+        return ret
 
-            self.__write_taps.append(self.Operation.EXECUTE)
-            self.__write_taps.append(self.Operation.UP_LR_STATE)
+    def __replace_list(self, _db: DB, values: list):
+        """
+        rewrite the list to values touching only the elements that differ:
+        an equal element is kept, a changed one is updated in place, the
+        others are inserted or deleted
+        """
+        rows = self.__stored_elements(_db)
+        old = [key for _, _, key in rows]
+        new = [self.__element_key(config) for config in values]
+
+        # most edits are local, the common ends are matched without a diff
+        lo = 0
+        while lo < min(len(old), len(new)) and old[lo] == new[lo]:
+            lo += 1
+        hi = 0
+        while hi < min(len(old), len(new)) - lo and old[-1 - hi] == new[-1 - hi]:
+            hi += 1
+
+        matcher = difflib.SequenceMatcher(
+            None, old[lo: len(old) - hi], new[lo: len(new) - hi], autojunk=False
+        )
 
-            self.__write_plans.append(
-                self.__plan_closure_maker(
-                    f"""
-                        INSERT INTO {ext_table_name}_{table_name}  ({ext_table_name}_id, {table_name}_id)
-                        VALUES (__LR_VAL__, 1)
-                    """
-                )
+        slots = [(row_id, pos) for row_id, pos, _ in rows[:lo]]
+        removed, updated, inserted = [], [], []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            i1, i2, j1, j2 = i1 + lo, i2 + lo, j1 + lo, j2 + lo
+            if tag == "equal":
+                slots.extend((row_id, pos) for row_id, pos, _ in rows[i1:i2])
+                continue
+
+            paired = min(i2 - i1, j2 - j1)
+            for k in range(paired):
+                row_id, pos, _ = rows[i1 + k]
+                key = new[j1 + k]
+                if any(value is self.__NO_DEFAULT for value in key):
+                    # an UPDATE cannot give the column its DEFAULT
+                    removed.append(row_id)
+                    inserted.append(values[j1 + k])
+                    slots.append((None, None))
+                else:
+                    # every column is written, as an insert would store them
+                    updated.append((row_id, dict(zip(self.__columns, key))))
+                    slots.append((row_id, pos))
+            removed.extend(row_id for row_id, _, _ in rows[i1 + paired: i2])
+            for j in range(j1 + paired, j2):
+                inserted.append(values[j])
+                slots.append((None, None))
+        slots.extend((row_id, pos) for row_id, pos, _ in rows[len(rows) - hi:])
+
+        if (positions := self._list_positions(slots)) is None:
+            # no room left between two elements, relink the whole list in order
+            positions = [self.LIST_POS_GAP * (i + 1) for i in range(len(slots))]
+            _db.execute(self.__unlink_all_sql, (self.__row_id,))
+            _db.executemany(
+                self.__link_sql,
+                [
+                    (row_id, self.__row_id, pos)
+                    for (row_id, _), pos in zip(slots, positions)
+                    if row_id is not None
+                ],
+            )
+            if not _db.history.enabled:
+                _db.executemany(self.__delete_sql, [(i,) for i in removed])
+        else:
+            self.__delete_elements(_db, removed)
+
+        self.__update_elements(_db, updated)
+        if inserted:
+            self.__insert_elements(
+                _db,
+                inserted,
+                [pos for (row_id, _), pos in zip(slots, positions) if row_id is None],
             )
 
-            self.__write_taps.append(self.Operation.EXECUTE)
-
-        self.__read_plans.append(
-            self.__plan_closure_maker(
-                f"""
-                    SELECT {",".join(values[0].keys())} FROM {ext_table_name}
-                    WHERE {ext_table_name}_id IN (
-                        SELECT {ext_table_name}_id FROM {ext_table_name}_{table_name}
-                        WHERE {table_name}_id = 1 
-                    )
-                """
+    def __element_id(self, _db: DB, index: int) -> int:
+        """
+        :param index: position in the list, negative counts from the end
+        :return: struct row id of the element
+        """
+        _db.execute(self.__count_sql, (self.__row_id,))
+        size = _db.fetchall()[0]["size"]
+        if not -size <= index < size:
+            raise CanfigException(
+                f"index {index} out of range of a list of {size} element(s)"
             )
+
+        _db.execute(self.__element_id_sql, (self.__row_id, index % size))
+        return _db.fetchall(RowMode.TUPLE)[0][0]
+
+    def __append(self, _db: DB, values: list):
+        _db.execute(self.__max_pos_sql, (self.__row_id,))
+        last = _db.fetchall()[0]["pos"] or 0
+        self.__insert_elements(
+            _db, values, [last + self.LIST_POS_GAP * (i + 1) for i in range(len(values))]
         )
 
-        self.__read_taps.append(self.Operation.EXECUTE)
+    def __remove(self, _db: DB, index: int):
+        self.__delete_elements(_db, [self.__element_id(_db, index)])
+
+    def __update(self, _db: DB, index: int, values: dict):
+        self.__update_elements(_db, [(self.__element_id(_db, index), values)])
+
+    def __edit(self, edit: str, _db: "Backend", *args) -> list:
+        """
+        run one element operation of a list plan and its triggers in one
+        transaction
+
+        :return: TriggerOutcome of the triggers run
+        """
+        assert self.__plan_callback == self.__bind_list, "not a list plan"
+
+        with _db.transaction():
+            _db.edit_field(self, edit, *args)
+            report = run_triggers(self.__write_callbacks, _db)
+
+        self.__build_flag = True
+        print("execute success!")
+        return report
+
+    def edit_rows(self, _db: DB, edit: str, *args):
+        """
+        run one element operation in the database, without the triggers and
+        inside the transaction of the caller
 
-        self.__init_flag = True
+        :param edit: "append", "remove" or "update", args as for them
+        """
+        edits = {"append": self.__append, "remove": self.__remove, "update": self.__update}
+
+        with _db.transaction():
+            self.__row_id = _db.list_row(self.__config_name, self.__link_table)
+            try:
+                edits[edit](_db, *args)
+            finally:
+                self.__row_id = None
+            _db.view_cache.invalidate(self.view_key)
+            if self.field_dir is not None:
+                _db.record_change(self.field_dir)
+
+    def append(self, _db: "Backend", values: dict | list[Dict]) -> list:
+        """
+        add one element, or a list of elements, at the end of the list
+        """
+        values = [values] if isinstance(values, dict) else list(values)
+        for config in values:
+            assert isinstance(config, dict), "list elements must be dicts"
+        for columns in {tuple(config) for config in values}:
+            self.__check_columns(columns)
+        self.__checks.validate(self.field_dir, values, is_list=True)
+        return self.__edit("append", _db, values)
+
+    def remove(self, _db: "Backend", index: int) -> list:
+        """
+        delete the element at index
+        """
+        return self.__edit("remove", _db, index)
+
+    def update(self, _db: "Backend", index: int, values: dict) -> list:
+        """
+        set the given fields of the element at index, the others are kept
+        """
+        assert isinstance(values, dict), "values must be a dict"
+        self.__check_columns(tuple(values))
+        # the fields left out keep their values
+        self.__checks.validate(self.field_dir, [values], defaults=False)
+        return self.__edit("update", _db, index, values)
+
+    def replace(self, _db: "Backend", values: list[Dict]) -> list:
+        """
+        rewrite the whole list, only the elements that differ are written
+        """
+        self.bind(values)
+        return self.execute(_db)
 
     def init_std_plan(self, table_name: str, _config_name: str):
-        def closure(values: str):
-            return self.__init_std_plan(table_name, _config_name, values)
+        self.__config_name = table_name
+        self.__read_columns = (_config_name,)
+        self.__update_sql = (
+            f"UPDATE {table_name} SET {_config_name} = ? WHERE {table_name}_id = ?"
+        )
+        self.__read_sql = (
+            f"SELECT {_config_name} FROM {table_name} WHERE {table_name}_id = ?"
+        )
+        self.__plan_callback = self.__bind_std
 
-        self.__plan_callback = closure
+    def init_ext_plan(
+            self, table_name: str, ext_table_name: str, _config_name: str, columns: list
+    ):
+        """
+        :param columns: columns of the struct table, without its id
+        """
+        self.__config_name = table_name
+        self.__ext_table_name = ext_table_name
+        self.__columns = self.__read_columns = tuple(columns)
 
-    def init_ext_plan(self, table_name: str, ext_table_name: str, _config_name: str):
-        def closure(values: dict):
-            return self.__init_ext_plan(
-                table_name, ext_table_name, _config_name, values
+        self.__update_sql = (
+            f"UPDATE {table_name} SET {_config_name} = ? WHERE {table_name}_id = ?"
+        )
+        self.__delete_sql = f"""
+            DELETE FROM {ext_table_name} WHERE {ext_table_name}_id = (
+                SELECT {_config_name} FROM {table_name} WHERE {table_name}_id = ?
+            )
+        """
+        self.__read_sql = f"""
+            SELECT {",".join(columns)} FROM {ext_table_name}
+            WHERE {ext_table_name}_id = (
+                SELECT {_config_name} FROM {table_name} WHERE {table_name}_id = ?
             )
+        """
+        self.__plan_callback = self.__bind_ext
 
-        self.__plan_callback = closure
+    def init_list_plan(
+            self, table_name: str, ext_table_name: str, columns: list, defaults: Optional[dict] = None
+    ):
+        """
+        :param columns: columns of the struct table, without its id
+        :param defaults: column -> literal DEFAULT of the struct table
+        """
+        self.__config_name = table_name
+        self.__ext_table_name = ext_table_name
+        self.__columns = self.__read_columns = tuple(columns)
+        self.__defaults = dict(defaults or {})
+
+        m2m_table = self.__link_table = f"{ext_table_name}_{table_name}"
 
-    def init_list_plan(self, table_name: str, ext_table_name: str):
-        def closure(values: list):
-            return self.__init_list_plan(table_name, ext_table_name, values)
+        self.__unlink_sql = (
+            f"DELETE FROM {m2m_table} "
+            f"WHERE {ext_table_name}_id = ? AND {table_name}_id = ?"
+        )
+        self.__delete_sql = (
+            f"DELETE FROM {ext_table_name} WHERE {ext_table_name}_id = ?"
+        )
+        self.__link_sql = (
+            f"INSERT INTO {m2m_table} "
+            f"({ext_table_name}_id, {table_name}_id, pos) VALUES (?, ?, ?)"
+        )
+        self.__unlink_all_sql = f"DELETE FROM {m2m_table} WHERE {table_name}_id = ?"
+        self.__relink_sql = (
+            f"UPDATE {m2m_table} SET {ext_table_name}_id = ? "
+            f"WHERE {ext_table_name}_id = ? AND {table_name}_id = ?"
+        )
+        self.__copy_sql = (
+            f"INSERT INTO {ext_table_name} ({ext_table_name}_id, {','.join(columns)}) "
+            f"SELECT ?, {','.join(columns)} FROM {ext_table_name} WHERE {ext_table_name}_id = ?"
+        )
+        self.__max_id_sql = (
+            f"SELECT COALESCE(MAX({ext_table_name}_id), 0) AS max_id FROM {ext_table_name}"
+        )
+        self.__max_pos_sql = (
+            f"SELECT MAX(pos) AS pos FROM {m2m_table} WHERE {table_name}_id = ?"
+        )
+        self.__count_sql = (
+            f"SELECT COUNT(*) AS size FROM {m2m_table} WHERE {table_name}_id = ?"
+        )
+
+        # links written before pos existed have none, they keep the id order
+        order = f"ORDER BY m.pos, m.{ext_table_name}_id"
+        self.__element_id_sql = (
+            f"SELECT m.{ext_table_name}_id FROM {m2m_table} m "
+            f"WHERE m.{table_name}_id = ? {order} LIMIT 1 OFFSET ?"
+        )
+        self.__elements_sql = f"""
+            SELECT m.{ext_table_name}_id, m.pos, {",".join(f"e.{c}" for c in columns)}
+            FROM {m2m_table} m
+            JOIN {ext_table_name} e ON e.{ext_table_name}_id = m.{ext_table_name}_id
+            WHERE m.{table_name}_id = ? {order}
+        """
+        # a config row of the history may read the links of an older one
+        self.__read_sql = f"""
+            SELECT {",".join(f"e.{c} AS {c}" for c in columns)}
+            FROM {m2m_table} m
+            JOIN {ext_table_name} e ON e.{ext_table_name}_id = m.{ext_table_name}_id
+            WHERE m.{table_name}_id = {links_of(m2m_table, "?1")} {order}
+        """
+        self.__plan_callback = self.__bind_list
 
-        self.__plan_callback = closure
+    def init_checks(self, checks: list):
+        """
+        :param checks: CHECKs of the rows the field writes, from compile_checks
+        """
+        self.__checks = Checks(checks)
 
     def bind(self, values):
-        self.__write_plans = []
-        self.__write_taps = []
-        self.__read_plans = []
-        self.__read_taps = []
-        self.__LR_state = "LR_VAL"
+        """
+        bind the values to write, the whole value is validated against the
+        CHECKs first, a LIST in one call
 
+        :raise CanfigException: when a CHECK fails, the plan keeps the values
+                                bound before
+        """
+        assert self.__plan_callback is not None, "init the plan before bind"
+
+        if self.__plan_callback == self.__bind_list and not (
+            isinstance(values, list) and all(isinstance(config, dict) for config in values)
+        ):
+            raise CanfigException(f"{self.field_dir} is a LIST, write a list of dicts")
+
+        if self.__checks:
+            if self.__plan_callback == self.__bind_std:
+                self.__checks.validate(self.field_dir, [{self.__read_columns[0]: values}])
+            elif self.__plan_callback == self.__bind_ext and isinstance(values, dict):
+                self.__checks.validate(self.field_dir, [values])
+            elif self.__plan_callback == self.__bind_list:
+                # every element is stored as an insert would store it
+                self.__checks.validate(self.field_dir, values, is_list=True)
         self.__plan_callback(values)
+        self.__bound = values
         self.__build_flag = True
 
-    def execute(self, _db: DB):
+    def __params(self, params: tuple) -> tuple:
+        # resolve LastRow against the last row state, CONFIG_ROW against the
+        # row written
+        if any(isinstance(p, (LastRow, ConfigRow)) for p in params):
+            return tuple(
+                self.__LR_state + p.offset if isinstance(p, LastRow)
+                else self.__row_id if p is CONFIG_ROW
+                else p
+                for p in params
+            )
+        return params
+
+    def write(self, _db: "Backend"):
+        """
+        write the bound values without the triggers, inside the transaction
+        of the caller
+        """
         assert self.__build_flag, "bind the plan before execute"
-        plan_cursor = 0
+        _db.write_field(self)
 
-        for tap in self.__write_taps:
-            if tap == self.Operation.UP_LR_STATE:
-                self.__LR_state = _db.get_lastrowid()
-            elif tap == self.Operation.EXECUTE:
-                _db.execute(self.__write_plans[plan_cursor]())
-                _db.commit()
-                plan_cursor += 1
-            else:
-                raise Exception("wrong plan operation")
+    def write_rows(self, _db: DB):
+        """
+        run the statements of the bound values in the database
+        """
+        assert self.__build_flag, "bind the plan before execute"
+
+        with _db.transaction():
+            plan_cursor = 0
+            self.__row_id = (
+                _db.config_row(self.__config_name, write=True)
+                if self.__link_table is None
+                else _db.list_row(self.__config_name, self.__link_table)
+            )
 
-        self.__LR_state = -1
+            try:
+                for tap in self.__write_taps:
+                    if tap == self.Operation.UP_LR_STATE:
+                        self.__LR_state = _db.get_lastrowid()
+                    elif tap == self.Operation.EXECUTE:
+                        sql, params = self.__write_plans[plan_cursor]
+                        _db.execute(sql, self.__params(params))
+                        plan_cursor += 1
+                    elif tap == self.Operation.DROP_REPLACED:
+                        if not _db.history.enabled:
+                            sql, params = self.__write_plans[plan_cursor]
+                            _db.execute(sql, self.__params(params))
+                        plan_cursor += 1
+                    elif tap == self.Operation.REPLACE_LIST:
+                        self.__replace_list(_db, self.__write_plans[plan_cursor][1])
+                        plan_cursor += 1
+                    else:
+                        raise Exception("wrong plan operation")
+            finally:
+                self.__LR_state = None
+                self.__row_id = None
+
+            _db.view_cache.invalidate(self.view_key)
+            if self.field_dir is not None:
+                _db.record_change(self.field_dir)
+
+    def execute(self, _db: "Backend") -> list:
+        """
+        write the bound values and run the triggers in one transaction, a
+        failed statement or trigger rolls the whole write back
 
-        # execute trigger callbacks
-        for callback_name, (trigger_func_str, env) in self.__write_callbacks.items():
-            if isinstance(ret := exec(trigger_func_str, env), TriggerException):
-                _db.rollback()
-                raise TriggerException(f"Trigger '{callback_name}' failed: {ret.message}")
+        :return: TriggerOutcome of the triggers run
+        """
+        with _db.transaction():
+            self.write(_db)
+            report = run_triggers(self.__write_callbacks, _db)
 
         print("execute success!")
+        return report
+
+    def view(self, _db: "Backend", mode: RowMode = RowMode.DICT, version: Optional[int] = None) -> list:
+        """
+        :param mode: RowMode.DICT, RowMode.ROW or RowMode.TUPLE, tuples skip
+                     building an object per row
+        :param version: committed version to read, needs the history on
+        """
+        columns, rows = _db.read_field(self, version)
+        if mode == RowMode.TUPLE:
+            return list(rows)
+        if mode == RowMode.DICT:
+            return _db.dict_rows(columns, rows)
+        if mode == RowMode.ROW:
+            return _db.sqlite_rows(columns, rows)
 
-    def view(self, _db: DB) -> list:
-        if not self.__build_flag:
-            return []
+        raise CanfigException(f"view does not support {mode}")
 
-        plan_cursor = 0
+    def read_rows(self, _db: DB, version: Optional[int] = None) -> tuple:
+        """
+        :return: (column names, row tuples) of the field in the database
+        """
+        if version is not None:
+            # a version never changes, its rows are not cached
+            (row_id,) = _db.config_rows([self.__config_name], version)
+            cached, cacheable = None, False
+        else:
+            # the cache holds tuples, they can be handed out without a copy
+            with _db.lock:
+                cached = _db.view_cache.get(self.view_key, _db.data_version())
+                generation = _db.view_cache.generation
+                # the cache is shared by every thread, it only holds committed
+                # rows: the transaction reads its own writes, and beside it
+                # the pool reads the last commit, stale once it commits
+                cacheable = not _db.in_transaction
+                row_id = _db.config_row(self.__config_name)
+
+        if cached is None:
+            with _db.reader() as cursor:
+                cursor.execute(self.__read_sql, (row_id,))
+                cached = (_db.columns(cursor, self.__read_sql), cursor.fetchall())
+            if cacheable:
+                with _db.lock:
+                    _db.view_cache.put(self.view_key, cached, generation)
+        return cached
+
+    def add_trigger(self, trigger_name: str, trigger_code, env: dict):
+        """
+        :param trigger_code: code object (or source) of the trigger body
+        :param env: globals the trigger runs with
+        """
+        self.__write_callbacks[trigger_name] = (trigger_code, env)
+
+    @property
+    def triggers(self) -> Dict[str, tuple]:
+        return self.__write_callbacks
 
-        for tap in self.__read_taps:
-            if tap == self.Operation.EXECUTE:
-                _db.execute(self.__read_plans[plan_cursor]())
-                plan_cursor += 1
+    @property
+    def view_key(self):
+        """
+        :return: key of the rows of the field in the view cache, shared by
+                 every plan of the field
+        """
+        return self if self.field_dir is None else self.field_dir
 
-        return _db.fetchall()
+    @property
+    def config_name(self) -> str:
+        return self.__config_name
 
-    def add_trigger(self, trigger_name: str, trigger_func_str: str, env: dict):
-        self.__write_callbacks[trigger_name] = (trigger_func_str, env)
+    @property
+    def ext_table(self) -> str | None:
+        return self.__ext_table_name
+
+    @property
+    def kind(self) -> str:
+        """
+        :return: "std", "ext" or "list", as the field spec of the schema
+        """
+        if self.__plan_callback == self.__bind_list:
+            return "list"
+        return "ext" if self.__plan_callback == self.__bind_ext else "std"
+
+    @property
+    def read_columns(self) -> tuple:
+        return self.__read_columns
+
+    @property
+    def bound(self):
+        """
+        :return: the value of the last bind()
+        """
+        return self.__bound
+
+    @property
+    def read_plans(self) -> list:
+        """
+        :return: (sql, params) of every query the plan reads with
+        """
+        ret = [(self.__read_sql, (self.CONFIG_ROW_ID,))]
+        if self.__plan_callback == self.__bind_list:
+            ret += [
+                (self.__elements_sql, (self.CONFIG_ROW_ID,)),
+                (self.__element_id_sql, (self.CONFIG_ROW_ID, 0)),
+                (self.__count_sql, (self.CONFIG_ROW_ID,)),
+                (self.__max_pos_sql, (self.CONFIG_ROW_ID,)),
+            ]
+        return ret
 
     def __str__(self):
         plan_cursor = 0
@@ -371,8 +1534,14 @@ class Plan:
                 ret += f"\nStep {i + 1}: \n"
                 if tap == self.Operation.UP_LR_STATE:
                     ret += "\n\t\tUPDATE LR_VAL\n"
-                elif tap == self.Operation.EXECUTE:
-                    ret += self.__write_plans[plan_cursor]()
+                elif tap in (self.Operation.EXECUTE, self.Operation.DROP_REPLACED):
+                    sql, params = self.__write_plans[plan_cursor]
+                    ret += f"\t\t{sql.strip()}\n\t\t{list(params)}\n"
+                    plan_cursor += 1
+                elif tap == self.Operation.REPLACE_LIST:
+                    _, values = self.__write_plans[plan_cursor]
+                    ret += f"\t\tREPLACE LIST BY DIFF ({len(values)} element(s))\n"
+                    ret += "".join(f"\t\t{config}\n" for config in values)
                     plan_cursor += 1
                 else:
                     raise Exception("wrong plan operation")
@@ -382,19 +1551,10 @@ class Plan:
             ret += "\nNOT BUILD YET\n"
         ret += "-" * 20
 
-        plan_cursor = 0
-        ret += f"\nRead Plan (total: {len(self.__read_taps)})\n"
+        ret += "\nRead Plan (total: 1)\n"
         ret += "-" * 20
         if self.__build_flag:
-            for i, tap in enumerate(self.__read_taps):
-                ret += f"\nStep {i + 1}: \n"
-                if tap == self.Operation.EXECUTE:
-                    ret += self.__read_plans[plan_cursor]()
-                    plan_cursor += 1
-                else:
-                    raise Exception("wrong plan operation")
-
-            ret += "\n"
+            ret += f"\nStep 1: \n\t\t{self.__read_sql.strip()}\n\t\t[{self.CONFIG_ROW_ID}]\n"
         else:
             ret += "\nNOT BUILD YET\n"
         ret += "-" * 20
@@ -402,6 +1562,17 @@ class Plan:
         return ret
 
 
+def run_triggers(callbacks: Dict[str, tuple], _db: Backend) -> list:
+    """
+    run the triggers concurrently on the trigger engine, for the open
+    transaction of _db
+
+    :param callbacks: trigger name -> (trigger code, env)
+    :return: TriggerOutcome of every trigger
+    """
+    return ENGINE.run(callbacks, _db.trigger_token)
+
+
 class PreSQL:
     def __init__(self, table_name: str, pre_sql: str, arg_rule: tuple):
         self.__pre_sql = CREATE_TABLE_plan(table_name, pre_sql)
@@ -431,11 +1602,35 @@ class PreSQL:
         return re.sub(r"\((\d+)\)", r"_\1", struct_name)
 
 
-def assign_plan(_final_plan, _plan, _for) -> Plan:
-    print(f"assign {_plan['name']}.{_for}")
-    if _plan["name"] not in _final_plan:
-        _final_plan[_plan["name"]] = {}
+def assign_plan(_final_plan, _config, _for) -> Plan:
+    print(f"assign {_config}.{_for}")
+    if _config not in _final_plan:
+        _final_plan[_config] = {}
+
+    assert _for not in _final_plan[_config], f"{_for} already init"
+    _final_plan[_config][_for] = Plan(f"{_config}.{_for}")
+    return _final_plan[_config][_for]
 
-    assert _for not in _final_plan[_plan["name"]], f"{_for} already init"
-    _final_plan[_plan["name"]][_for] = Plan()
-    return _final_plan[_plan["name"]][_for]
+
+def init_plan(plan: Plan, config: str, field: str, spec: dict) -> Plan:
+    """
+    :param spec: spec of the field, from resolve_schema
+    """
+    if spec["kind"] == "list":
+        plan.init_list_plan(
+            table_name=config,
+            ext_table_name=spec["ext_table"],
+            columns=spec["columns"],
+            defaults=spec.get("defaults"),
+        )
+    elif spec["kind"] == "ext":
+        plan.init_ext_plan(
+            table_name=config,
+            ext_table_name=spec["ext_table"],
+            _config_name=field,
+            columns=spec["columns"],
+        )
+    else:
+        plan.init_std_plan(table_name=config, _config_name=field)
+    plan.init_checks(spec.get("checks", []))
+    return plan
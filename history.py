@@ -0,0 +1,336 @@
+"""
+Config history: with history on, a committed config row is never written
+again. The first write of a transaction to a config copies its row to a new
+row; the commit records the new row as the config at its write version.
+
+the LIST links are not copied with the row, the new row shares the links of
+the row it was copied from until the transaction writes the LIST: a commit
+copies the links of the LISTs it writes only.
+
+    _canfig_history     (config, version) -> row id of the config from that
+                        version on
+    _canfig_links       (link table, row id) -> row whose links the config row
+                        reads, a row without entry reads its own
+
+reading a version looks up the last row of each config at or before it, so
+a pinned reader only sees rows no writer touches. Rolling back to a version
+commits a new version made of the rows of that version, nothing is copied.
+"""
+
+import collections
+
+from utils import CanfigException
+
+# row of a config that was never written with history on
+CONFIG_ROW_ID = 1
+
+# oldest version whose rows are kept, moved up by prune()
+HISTORY_FROM_KEY = "history_from"
+
+# versions a commit may add before the old ones are pruned, by default. A
+# prune scans every config row and link, more often only adds that scan to
+# more commits
+PRUNE_INTERVAL = 100
+
+# rows of the versions read last, a version never changes once committed
+PINNED_CACHE_SIZE = 64
+
+_ROWS_AT_SQL = """
+    SELECT config, row_id FROM _canfig_history h
+    WHERE version = (
+        SELECT MAX(version) FROM _canfig_history
+        WHERE config = h.config AND version <= ?
+    )
+"""
+_LIVE_ROWS_SQL = """
+    SELECT config, row_id FROM _canfig_history h
+    WHERE version = (SELECT MAX(version) FROM _canfig_history WHERE config = h.config)
+"""
+_RECORD_SQL = "INSERT OR REPLACE INTO _canfig_history (config, version, row_id) VALUES (?, ?, ?)"
+_HISTORY_FROM_SQL = "SELECT value FROM _canfig_meta WHERE key = ?"
+_SET_HISTORY_FROM_SQL = "INSERT OR REPLACE INTO _canfig_meta (key, value) VALUES (?, ?)"
+# an entry is superseded when a later one of its config is already live at cutoff
+_PRUNE_ENTRIES_SQL = """
+    DELETE FROM _canfig_history
+    WHERE version < ? AND EXISTS (
+        SELECT 1 FROM _canfig_history n
+        WHERE n.config = _canfig_history.config
+        AND n.version > _canfig_history.version AND n.version <= ?
+    )
+"""
+_SHARE_LINKS_SQL = """
+    INSERT INTO _canfig_links (link, row_id, owner) VALUES (?1, ?2, COALESCE(
+        (SELECT owner FROM _canfig_links WHERE link = ?1 AND row_id = ?3), ?3
+    ))
+"""
+_OWNER_SQL = "SELECT owner FROM _canfig_links WHERE link = ? AND row_id = ?"
+_UNSHARE_SQL = "DELETE FROM _canfig_links WHERE link = ? AND row_id = ?"
+_VERSIONS_SQL = """
+    SELECT h.version, c.committed_at, group_concat(h.config, ',') AS configs
+    FROM _canfig_history h
+    LEFT JOIN _canfig_changelog c ON c.version = h.version
+    WHERE h.version > ?
+    GROUP BY h.version ORDER BY h.version DESC LIMIT ?
+"""
+
+
+def links_of(link: str, row: str) -> str:
+    """
+    :param row: sql expression of the config row id
+    :return: sql expression of the row id the links of row are keyed by in
+             the link table
+    """
+    return (
+        f"COALESCE((SELECT owner FROM _canfig_links WHERE link = '{link}' "
+        f"AND row_id = {row}), {row})"
+    )
+
+
+class History:
+    """
+    row of every config, at the last commit or at a pinned version
+    """
+
+    def __init__(self, keep: int = 0, prune_every: int = PRUNE_INTERVAL):
+        """
+        :param keep: versions kept for rollback and pinned reads, 0 turns the
+                     history off and writes the config rows in place
+        :param prune_every: the commit of every prune_every-th version prunes
+                            the versions older than the last keep
+        """
+        assert keep >= 0, "history keeps a positive number of versions"
+        assert prune_every > 0, "history prunes every positive number of versions"
+        self.keep = keep
+        self.prune_every = prune_every
+
+        # config -> row id at the last commit, reloaded when another
+        # connection commits
+        self.__live: dict | None = None
+        self.__data_version = None
+        self.__pinned: collections.OrderedDict = collections.OrderedDict()
+
+        # read from the schema on first use
+        self.__columns: dict = {}
+        self.__references: dict | None = None
+        # config -> statement copying its row
+        self.__copy_sqls: dict = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.keep > 0
+
+    def schema_changed(self):
+        self.__columns.clear()
+        self.__references = None
+        self.__copy_sqls.clear()
+
+    def __query(self, _db, sql: str, args: tuple = ()) -> list:
+        # before migrate the history tables do not exist, nothing is recorded
+        try:
+            with _db.reader() as cursor:
+                return cursor.execute(sql, args).fetchall()
+        except CanfigException as e:
+            if "no such table" in str(e):
+                return []
+            raise
+
+    def live_rows(self, _db) -> dict:
+        """
+        :return: config -> row id at the last commit, call under _db.lock
+        """
+        data_version = _db.data_version()
+        if self.__live is None or data_version != self.__data_version:
+            self.__live = dict(self.__query(_db, _LIVE_ROWS_SQL))
+            self.__data_version = data_version
+            self.__pinned.clear()
+        return self.__live
+
+    def history_from(self, _db) -> int | None:
+        """
+        :return: oldest version that can be read or restored, None before the
+                 first version recorded
+        """
+        rows = self.__query(_db, _HISTORY_FROM_SQL, (HISTORY_FROM_KEY,))
+        return int(rows[0][0]) if rows else None
+
+    def rows_at(self, _db, version: int) -> dict:
+        """
+        :return: config -> row id at version
+        """
+        if (rows := self.__pinned.get(version)) is not None:
+            self.__pinned.move_to_end(version)
+            return rows
+
+        oldest = self.history_from(_db)
+        latest = _db.read_write_version() or 0
+        if oldest is None or not oldest <= version <= latest:
+            raise CanfigException(
+                f"version {version} not in history"
+                + (f", versions {oldest} to {latest} are kept" if oldest is not None else "")
+            )
+
+        rows = dict(self.__query(_db, _ROWS_AT_SQL, (version,)))
+        self.__pinned[version] = rows
+        if len(self.__pinned) > PINNED_CACHE_SIZE:
+            self.__pinned.popitem(last=False)
+        return rows
+
+    def versions(self, _db, limit: int = 20) -> list:
+        """
+        :return: (version, committed_at, configs written) of the last
+                 versions, newest first
+        """
+        since = self.history_from(_db)
+        if since is None:
+            return []
+        return [
+            (version, committed_at, configs.split(","))
+            for version, committed_at, configs in self.__query(_db, _VERSIONS_SQL, (since, limit))
+        ]
+
+    def __table_columns(self, _db, config: str) -> str:
+        if (columns := self.__columns.get(config)) is None:
+            columns = self.__columns[config] = ", ".join(
+                row[1]
+                for row in self.__query(_db, f"PRAGMA table_info({config})")
+                if row[1] != f"{config}_id"
+            )
+        return columns
+
+    def references(self, _db) -> dict:
+        """
+        :return: table -> (referencing table, column) of every foreign key
+                 to it, the LIST links of a config and the struct fields
+        """
+        if self.__references is None:
+            self.__references = {}
+            for (table,) in self.__query(_db, "SELECT name FROM _canfig_schema"):
+                for row in self.__query(_db, f"PRAGMA foreign_key_list({table})"):
+                    # id, seq, table, from, to, ...
+                    self.__references.setdefault(row[2], []).append((table, row[3]))
+        return self.__references
+
+    def __links(self, _db, config: str) -> list:
+        # LIST join tables of the config, keyed by (element, config)
+        return [
+            (table, column)
+            for table, column in self.references(_db).get(config, [])
+            if table != config
+        ]
+
+    def copy(self, _db, config: str, row_id: int) -> int:
+        """
+        copy the config row in the open transaction, the new row shares the
+        LIST links of row_id
+
+        :return: id of the new row
+        """
+        if (sql := self.__copy_sqls.get(config)) is None:
+            columns = self.__table_columns(_db, config)
+            sql = self.__copy_sqls[config] = (
+                f"INSERT INTO {config} ({columns}) SELECT {columns} FROM {config} "
+                f"WHERE {config}_id = ?"
+                if columns
+                else f"INSERT INTO {config} DEFAULT VALUES"
+            )
+        _db.execute(sql, (row_id,) if "?" in sql else None)
+        new_id = _db.get_lastrowid()
+
+        if links := self.__links(_db, config):
+            _db.executemany(_SHARE_LINKS_SQL, [(table, new_id, row_id) for table, _ in links])
+        return new_id
+
+    def own_links(self, _db, link: str, column: str, row_id: int):
+        """
+        copy the links row_id shares to it, before the open transaction
+        writes them
+
+        :param link: link table of a LIST of the config
+        :param column: column of the link table keyed by the config row
+        """
+        with _db.lock:
+            # the entry is written by the open transaction, not committed yet
+            _db.execute(_OWNER_SQL, (link, row_id))
+            if not (owner := _db.cursor.fetchall()):
+                return
+        other = [c for c in self.__table_columns(_db, link).split(", ") if c != column]
+        _db.execute(
+            f"INSERT INTO {link} ({column}, {', '.join(other)}) "
+            f"SELECT ?, {', '.join(other)} FROM {link} WHERE {column} = ?",
+            (row_id, owner[0][0]),
+        )
+        _db.execute(_UNSHARE_SQL, (link, row_id))
+
+    def record(self, _db, version: int, rows: dict):
+        """
+        record rows as the configs at version, in the committing transaction
+        """
+        if (oldest := self.history_from(_db)) is None:
+            # the rows before the first version were written in place
+            oldest = version - 1
+            _db.execute(_SET_HISTORY_FROM_SQL, (HISTORY_FROM_KEY, str(oldest)))
+
+        live = self.live_rows(_db)
+        entries = []
+        for config, row_id in rows.items():
+            if config not in live:
+                # the row the config had until now
+                entries.append((config, oldest, CONFIG_ROW_ID))
+            entries.append((config, version, row_id))
+        _db.executemany(_RECORD_SQL, entries)
+
+        if self.enabled and version % self.prune_every == 0:
+            self.prune(_db, version)
+
+    def committed(self, rows: dict):
+        if self.__live is not None:
+            self.__live.update(rows)
+
+    def prune(self, _db, version: int) -> int:
+        """
+        drop the versions older than the last self.keep, their config rows,
+        links and the struct rows only they referenced
+
+        :return: number of config rows deleted
+        """
+        cutoff = version - self.keep
+        if (oldest := self.history_from(_db)) is None or cutoff <= oldest:
+            return 0
+
+        _db.execute(_PRUNE_ENTRIES_SQL, (cutoff, cutoff))
+        _db.execute(_SET_HISTORY_FROM_SQL, (HISTORY_FROM_KEY, str(cutoff)))
+
+        configs = [row[0] for row in self.__query(_db, "SELECT DISTINCT config FROM _canfig_history")]
+
+        deleted = 0
+        kept = "SELECT row_id FROM _canfig_history WHERE config = ?"
+        # a kept row may read the links of a dropped one, these are kept
+        shared = f"SELECT owner FROM _canfig_links WHERE link = ? AND row_id IN ({kept})"
+        for config in configs:
+            links = self.__links(_db, config)
+            for table, column in links:
+                _db.execute(
+                    f"DELETE FROM {table} WHERE {column} NOT IN ({kept}) "
+                    f"AND {column} NOT IN ({shared})",
+                    (config, table, config),
+                )
+            _db.execute(f"DELETE FROM {config} WHERE {config}_id NOT IN ({kept})", (config,))
+            deleted += _db.cursor.rowcount
+            for table, _ in links:
+                _db.execute(
+                    f"DELETE FROM _canfig_links WHERE link = ? AND row_id NOT IN ({kept})",
+                    (table, config),
+                )
+
+        # struct rows referenced by no config row nor LIST link left
+        structs = self.__query(_db, "SELECT name FROM _canfig_schema WHERE kind = 'STRUCT'")
+        for (table,) in structs:
+            if not (refs := self.references(_db).get(table)):
+                continue
+            selects = " UNION ALL ".join(
+                f"SELECT {column} FROM {ref} WHERE {column} IS NOT NULL" for ref, column in refs
+            )
+            _db.execute(f"DELETE FROM {table} WHERE {table}_id NOT IN ({selects})")
+
+        self.__pinned.clear()
+        return deleted
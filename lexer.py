@@ -0,0 +1,251 @@
+"""
+Native lexer for Canfig, follow the same rules as ast.mll but run in-process.
+
+Tokens are yielded one by one, so the parser can consume the stream without
+the `./ast` subprocess and the `.cando` round trip.
+"""
+
+import re
+from typing import Iterator
+
+from common import Token, TokenType
+from utils import CanfigException
+
+TAG_TOKENS = {
+    "@version": TokenType.VERSION,
+    "@min_sup": TokenType.MIN_SUP,
+    "@author": TokenType.AUTHOR,
+    "@description": TokenType.DESCRIPTION,
+    "@log": TokenType.LOG,
+    "@doc": TokenType.DOC,
+    "@help": TokenType.HELP,
+    "@storage": TokenType.STORAGE,
+}
+
+KEYWORD_TOKENS = {
+    "STRUCT": TokenType.STRUCT,
+    "CONFIG": TokenType.CONFIG,
+    "TRIGGER": TokenType.TRIGGER,
+    "SLICE": TokenType.SLICE,
+}
+
+# top level rules, the order resolve the same ties as ocamllex longest match,
+# leading whitespace is skipped as part of the match
+_TOKEN_RE = re.compile(
+    r"""
+    [ \t\n\r]*
+    (?:
+      (?P<tag>@(?:version|min_sup|author|description|log|doc|help|storage))
+    | (?P<tricond>WHEN\ CHANGE)
+    | (?P<ident>[A-Z_][a-zA-Z_]*)
+    | (?P<comment>\(\*)
+    | (?P<line_comment>//)
+    | (?P<string>")
+    | (?P<semi>;)
+    | (?P<equal>=)
+    | (?P<argument>\()
+    | (?P<command>\{)
+    | (?P<close_comment>\*\))
+    | (?P<close_argument>\))
+    | (?P<close_command>\})
+    | (?P<eof>$)
+    )
+    """,
+    re.VERBOSE,
+)
+
+_COMMAND_RE = re.compile(r"\{|\}|\(\*|\*\)")
+_COMMENT_RE = re.compile(r"\(\*|\*\)")
+_STRING_RE = re.compile(r'((?:[^"\\]|\\.)*)"', re.DOTALL)
+_ESCAPE_RE = re.compile(r"\\(?:([\\'\"tnrb ])|([0-7]{3})|[\n\r][ \t]*)")
+
+_ESCAPES = {
+    "\\": "\\",
+    "'": "'",
+    '"': '"',
+    "t": "\t",
+    "n": "\n",
+    "r": "\r",
+    "b": "\b",
+    " ": " ",
+}
+
+
+def _raise_at(source: str, pos: int, msg: str):
+    line = source.count("\n", 0, pos) + 1
+    col = pos - source.rfind("\n", 0, pos)
+    raise CanfigException(f"lexing error at line {line}, column {col}: {msg}")
+
+
+def _unescape(match) -> str:
+    if match.group(1) is not None:
+        return _ESCAPES[match.group(1)]
+    if match.group(2) is not None:
+        return chr(int(match.group(2), 8))
+    # escaped line break, skip the indentation of the next line
+    return ""
+
+
+def _skip_comment(source: str, pos: int) -> int:
+    """
+    :param pos: position right after the opening '(*'
+    :return: position right after the matching '*)'
+    """
+    level = 1
+    while True:
+        match = _COMMENT_RE.search(source, pos)
+        if match is None:
+            _raise_at(source, pos, "unmatched open comment")
+
+        pos = match.end()
+        if match.group() == "(*":
+            level += 1
+        else:
+            level -= 1
+            if level == 0:
+                return pos
+
+
+def _command(source: str, pos: int) -> tuple[str, int]:
+    level = 1
+    start = pos
+    parts = []
+
+    while True:
+        match = _COMMAND_RE.search(source, pos)
+        if match is None:
+            _raise_at(source, start, "unmatched command block")
+
+        sym = match.group()
+        if sym == "{":
+            level += 1
+            pos = match.end()
+        elif sym == "}":
+            level -= 1
+            if level == 0:
+                parts.append(source[start : match.start()])
+                return "".join(parts), match.end()
+            pos = match.end()
+        elif sym == "(*":
+            # comments are dropped from the command body
+            parts.append(source[start : match.start()])
+            pos = start = _skip_comment(source, match.end())
+        else:
+            _raise_at(source, match.start(), "unmatched closed comment")
+
+
+def _string(source: str, pos: int) -> tuple[str, int]:
+    match = _STRING_RE.match(source, pos)
+    if match is None:
+        _raise_at(source, pos, "unterminated string")
+
+    body = match.group(1)
+    if "\\" in body:
+        body = _ESCAPE_RE.sub(_unescape, body)
+    return body, match.end()
+
+
+def lex(source: str) -> Iterator[Token]:
+    """
+    :param source: content of a .cand file
+    :return: generator of tokens, EOF is not yielded (same as the ast output)
+    """
+    pos = 0
+    end = len(source)
+    token_match = _TOKEN_RE.match
+
+    while pos < end:
+        match = token_match(source, pos)
+        if match is None:
+            pos += len(source[pos:]) - len(source[pos:].lstrip(" \t\n\r"))
+            _raise_at(source, pos, f"unexpected character {source[pos]!r}")
+
+        kind = match.lastgroup
+        pos = match.end()
+
+        if kind == "ident":
+            ident = match.group(kind)
+            if ident in KEYWORD_TOKENS:
+                yield Token(KEYWORD_TOKENS[ident])
+            else:
+                yield Token(TokenType.IDENT, ident)
+        elif kind == "semi":
+            yield Token(TokenType.SEMI)
+        elif kind == "command":
+            value, pos = _command(source, pos)
+            yield Token(TokenType.COMMAND, value)
+        elif kind == "string":
+            value, pos = _string(source, pos)
+            yield Token(TokenType.STRING, value)
+        elif kind == "tag":
+            yield Token(TAG_TOKENS[match.group(kind)])
+        elif kind == "tricond":
+            yield Token(TokenType.TRICOND)
+        elif kind == "argument":
+            if (close := source.find(")", pos)) == -1:
+                _raise_at(source, match.start(kind), "unmatched ()")
+            yield Token(TokenType.ARGUMENT, source[pos:close])
+            pos = close + 1
+        elif kind == "equal":
+            if (semi := source.find(";", pos)) == -1:
+                _raise_at(source, match.start(kind), "'=' without ending ';'")
+            yield Token(TokenType.COMMAND, source[pos:semi])
+            pos = semi
+        elif kind == "comment":
+            pos = _skip_comment(source, pos)
+        elif kind == "line_comment":
+            if (pos := source.find("\n", pos)) == -1:
+                return
+        elif kind == "close_comment":
+            _raise_at(source, match.start(kind), "unmatched closed comment")
+        elif kind == "close_argument":
+            _raise_at(source, match.start(kind), "unmatched ()")
+        elif kind == "eof":
+            return
+        else:
+            _raise_at(source, match.start(kind), "unmatched command block")
+
+
+_BOUNDARY_RE = re.compile(r'[;"{(=]|//')
+
+
+def split_declarations(source: str) -> list[str]:
+    """
+    cut source into top level declarations, each ends with its ';'
+
+    only the bodies that can hide a ';' are skipped (strings, commands,
+    arguments and comments), malformed input is left in the last piece for
+    `lex` to report
+    """
+    decls = []
+    start = pos = 0
+
+    try:
+        while (match := _BOUNDARY_RE.search(source, pos)) is not None:
+            sym = match.group()
+            pos = match.end()
+
+            if sym == ";":
+                decls.append(source[start:pos])
+                start = pos
+            elif sym == '"':
+                _, pos = _string(source, pos)
+            elif sym == "{":
+                _, pos = _command(source, pos)
+            elif sym == "(":
+                if source.startswith("*", pos):
+                    pos = _skip_comment(source, pos + 1)
+                elif (pos := source.find(")", pos) + 1) == 0:
+                    break
+            elif sym == "=":
+                if (pos := source.find(";", pos)) == -1:
+                    break
+            elif (pos := source.find("\n", pos)) == -1:
+                break
+    except CanfigException:
+        pass
+
+    if start < len(source):
+        decls.append(source[start:])
+
+    return decls
@@ -0,0 +1,442 @@
+"""
+In-memory backend: the value of every config field is kept in a dict and
+written at once, a background thread persists the commits to a DB.
+
+    values["Config.field"] = (column names, row tuples)
+
+the same rows Plan.read_rows reads from sqlite, so plans, triggers and
+slices work unchanged on top of it. A commit hands its writes to the
+write-behind thread through a bounded queue: a writer waits while
+WRITE_BEHIND_QUEUE commits are not persisted yet, which bounds the lag.
+The thread persists the commits queued meanwhile in one sqlite
+transaction. A commit sqlite rejects is reported by flush() and its fields
+are read back from sqlite.
+
+every commit is published to commit_listeners as a ChangeEvent of the
+memory write version, no changelog is kept: a watcher resuming from an
+older version gets a reset event. Versions are kept by the database, a
+rollback persists the pending commits, restores the database and reads
+the moved configs back.
+"""
+
+import collections
+import contextlib
+import copy
+import queue
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from changefeed import ChangeEvent
+from checks import UNKNOWN, affinity, stored
+from evaluator import DB, Backend, Plan, init_plan
+from utils import CanfigException
+
+# commits written in memory and not persisted yet, before a writer waits
+WRITE_BEHIND_QUEUE = 1024
+
+# queued commits persisted in one sqlite transaction at most
+WRITE_BEHIND_BATCH = 256
+
+
+class MemoryBackend(Backend):
+    """
+    fields in memory in front of a DB, the DB is closed with it
+    """
+
+    # a watcher resuming from an older version reads everything again
+    keeps_changelog = False
+
+    def __init__(self, _db: DB, fields: dict):
+        """
+        :param _db: database the fields are warmed from and persisted to
+        :param fields: config -> field -> spec, from resolve_schema
+        """
+        super().__init__()
+        self.db = _db
+        self.lock = threading.RLock()
+        self.values: Dict[str, tuple] = {}
+
+        # plans of the write-behind thread, the ones of the callers keep
+        # their own bound values
+        self.__plans: Dict[str, Plan] = {
+            f"{config}.{field}": init_plan(Plan(f"{config}.{field}"), config, field, spec)
+            for config, config_fields in fields.items()
+            for field, spec in config_fields.items()
+        }
+        # struct table -> column -> DEFAULT, for the columns a write leaves out
+        self.__defaults: Dict[str, dict] = {}
+        # table -> column -> affinity, a value is kept as sqlite stores it
+        self.__affinities: Dict[str, dict] = {}
+        # converts the values the validator cannot tell, a column per affinity
+        self.__scratch = sqlite3.connect(":memory:", check_same_thread=False)
+        self.__scratch.execute(
+            "CREATE TABLE affinity (INTEGER_ INTEGER, NUMERIC_ NUMERIC, REAL_ REAL, TEXT_ TEXT, BLOB_ BLOB)"
+        )
+        self.__scratch_lock = threading.Lock()
+
+        # a transaction at a time, nested ones run on the thread of the outer
+        # one or on its triggers. Each level holds the rows it wrote and the
+        # writes to persist
+        self.__writer = threading.Lock()
+        self.__depth = 0
+        self.__owner = None
+        self.__levels: list = []
+
+        self.__queue: queue.Queue = queue.Queue(WRITE_BEHIND_QUEUE)
+        # "Config.field" -> queued commits writing it
+        self.__pending: collections.Counter = collections.Counter()
+        self.__failures: list = []
+
+        # called with the ChangeEvent of every commit, as DB.commit_listeners
+        self.commit_listeners: list = []
+        # config -> changed fields -> their new values, recorded with the events
+        self.change_values: Optional[Callable] = None
+
+        self.warm()
+        self.__persister = threading.Thread(target=self.__persist, daemon=True)
+        self.__persister.start()
+
+    def warm(self):
+        """
+        read every field from the database
+        """
+        with self.lock:
+            for field_dir, plan in self.__plans.items():
+                self.values[field_dir] = plan.read_rows(self.db)
+                if (table := self.__table(plan)) not in self.__affinities:
+                    self.__read_table_info(table)
+            self.write_version = self.db.read_write_version() or 0
+
+    @staticmethod
+    def __table(plan: Plan) -> str:
+        """
+        :return: table the rows of a plan are read from
+        """
+        return plan.config_name if plan.ext_table is None else plan.ext_table
+
+    def __read_table_info(self, table: str):
+        with self.db.reader() as cursor:
+            info = cursor.execute(f"PRAGMA table_info({table})").fetchall()
+        self.__affinities[table] = {name: affinity(declared) for _, name, declared, _, _, _ in info}
+
+        # a DEFAULT is a constant expression, evaluated once
+        self.__defaults[table] = {
+            name: self.__stored(table, name, self.__scratch.execute(f"SELECT {default}").fetchone()[0])
+            for _, name, _, _, default, _ in info
+            if default is not None
+        }
+
+    def __stored(self, table: str, column: str, value):
+        """
+        :return: value as the column stores it
+        """
+        aff = self.__affinities[table].get(column, "BLOB")
+        if (ret := stored(aff, value)) is not UNKNOWN:
+            return ret
+        with self.__scratch_lock:
+            try:
+                self.__scratch.execute(f"INSERT INTO affinity ({aff}_) VALUES (?)", (value,))
+                return self.__scratch.execute(f"SELECT {aff}_ FROM affinity").fetchone()[0]
+            finally:
+                self.__scratch.execute("DELETE FROM affinity")
+
+    @property
+    def in_transaction(self) -> bool:
+        return self.__depth > 0
+
+    @property
+    def lag(self) -> int:
+        """
+        :return: commits not persisted yet
+        """
+        return self.__queue.unfinished_tasks
+
+    def __sees_pending(self) -> bool:
+        # the thread of the transaction and its triggers see its writes
+        return self.runs_transaction(self.__owner)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.check_trigger()
+        outer = not (self.__depth and self.__sees_pending())
+        if outer:
+            self.__writer.acquire()
+            self.__owner = threading.get_ident()
+            self.trigger_token = object()
+        else:
+            # nested blocks of concurrent triggers run one after the other
+            self.lock.acquire()
+            # the transaction may have ended while the trigger waited
+            try:
+                self.check_trigger()
+            except CanfigException:
+                self.lock.release()
+                raise
+
+        with self.lock:
+            self.__depth += 1
+            self.__levels.append(({}, []))
+
+        try:
+            yield self
+        except BaseException:
+            with self.lock:
+                self.__depth -= 1
+                self.__levels.pop()
+            if outer:
+                self.__owner = self.trigger_token = None
+                self.__writer.release()
+            else:
+                self.lock.release()
+            raise
+
+        if not outer:
+            try:
+                self.__depth -= 1
+                rows, writes = self.__levels.pop()
+                self.__levels[-1][0].update(rows)
+                self.__levels[-1][1].extend(writes)
+            finally:
+                self.lock.release()
+            return
+
+        event = None
+        try:
+            with self.lock:
+                self.__depth -= 1
+                rows, writes = self.__levels.pop()
+                self.__owner = self.trigger_token = None
+                self.values.update(rows)
+                if writes:
+                    self.write_version += 1
+                    self.__pending.update({field_dir for field_dir, _, _ in writes})
+                    event = self.__event(writes)
+            if writes:
+                # waits while the write-behind thread lags
+                self.__queue.put(writes)
+        finally:
+            self.__writer.release()
+
+        if event is not None:
+            for listener in self.commit_listeners:
+                listener(event)
+
+    def __event(self, writes: list) -> ChangeEvent:
+        changes: Dict[str, list] = {}
+        for field_dir in sorted({field_dir for field_dir, _, _ in writes}):
+            config_n, field_n = field_dir.split(".")
+            changes.setdefault(config_n, []).append(field_n)
+        values = self.change_values(changes) if self.change_values else None
+        return ChangeEvent(self.write_version, time.time(), changes, values)
+
+    def __level(self) -> tuple:
+        assert self.__levels, "write the memory backend inside a transaction"
+        return self.__levels[-1]
+
+    def __current(self, field_dir: str) -> tuple:
+        if self.__levels and self.__sees_pending():
+            with self.lock:
+                for rows, _ in reversed(self.__levels):
+                    if (ret := rows.get(field_dir)) is not None:
+                        return ret
+        return self.values[field_dir]
+
+    def __rows(self, plan: Plan, value) -> list:
+        """
+        :return: row tuples of a value bound to plan, as sqlite stores them
+        """
+        table = self.__table(plan)
+        if plan.kind == "std":
+            return [(self.__stored(table, plan.read_columns[0], value),)]
+
+        defaults = self.__defaults.get(table, {})
+        columns = plan.read_columns
+        if plan.kind == "ext":
+            value = [value]
+        return [
+            tuple(self.__stored(table, c, config[c]) if c in config else defaults.get(c) for c in columns)
+            for config in value
+        ]
+
+    def read_field(self, plan: Plan, version: Optional[int] = None) -> tuple:
+        if version is not None:
+            raise CanfigException("the memory backend keeps no version, read it from the database")
+        return self.__current(plan.field_dir)
+
+    def write_field(self, plan: Plan):
+        value = copy.deepcopy(plan.bound)
+        rows = self.__rows(plan, value)
+        with self.lock:
+            level_rows, writes = self.__level()
+            level_rows[plan.field_dir] = (plan.read_columns, rows)
+            writes.append((plan.field_dir, "set", (value,)))
+
+    def edit_field(self, plan: Plan, edit: str, *args):
+        args = copy.deepcopy(args)
+        with self.lock:
+            level_rows, writes = self.__level()
+            columns, rows = self.__current(plan.field_dir)
+            rows = list(rows)
+
+            if edit == "append":
+                rows.extend(self.__rows(plan, args[0]))
+            else:
+                index = args[0]
+                if not -len(rows) <= index < len(rows):
+                    raise CanfigException(
+                        f"index {index} out of range of a list of {len(rows)} element(s)"
+                    )
+                if edit == "remove":
+                    del rows[index]
+                else:
+                    table = self.__table(plan)
+                    rows[index] = tuple(
+                        self.__stored(table, c, args[1][c]) if c in args[1] else old
+                        for c, old in zip(columns, rows[index])
+                    )
+
+            level_rows[plan.field_dir] = (columns, rows)
+            writes.append((plan.field_dir, edit, args))
+
+    def snapshot(self, query, version: Optional[int] = None) -> dict:
+        ret = {}
+        for config, field_names in query.selection.items():
+            values = ret[config] = {}
+            for field in field_names:
+                plan = self.__plans[f"{config}.{field}"]
+                columns, rows = self.read_field(plan, version)
+                if plan.kind == "std":
+                    values[field] = rows[0][0] if rows else None
+                elif plan.kind == "ext":
+                    values[field] = dict(zip(columns, rows[0])) if rows else None
+                else:
+                    values[field] = [dict(zip(columns, row)) for row in rows]
+        return ret
+
+    def restore(self, version: int) -> list:
+        """
+        roll the database back to version, then read the moved configs back
+        in the open transaction
+
+        :param version: version of the database history
+        :return: configs moved
+        """
+        if any(writes for _, writes in self.__levels):
+            raise CanfigException("roll back the memory backend before any write of the transaction")
+        level_rows, writes = self.__level()
+
+        # the database holds every commit before it is rolled back
+        self.flush()
+        with self.db.transaction():
+            moved = self.db.restore(version)
+            for field_dir in self.__plans:
+                if field_dir.split(".")[0] in moved:
+                    self.db.record_change(field_dir)
+
+        with self.lock:
+            for field_dir, plan in self.__plans.items():
+                if field_dir.split(".")[0] in moved:
+                    level_rows[field_dir] = plan.read_rows(self.db)
+                    # already in the database, published with the commit
+                    writes.append((field_dir, "restored", ()))
+        return moved
+
+    def record_change(self, field_dir: str):
+        """
+        the writes of a transaction are its changes, restore() records the
+        fields it reads back
+        """
+
+    def read_write_version(self) -> int | None:
+        return self.write_version
+
+    def __apply(self, batch: list):
+        """
+        persist commits in one sqlite transaction, without the triggers:
+        they ran on the memory backend
+        """
+        with self.db.transaction():
+            for writes in batch:
+                for field_dir, edit, args in writes:
+                    plan = self.__plans[field_dir]
+                    if edit == "restored":
+                        continue
+                    if edit == "set":
+                        plan.bind(args[0])
+                        plan.write(self.db)
+                    else:
+                        plan.edit_rows(self.db, edit, *args)
+
+    def __persisted(self, writes: list, error: Optional[Exception] = None):
+        with self.lock:
+            fields = {field_dir for field_dir, _, _ in writes}
+            self.__pending.subtract(fields)
+            if error is None:
+                return
+
+            # reported by flush()
+            self.__failures.append(error)
+            # unless a later commit writes it, the field takes back its
+            # value in sqlite
+            for field_dir in fields:
+                if self.__pending[field_dir] <= 0:
+                    self.values[field_dir] = self.__plans[field_dir].read_rows(self.db)
+
+    def __persist(self):
+        stop = False
+        while not stop:
+            if (writes := self.__queue.get()) is None:
+                break
+
+            batch = [writes]
+            while len(batch) < WRITE_BEHIND_BATCH:
+                try:
+                    writes = self.__queue.get_nowait()
+                except queue.Empty:
+                    break
+                if writes is None:
+                    stop = True
+                    break
+                batch.append(writes)
+
+            try:
+                self.__apply(batch)
+                for writes in batch:
+                    self.__persisted(writes)
+            except Exception:
+                # find the rejected commits one by one
+                for writes in batch:
+                    try:
+                        self.__apply([writes])
+                    except Exception as e:
+                        self.__persisted(writes, e)
+                    else:
+                        self.__persisted(writes)
+            finally:
+                for _ in batch:
+                    self.__queue.task_done()
+
+    def flush(self):
+        """
+        wait until every commit is persisted
+
+        :raise CanfigException: when sqlite rejected some since the last flush
+        """
+        self.__queue.join()
+        with self.lock:
+            failures, self.__failures = self.__failures, []
+        if failures:
+            raise CanfigException(
+                f"{len(failures)} write(s) rejected by the database, the first: {failures[0]}"
+            )
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.__queue.put(None)
+            self.__persister.join()
+            self.__scratch.close()
+            self.db.close()
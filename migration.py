@@ -0,0 +1,291 @@
+"""
+Warm start, keep the database between runs and only apply the schema delta.
+
+the schema applied to a database is recorded inside it:
+    _canfig_meta        key -> value, holds the fingerprint of the whole schema
+    _canfig_schema      table name -> kind, fingerprint, ddl
+    _canfig_migration   every migration script that has been applied
+
+and the write version, changelog and history of the configs, see
+evaluator.DB, changefeed and history.
+"""
+
+import re
+import hashlib
+
+from evaluator import DB
+from utils import CanfigException
+
+SCHEMA_FINGERPRINT_KEY = "schema_fingerprint"
+
+_INDEX_RE = re.compile(r"\s*CREATE\s+(UNIQUE\s+)?INDEX\b", re.IGNORECASE)
+
+META_TABLES = """
+    CREATE TABLE IF NOT EXISTS _canfig_meta (
+        key     TEXT PRIMARY KEY,
+        value   TEXT
+    );
+    CREATE TABLE IF NOT EXISTS _canfig_schema (
+        name        TEXT PRIMARY KEY,
+        kind        TEXT,
+        fingerprint TEXT,
+        ddl         TEXT
+    );
+    CREATE TABLE IF NOT EXISTS _canfig_version (
+        _canfig_version_id  INTEGER PRIMARY KEY,
+        version             INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS _canfig_changelog (
+        version         INTEGER PRIMARY KEY,
+        committed_at    REAL,
+        changes         TEXT,
+        field_values    TEXT
+    );
+    CREATE TABLE IF NOT EXISTS _canfig_history (
+        config      TEXT,
+        version     INTEGER,
+        row_id      INTEGER,
+        PRIMARY KEY (config, version)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS _canfig_links (
+        link        TEXT,
+        row_id      INTEGER,
+        owner       INTEGER,
+        PRIMARY KEY (link, row_id)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS _canfig_migration (
+        _canfig_migration_id    INTEGER PRIMARY KEY ASC,
+        applied_at              REAL,
+        from_fingerprint        TEXT,
+        to_fingerprint          TEXT,
+        script                  TEXT
+    );
+"""
+
+
+def table_fingerprint(ddl: list) -> str:
+    # whitespace does not change a table
+    return hashlib.sha1(
+        "\n".join(re.sub(r"\s+", " ", sql).strip() for sql in ddl).encode()
+    ).hexdigest()
+
+
+def schema_fingerprint(tables: list) -> str:
+    """
+    :param tables: [{"name", "kind", "ddl": [...]}, ...]
+    """
+    md = hashlib.sha1()
+    for table in tables:
+        md.update(
+            f"{table['name']}:{table['kind']}:{table_fingerprint(table['ddl'])};".encode()
+        )
+    return md.hexdigest()
+
+
+def _quote(value) -> str:
+    if value is None:
+        return "NULL"
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _record_script(tables: list, fingerprint: str, from_fingerprint, script: list) -> list:
+    """
+    statements recording tables as the applied schema
+    """
+    ret = ["DELETE FROM _canfig_schema"]
+    for table in tables:
+        ret.append(
+            "INSERT INTO _canfig_schema (name, kind, fingerprint, ddl) VALUES "
+            f"({_quote(table['name'])}, {_quote(table['kind'])}, "
+            f"{_quote(table_fingerprint(table['ddl']))}, {_quote(';'.join(table['ddl']))})"
+        )
+    ret.append(
+        "INSERT OR REPLACE INTO _canfig_meta (key, value) VALUES "
+        f"({_quote(SCHEMA_FINGERPRINT_KEY)}, {_quote(fingerprint)})"
+    )
+    ret.append(
+        "INSERT INTO _canfig_migration "
+        "(applied_at, from_fingerprint, to_fingerprint, script) VALUES "
+        f"((julianday('now') - 2440587.5) * 86400.0, {_quote(from_fingerprint)}, {_quote(fingerprint)}, "
+        f"{_quote(';'.join(script))})"
+    )
+    return ret
+
+
+def bootstrap_script(tables: list, fingerprint: str | None = None) -> str:
+    """
+    :param fingerprint: schema_fingerprint of tables, computed when not given
+    :return: one script creating the whole schema on an empty database in a
+             single transaction
+    """
+    fingerprint = fingerprint or schema_fingerprint(tables)
+    script = [sql for table in tables for sql in table["ddl"]]
+    statements = (
+        [s for s in META_TABLES.split(";") if s.strip()]
+        + script
+        + _record_script(tables, fingerprint, None, script)
+    )
+    return "BEGIN;\n" + ";\n".join(s.strip() for s in statements) + ";\nCOMMIT;"
+
+
+def _columns(db: DB, table: str) -> list:
+    db.execute(f"PRAGMA table_info({table})")
+    return [col["name"] for col in db.fetchall()]
+
+
+def _rebuild_script(db: DB, name: str, kind: str, ddl: list) -> list:
+    """
+    sqlite cannot alter constraints in place: build the new table aside,
+    copy the columns both versions share, then swap it in
+    """
+    tmp_name = f"_canfig_new_{name}"
+    create_sql = re.sub(
+        rf"CREATE TABLE IF NOT EXISTS {name}\b",
+        f"CREATE TABLE {tmp_name}",
+        ddl[0],
+        count=1,
+    )
+
+    script = [f"DROP TABLE IF EXISTS {tmp_name}", create_sql]
+
+    old_columns = _columns(db, name)
+    db.execute(create_sql)
+    shared = [c for c in _columns(db, tmp_name) if c in old_columns]
+    db.execute(f"DROP TABLE {tmp_name}")
+
+    if shared:
+        cols = ", ".join(shared)
+        script.append(f"INSERT INTO {tmp_name} ({cols}) SELECT {cols} FROM {name}")
+
+    script += [f"DROP TABLE {name}", f"ALTER TABLE {tmp_name} RENAME TO {name}"]
+
+    # the indexes went with the old table
+    script += [sql for sql in ddl[1:] if _INDEX_RE.match(sql)]
+
+    # a config must keep its single row
+    if kind == "CONFIG":
+        script.append(
+            f"INSERT INTO {name} ({name}_id) SELECT 1 "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {name})"
+        )
+
+    return script
+
+
+def plan_migration(db: DB, tables: list) -> list:
+    """
+    :return: statements turning the schema recorded in db into tables
+    """
+    db.execute("SELECT name, kind, fingerprint FROM _canfig_schema")
+    applied = {row["name"]: row for row in db.fetchall()}
+
+    script = []
+    for table in tables:
+        name, kind, ddl = table["name"], table["kind"], table["ddl"]
+        if name not in applied:
+            script += ddl
+        elif applied[name]["fingerprint"] != table_fingerprint(ddl):
+            script += _rebuild_script(db, name, kind, ddl)
+
+    wanted = {table["name"] for table in tables}
+    for name in applied:
+        if name not in wanted:
+            script.append(f"DROP TABLE IF EXISTS {name}")
+
+    return script
+
+
+def applied_fingerprint(db: DB) -> str | None:
+    """
+    :return: fingerprint of the schema in db, None for a fresh database
+    """
+    db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = '_canfig_meta'")
+    if not db.fetchall():
+        return None
+
+    db.execute("SELECT value FROM _canfig_meta WHERE key = ?", (SCHEMA_FINGERPRINT_KEY,))
+    return row[0]["value"] if (row := db.fetchall()) else None
+
+
+def migrate(db: DB, tables, schema: dict | None = None) -> list:
+    """
+    bring the database to the schema of tables in one transaction, a
+    database already on the same schema is left untouched
+
+    :param tables: [{"name", "kind", "ddl": [...]}, ...], or a function
+                   returning them, only called when the database is not on
+                   the schema, e.g. to decode them from the candy
+    :param schema: {"fingerprint"} precomputed by the compiler
+    :return: statements applied
+    """
+    if schema is None:
+        tables = tables() if callable(tables) else tables
+        schema = {"fingerprint": schema_fingerprint(tables)}
+
+    fingerprint = schema["fingerprint"]
+    current = applied_fingerprint(db)
+
+    if current == fingerprint:
+        # meta tables added after the schema was applied
+        db.executescript(META_TABLES)
+        return []
+
+    if callable(tables):
+        tables = tables()
+
+    if current is None:
+        # fresh database, the whole schema in one script
+        try:
+            db.executescript(bootstrap_script(tables, fingerprint))
+            db.executescript(META_TABLES)
+        except CanfigException as e:
+            db.rollback()
+            raise CanfigException(f"schema migration fails: {e}")
+        return [sql for table in tables for sql in table["ddl"]]
+
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        for sql in META_TABLES.split(";"):
+            if sql.strip():
+                db.execute(sql)
+
+        script = plan_migration(db, tables)
+        for sql in script + _record_script(tables, fingerprint, current, script):
+            db.execute(sql)
+
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise CanfigException(f"schema migration fails: {e}")
+
+    return script
+
+
+def collect_garbage(db: DB, fields: dict) -> int:
+    """
+    delete the struct rows no config field or LIST element links to, left by
+    writes that replaced them before the plans deleted old rows
+
+    :param fields: config -> field -> spec, from resolve_schema
+    :return: number of rows deleted
+    """
+    refs: dict = {}
+    for config, config_fields in fields.items():
+        for field, spec in config_fields.items():
+            if spec["kind"] == "ext":
+                refs.setdefault(spec["ext_table"], []).append(
+                    f"SELECT {field} FROM {config} WHERE {field} IS NOT NULL"
+                )
+            elif spec["kind"] == "list":
+                ext = spec["ext_table"]
+                refs.setdefault(ext, []).append(f"SELECT {ext}_id FROM {ext}_{config}")
+
+    deleted = 0
+    with db.transaction():
+        for ext, selects in refs.items():
+            with db.lock:
+                db.execute(
+                    f"DELETE FROM {ext} WHERE {ext}_id NOT IN ({' UNION ALL '.join(selects)})"
+                )
+                deleted += db.cursor.rowcount
+    return deleted
@@ -0,0 +1,34 @@
+"""
+Check the generated read plans against the sqlite query planner: a read that
+scans a whole table misses an index and slows down as the table grows.
+"""
+
+import re
+
+from evaluator import DB, RowMode
+
+# "SCAN t" or "SCAN t USING INDEX i". A SELECT without FROM scans a constant
+# row, and the rows of a subquery are checked by the plan of the subquery
+_SCAN_RE = re.compile(r"SCAN (?!CONSTANT ROW|\(subquery-)")
+
+
+def full_scans(_db: DB, sql: str, params: tuple = ()) -> list:
+    """
+    :return: steps of the query plan of sql that scan a whole table
+    """
+    with _db.lock:
+        _db.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        rows = _db.fetchall(RowMode.TUPLE)
+    return [detail for *_, detail in rows if _SCAN_RE.match(detail)]
+
+
+def verify_read_plans(_db: DB, reads: dict) -> dict:
+    """
+    :param reads: name -> (sql, params) of every read to check
+    :return: name -> full scan steps, for the reads doing any
+    """
+    ret = {}
+    for name, (sql, params) in reads.items():
+        if scans := full_scans(_db, sql, params):
+            ret[name] = scans
+    return ret
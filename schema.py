@@ -0,0 +1,263 @@
+"""
+Resolve STRUCT and CONFIG declarations into the final database schema at
+compile time, the evaluator then applies it without looking into the SQL.
+"""
+
+import re
+import sqlite3
+
+from evaluator import (
+    SQLITE3_BUILD_IN_TYPE,
+    PreSQL,
+    pre_sql_get_args,
+    CREATE_TABLE_plan,
+    CREATE_BUILD_IN_plan,
+    CREATE_M2M_plan,
+    CREATE_INDEX_plan,
+    CREATE_CONFIG_INIT_plan,
+)
+from checks import UNKNOWN, compile_checks, literal_default
+from utils import CanfigException
+
+
+def _instance_struct(structs: list, req_struct: str) -> dict:
+    """
+    :param req_struct: parameterized struct with its argument, like TIME_S(5)
+    :return: table of the struct instance
+    """
+    pre_sql_struct = re.search(r"(\w+)\(", req_struct).groups()[0]
+
+    for plan in structs:
+        if plan["name"] == pre_sql_struct and "pre_plan" in plan:
+            return {
+                "name": PreSQL.format_struct_to_name(req_struct),
+                "kind": "STRUCT",
+                "ddl": [
+                    plan["pre_plan"].make(
+                        re.search(r"\((.*?)\)", req_struct).groups()[0]
+                    )
+                ],
+            }
+
+    raise CanfigException(
+        f"Fail to build {req_struct} due to struct {pre_sql_struct} not exist"
+    )
+
+
+def resolve_schema(structs: list, configs: list, cache=None) -> tuple[list, dict]:
+    """
+    :param structs: STRUCT declarations from the parser
+    :param configs: CONFIG declarations from the parser
+    :param cache: DeclarationCache to reuse the columns of unchanged tables
+    :return: (tables, fields)
+        tables: [{"name", "kind", "ddl": [...]}, ...] in creation order
+        fields: config -> field -> {"kind": "std" | "ext" | "list",
+                                    "ext_table", "columns", "defaults", "checks"}
+    """
+    tables = []
+    fields: dict = {}
+
+    # declared structs, a field of these types references a struct row
+    struct_set: set = set()
+    # tables that already been created
+    created: set = set()
+
+    def add_struct_instance(req_struct):
+        if (post_struct := PreSQL.format_struct_to_name(req_struct)) in created:
+            return
+        tables.append(_instance_struct(structs, req_struct))
+        created.add(post_struct)
+
+    # evaluate STRUCT
+    structs = [dict(plan) for plan in structs]
+    for plan in structs:
+        # the DDL creates a table only if it does not exist, sqlite would not
+        # tell a declaration made twice
+        if plan["name"] in struct_set:
+            raise CanfigException(f"STRUCT '{plan['name']}' already defined")
+
+        if not plan["pre"]:
+            tables.append(
+                {
+                    "name": plan["name"],
+                    "kind": "STRUCT",
+                    "ddl": [CREATE_TABLE_plan(table_name=plan["name"], sql=plan["sql"])],
+                }
+            )
+            struct_set.add(plan["name"])
+            created.add(plan["name"])
+
+        elif "arg" in plan:
+            plan_rule = re.match(r"(\w+):(\w+)\s*=\s*(\d+)", plan["arg"]).groups()
+            pre_plan = PreSQL(
+                table_name=f"{plan['name']}",
+                pre_sql=plan["sql"],
+                arg_rule=plan_rule,
+            )
+            plan["pre_plan"] = pre_plan
+            tables.append(
+                {"name": plan["name"], "kind": "STRUCT", "ddl": [pre_plan.make(None)]}
+            )
+            struct_set.add(plan["name"])
+            created.add(plan["name"])
+
+    # evaluate CONFIG
+    for plan in configs:
+        config = plan["name"]
+        sql = plan["sql"]
+        if config in fields or config in struct_set:
+            raise CanfigException(f"CONFIG '{config}' already defined")
+        config_fields = fields[config] = {}
+        m2m_tables = []
+
+        def assign(field_name, spec, config=config, config_fields=config_fields):
+            assert field_name not in config_fields, f"{config}.{field_name} already init"
+            config_fields[field_name] = spec
+
+        if list_matches := re.findall(
+            r"(\w+)\s+LIST\(([^()]*(?:\([^)]*\))?[^()]*)\)", sql
+        ):
+            # Evaluate LIST, basically create many-to-many relation with the
+            # list argument.
+            for field_name, req_struct in list_matches:
+                if PreSQL.format_struct_to_name(req_struct) not in created:
+                    # create missing struct
+                    if not bool(re.fullmatch(r"\w+\([^()]*\)", req_struct)):
+                        # case 1: not pre-sql type, that is build-in-type
+                        if req_struct not in SQLITE3_BUILD_IN_TYPE:
+                            raise CanfigException(f"invalid type LIST({req_struct})")
+                        tables.append(
+                            {
+                                "name": req_struct,
+                                "kind": "STRUCT",
+                                "ddl": [CREATE_BUILD_IN_plan(req_struct)],
+                            }
+                        )
+                        created.add(req_struct)
+                    else:
+                        # case 2: pre-sql type, need create PreSQL instance
+                        add_struct_instance(req_struct)
+
+                post_struct = PreSQL.format_struct_to_name(req_struct)
+                assign(field_name, {"kind": "list", "ext_table": post_struct})
+
+                # should be consistent on how CREATE_M2M_plan create m2m table name
+                m2m_tables.append(
+                    {
+                        "name": f"{post_struct}_{config}",
+                        "kind": "M2M",
+                        "ddl": [
+                            CREATE_M2M_plan(tname_1=post_struct, tname_2=config),
+                            CREATE_INDEX_plan(f"{post_struct}_{config}", [f"{config}_id", "pos"]),
+                        ],
+                    }
+                )
+
+            # replace LIST to be NULL type
+            sql = re.sub(r"LIST\(([^()]*(?:\([^()]*\)[^()]*)*)\)", "NULL", sql)
+
+        # Evaluate struct referencing
+        struct_ref_fks = []
+        for field_name, ref_struct in pre_sql_get_args(sql, struct_set):
+            if "(" in ref_struct:
+                add_struct_instance(ref_struct)
+
+            ext_table = PreSQL.format_struct_to_name(ref_struct)
+            assign(field_name, {"kind": "ext", "ext_table": ext_table})
+            struct_ref_fks.append((field_name, ext_table))
+
+        for field_name, field_type in pre_sql_get_args(sql, struct_set, True):
+            if field_type != "NULL":
+                assign(field_name, {"kind": "std", "ext_table": None})
+
+        # config table and its init row
+        tables.append(
+            {
+                "name": config,
+                "kind": "CONFIG",
+                "ddl": [
+                    CREATE_TABLE_plan(table_name=config, sql=sql, FKs=struct_ref_fks),
+                    *(CREATE_INDEX_plan(config, [field]) for field, _ in struct_ref_fks),
+                    CREATE_CONFIG_INIT_plan(config),
+                ],
+            }
+        )
+        tables.extend(m2m_tables)
+
+    # check the schema on a scratch database and read back the struct columns
+    # and the CHECKs the plans validate before writing
+    columns, defaults, checks = table_columns(tables, cache)
+    for config, config_fields in fields.items():
+        for field, spec in config_fields.items():
+            if spec["ext_table"] is not None:
+                spec["columns"] = [
+                    c for c in columns[spec["ext_table"]] if c != f"{spec['ext_table']}_id"
+                ]
+                # struct column -> literal DEFAULT, a column whose DEFAULT is
+                # an expression is left out
+                spec["defaults"] = {
+                    c: v for c, v in defaults[spec["ext_table"]].items() if c in spec["columns"]
+                }
+                spec["checks"] = checks[spec["ext_table"]]
+            else:
+                spec["columns"] = []
+                spec["defaults"] = {}
+                # a CHECK across fields of the config is left to SQLite
+                spec["checks"] = [c for c in checks[config] if c["columns"] == [field]]
+
+    return tables, fields
+
+
+def table_columns(tables: list, cache=None) -> tuple[dict, dict, dict]:
+    """
+    :param cache: DeclarationCache keeping the result of every table by its
+                  DDL, only the tables missing from it are applied
+    :return: (table name -> column names, table name -> column -> literal
+             DEFAULT, table name -> CHECKs), by applying tables on :memory:
+    """
+    if cache is not None and len({table["name"] for table in tables}) < len(tables):
+        # a table created twice is only reported by applying every table
+        cache = None
+
+    columns, defaults, checks = {}, {}, {}
+    connection = sqlite3.connect(":memory:")
+    try:
+        # a table only depends on its own DDL, SQLite does not check a
+        # REFERENCES before the referenced table is written to
+        applied = []
+        for table in tables:
+            if cache is not None and (
+                cached := cache.get_derived("table", "\n".join(table["ddl"]))
+            ):
+                columns[table["name"]], defaults[table["name"]], checks[table["name"]] = cached
+                continue
+
+            for sql in table["ddl"]:
+                try:
+                    connection.execute(sql)
+                except sqlite3.Error as e:
+                    raise CanfigException(f"invalid {table['kind']} '{table['name']}': {e}")
+            applied.append(table)
+
+        for table in applied:
+            info = connection.execute(f"PRAGMA table_info({table['name']})").fetchall()
+            (create_sql,) = connection.execute(
+                "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?",
+                (table["name"],),
+            ).fetchone()
+            columns[table["name"]] = [row[1] for row in info]
+            defaults[table["name"]] = {
+                row[1]: value
+                for row in info
+                if (value := literal_default(row[4])) is not UNKNOWN
+            }
+            checks[table["name"]] = compile_checks(create_sql, info)
+            if cache is not None:
+                cache.put_derived(
+                    "table",
+                    "\n".join(table["ddl"]),
+                    (columns[table["name"]], defaults[table["name"]], checks[table["name"]]),
+                )
+        return columns, defaults, checks
+    finally:
+        connection.close()
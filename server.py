@@ -1,8 +1,215 @@
-from fastapi import FastAPI
+"""
+HTTP server of a candy: the plan and its database are loaded once at start,
+configs and slices are served from the read-only connections of the DB.
 
-app = FastAPI()
+    CANFIG_CANDY=sample/sample.candy uvicorn server:app
+
+environment:
+    CANFIG_CANDY        .candy plan to serve
+    CANFIG_DB           sqlite3 database file, kept between runs
+    CANFIG_STORAGE      storage profile, by default the @storage of the candy
+                        or read-mostly
+    CANFIG_VERSION_POLL seconds between two checks for writes of other
+                        processes
+    CANFIG_WATCH_VALUES 1 to send the new values with the change events
+    CANFIG_HISTORY      versions kept by the writes of the server, see
+                        history. Reads of ?version=N need the database to
+                        keep them
+    CANFIG_PRUNE_EVERY  versions committed between two prunes of the history
+
+every response carries an ETag made of the candy md5 and the write version
+of the database. The version is held in memory, so a request whose
+If-None-Match is still current gets a 304 without touching the database.
+
+GET /watch streams the change events as server-sent events, the id of an
+event is its version. A client reconnecting with Last-Event-ID, or
+?since=version, gets the events it missed first.
+"""
+
+import contextlib
+import json
+import os
+import threading
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+import candy
+import canfig
+from changefeed import ChangeEvent, ChangeFeed
+from evaluator import DB, DB_FILE
+from history import PRUNE_INTERVAL
+from migration import migrate
+from slices import index_fields
+from utils import CanfigException
+
+CANDY_FILE = os.environ.get("CANFIG_CANDY", os.path.join("sample", "sample.candy"))
+SERVER_DB_FILE = os.environ.get("CANFIG_DB", DB_FILE)
+SERVER_STORAGE = os.environ.get("CANFIG_STORAGE")
+VERSION_POLL = float(os.environ.get("CANFIG_VERSION_POLL", "0.1"))
+WATCH_VALUES = os.environ.get("CANFIG_WATCH_VALUES", "0") == "1"
+HISTORY = int(os.environ.get("CANFIG_HISTORY", "0"))
+PRUNE_EVERY = int(os.environ.get("CANFIG_PRUNE_EVERY", str(PRUNE_INTERVAL)))
+
+# seconds without event before a keepalive comment is sent to a watcher
+WATCH_KEEPALIVE = 15.0
+
+
+class Served:
+    """
+    the candy and database of the server, and the write version they are at
+    """
+
+    def __init__(self, cplan_file: str, db_file: str, storage: str | None):
+        self.cplan = candy.load(cplan_file)
+        storage = storage or self.cplan["meta_data"].get("STORAGE", "read-mostly")
+
+        self.db = canfig.db = DB(db_file, storage, HISTORY, PRUNE_EVERY)
+        # the tables are only decoded when the database is not on the schema
+        migrate(self.db, lambda: self.cplan["tables"], self.cplan["schema"])
+
+        canfig.build_plans(self.cplan["fields"])
+        if "slices" in self.cplan:
+            canfig.load_slices(index_fields(self.cplan["fields"]), self.cplan["slices"])
+
+        canfig.record_values(WATCH_VALUES)
+        self.feed = canfig.feed = ChangeFeed(self.db)
+        self.__data_version = self.db.data_version()
+        self.__stop = threading.Event()
+        self.__poller = threading.Thread(target=self.__poll, daemon=True)
+        self.__poller.start()
+
+    def __poll(self):
+        # the writes of this process update db.write_version when they
+        # commit, the ones of other processes show up in data_version
+        while not self.__stop.wait(VERSION_POLL):
+            if (data_version := self.db.data_version()) != self.__data_version:
+                self.__data_version = data_version
+                self.feed.poll()
+                self.db.read_write_version()
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.cplan.md5[:12]}-{self.db.write_version}"'
+
+    def close(self):
+        self.__stop.set()
+        self.__poller.join()
+        self.feed.close()
+        self.db.close()
+        self.cplan.close()
+
+
+served: Served | None = None
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_app: FastAPI):
+    global served
+    served = Served(CANDY_FILE, SERVER_DB_FILE, SERVER_STORAGE)
+    try:
+        yield
+    finally:
+        served.close()
+        served = None
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def _not_found(e: CanfigException) -> HTTPException:
+    return HTTPException(status_code=404, detail=str(e))
+
+
+def _respond(request: Request, read, version: int | None = None) -> Response:
+    """
+    :param read: reads the body, only called when the client copy is stale
+    :param version: the body is of this committed version, it never changes
+
+    the tag is the same for every resource, the caller checks the one asked
+    exists before, so neither "*" nor a current tag gives a 304 for it
+    """
+    # the version is taken before the read, a write in between gives a newer
+    # body under an older tag and the next poll fetches it again
+    etag = served.etag if version is None else f'"{served.cplan.md5[:12]}-{version}"'
+    if_none_match = request.headers.get("if-none-match", "")
+    if if_none_match == "*" or etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers={"ETag": etag})
+
+    try:
+        body = read()
+    except CanfigException as e:
+        raise _not_found(e)
+    return JSONResponse(body, headers={"ETag": etag})
+
+
+def _event_stream(event: ChangeEvent) -> str:
+    kind = "reset" if event.reset else "change"
+    return f"id: {event.version}\nevent: {kind}\ndata: {json.dumps(event.to_dict())}\n\n"
 
 
 @app.get("/")
-async def root():
-    return {"message": "Hello World"}
+def root():
+    return {
+        "candy": served.cplan.md5,
+        "storage": served.db.profile,
+        "version": served.db.write_version,
+        "configs": list(canfig.final_plan),
+        "slices": list(canfig.slices.slices),
+    }
+
+
+@app.get("/config/{name}")
+def get_config(name: str, request: Request, version: int | None = None):
+    if name not in canfig.final_plan:
+        raise _not_found(CanfigException(f"config '{name}' not exist"))
+    return _respond(request, lambda: canfig.snapshot(name, version), version)
+
+
+@app.get("/config/{name}/{field}")
+def get_field(name: str, field: str, request: Request, version: int | None = None):
+    if field not in canfig.final_plan.get(name, {}):
+        raise _not_found(CanfigException(f"field '{name}.{field}' not exist"))
+
+    return _respond(request, lambda: canfig.snapshot_field(f"{name}.{field}", version), version)
+
+
+@app.get("/slice/{name}")
+def get_slice(name: str, request: Request, version: int | None = None):
+    try:
+        scope = canfig.scope(name)
+    except CanfigException as e:
+        raise _not_found(e)
+    return _respond(request, lambda: scope.snapshot(version), version)
+
+
+@app.get("/watch")
+async def watch(request: Request, since: int | None = None):
+    """
+    stream the change events after version since, or after Last-Event-ID
+    """
+    if last_event_id := request.headers.get("last-event-id"):
+        try:
+            since = int(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"invalid Last-Event-ID '{last_event_id}'")
+
+    subscription = served.feed.subscribe(since)
+
+    async def stream():
+        try:
+            # tells the client the version it watches from
+            yield f"retry: 1000\nid: {subscription.version}\n\n"
+            while True:
+                if (event := await subscription.aget(WATCH_KEEPALIVE)) is None:
+                    yield ": keepalive\n\n"
+                else:
+                    yield _event_stream(event)
+        finally:
+            subscription.close()
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,244 @@
+"""
+SLICE engine: a slice is a set of config fields, stored as a bitmap over the
+global field index.
+
+    expr    := term (("+" | "-") term)*
+    term    := "(" expr ")" | "<" fields ">" | "{" fields "}" | Config | Slice | ALL
+    fields  := [Config.field ("," Config.field)*]
+
+"+" is the union and "-" the difference, both left associative. Slices
+are resolved by the compiler, the evaluator only loads the bitmaps.
+"""
+
+import re
+
+from utils import CanfigException
+
+_TOKEN_RE = re.compile(
+    r"\s*(?:(?P<set><[^<>]*>|\{[^{}]*\})|(?P<ident>\w+)|(?P<op>[-+()]))"
+)
+_FIELD_RE = re.compile(r"\w+\.\w+")
+
+ALL = "ALL"
+
+
+def _tokens(expr: str) -> list:
+    ret = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        if not (match := _TOKEN_RE.match(expr, pos)):
+            raise CanfigException(f"invalid slice expression at '{expr[pos:].strip()}'")
+        ret.append((match.lastgroup, match.group(match.lastgroup)))
+        pos = match.end()
+    return ret
+
+
+def evaluate(expr: str, position: dict, resolve) -> int:
+    """
+    :param position: "Config.field" -> bit
+    :param resolve: name -> bits of a config, a slice or ALL, None if unknown
+    :return: bits of the fields selected by expr
+    """
+    tokens = _tokens(expr)
+    cursor = 0
+
+    def peek():
+        return tokens[cursor] if cursor < len(tokens) else (None, None)
+
+    def term() -> int:
+        nonlocal cursor
+        kind, text = peek()
+        cursor += 1
+
+        if kind == "op" and text == "(":
+            bits = union()
+            if peek() != ("op", ")"):
+                raise CanfigException(f"missing ')' in slice expression '{expr.strip()}'")
+            cursor += 1
+            return bits
+
+        if kind == "set":
+            bits = 0
+            for field_dir in filter(None, (f.strip() for f in text[1:-1].split(","))):
+                if not _FIELD_RE.fullmatch(field_dir) or field_dir not in position:
+                    raise CanfigException(f"field '{field_dir}' not exist")
+                bits |= 1 << position[field_dir]
+            return bits
+
+        if kind == "ident":
+            if (bits := resolve(text)) is None:
+                raise CanfigException(f"'{text}' is neither a config nor a slice")
+            return bits
+
+        raise CanfigException(f"unexpected '{text}' in slice expression '{expr.strip()}'")
+
+    def union() -> int:
+        nonlocal cursor
+        bits = term()
+        while (token := peek())[0] == "op" and token[1] in "+-":
+            cursor += 1
+            if token[1] == "+":
+                bits |= term()
+            else:
+                bits &= ~term()
+        return bits
+
+    bits = union()
+    if cursor != len(tokens):
+        raise CanfigException(f"unexpected '{tokens[cursor][1]}' in slice expression '{expr.strip()}'")
+    return bits
+
+
+def to_bitmap(bits: int, n_fields: int) -> bytes:
+    return bits.to_bytes((n_fields + 7) // 8, "little")
+
+
+def index_fields(fields: dict) -> list:
+    """
+    :param fields: config -> field -> spec, from resolve_schema
+    :return: every "Config.field", the position is its bit in a bitmap
+    """
+    return [f"{config}.{field}" for config, spec in fields.items() for field in spec]
+
+
+def compile_slices(slices: list, fields: dict) -> tuple[list, list]:
+    """
+    :param slices: SLICE declarations from the parser, {"name", "cmd"}
+    :param fields: config -> field -> spec, from resolve_schema
+    :return: (field index, slices with their "bitmap")
+        field index: from index_fields
+    """
+    field_index = index_fields(fields)
+    position = {field_dir: i for i, field_dir in enumerate(field_index)}
+
+    config_bits = {}
+    for config, spec in fields.items():
+        config_bits[config] = sum(1 << position[f"{config}.{field}"] for field in spec)
+
+    exprs = {}
+    for plan in slices:
+        if plan["name"] in exprs or plan["name"] in fields or plan["name"] == ALL:
+            raise CanfigException(f"slice '{plan['name']}' already defined")
+        exprs[plan["name"]] = plan["cmd"]
+
+    resolved: dict = {}
+    resolving: list = []
+
+    def resolve(name: str) -> int | None:
+        if name == ALL:
+            return (1 << len(field_index)) - 1
+        if name in config_bits:
+            return config_bits[name]
+        if name not in exprs:
+            return None
+        if name in resolving:
+            raise CanfigException(f"slice '{name}' refers to itself")
+
+        if name not in resolved:
+            resolving.append(name)
+            try:
+                resolved[name] = evaluate(exprs[name], position, resolve)
+            except CanfigException as e:
+                raise CanfigException(f"invalid slice '{name}': {e}")
+            resolving.pop()
+        return resolved[name]
+
+    return field_index, [
+        {**plan, "bitmap": to_bitmap(resolve(plan["name"]), len(field_index))}
+        for plan in slices
+    ]
+
+
+class Slice:
+    """
+    set of fields, membership is a byte lookup in the bitmap
+    """
+
+    __slots__ = ("name", "bitmap", "registry", "__fields")
+
+    def __init__(self, name: str, bitmap: bytes, registry: "SliceRegistry"):
+        self.name = name
+        self.bitmap = bitmap
+        self.registry = registry
+        self.__fields = None
+
+    @property
+    def bits(self) -> int:
+        return int.from_bytes(self.bitmap, "little")
+
+    def __contains__(self, field_dir: str) -> bool:
+        if (i := self.registry.position.get(field_dir)) is None:
+            return False
+        return bool(self.bitmap[i >> 3] >> (i & 7) & 1)
+
+    def fields(self) -> list:
+        if self.__fields is None:
+            bitmap = self.bitmap
+            self.__fields = [
+                f for i, f in enumerate(self.registry.field_index) if bitmap[i >> 3] >> (i & 7) & 1
+            ]
+        return list(self.__fields)
+
+    def __len__(self):
+        return self.bits.bit_count()
+
+    def __compose(self, name: str, bits: int) -> "Slice":
+        return Slice(name, to_bitmap(bits, len(self.registry.field_index)), self.registry)
+
+    def __add__(self, other: "Slice") -> "Slice":
+        return self.__compose(f"({self.name} + {other.name})", self.bits | other.bits)
+
+    def __sub__(self, other: "Slice") -> "Slice":
+        return self.__compose(f"({self.name} - {other.name})", self.bits & ~other.bits)
+
+    def __and__(self, other: "Slice") -> "Slice":
+        return self.__compose(f"({self.name} & {other.name})", self.bits & other.bits)
+
+    def __repr__(self):
+        return f"Slice({self.name}, {len(self)} field(s))"
+
+
+class SliceRegistry:
+    """
+    slices of a candy, loaded once
+    """
+
+    def __init__(self, field_index: list, slices: list):
+        self.field_index = list(field_index)
+        self.position = {field_dir: i for i, field_dir in enumerate(self.field_index)}
+        # the candy leaves out the zero bytes a bitmap ends with
+        size = (len(self.field_index) + 7) // 8
+        self.slices = {
+            plan["name"]: Slice(plan["name"], bytes(plan["bitmap"]).ljust(size, b"\0"), self)
+            for plan in slices
+        }
+
+    def __getitem__(self, name: str) -> Slice:
+        try:
+            return self.slices[name]
+        except KeyError:
+            raise CanfigException(f"slice '{name}' not exist")
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.slices
+
+    def compose(self, expr: str) -> Slice:
+        """
+        evaluate a slice expression over the loaded slices and configs
+        """
+
+        def resolve(name: str) -> int | None:
+            if name == ALL:
+                return (1 << len(self.field_index)) - 1
+            if name in self.slices:
+                return self.slices[name].bits
+            prefix = f"{name}."
+            bits = sum(1 << i for i, f in enumerate(self.field_index) if f.startswith(prefix))
+            return bits or None
+
+        return Slice(
+            expr.strip(),
+            to_bitmap(evaluate(expr, self.position, resolve), len(self.field_index)),
+            self,
+        )
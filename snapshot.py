@@ -0,0 +1,102 @@
+"""
+Snapshot reads: every field of a config, or of a slice, in one query.
+
+the config row, its struct rows and its LIST elements are put together by
+sqlite json functions, one column per chunk of fields so a json_object
+never exceeds the argument limit of sqlite functions.
+"""
+
+import json
+
+from evaluator import DB
+from history import links_of
+
+# json_object takes a name and a value per field, sqlite allows 127 arguments
+FIELDS_PER_COLUMN = 60
+
+
+def _struct_object(columns: list) -> str:
+    return "json_object(" + ", ".join(f"'{c}', e.{c}" for c in columns) + ")"
+
+
+def field_expr(config: str, field: str, spec: dict) -> str:
+    """
+    :return: sql expression of the field value inside a query on config
+    """
+    if spec["kind"] == "std":
+        return f"{config}.{field}"
+
+    ext = spec["ext_table"]
+    obj = _struct_object(spec["columns"])
+
+    if spec["kind"] == "ext":
+        return f"""json((
+            SELECT {obj}
+            FROM {ext} e WHERE e.{ext}_id = {config}.{field}
+        ))"""
+
+    # a scalar subquery drops the json subtype, json() gives it back
+    return f"""json((
+            SELECT json_group_array(json(j)) FROM (
+                SELECT {obj}
+                AS j FROM {ext} e
+                JOIN {ext}_{config} m ON m.{ext}_id = e.{ext}_id
+                WHERE m.{config}_id = {links_of(f"{ext}_{config}", f"{config}.{config}_id")}
+                ORDER BY m.pos, m.{ext}_id
+            )
+        ))"""
+
+
+class SnapshotQuery:
+    """
+    one planned query reading the selected fields of one or more configs
+    """
+
+    def __init__(self, fields: dict, selection: dict):
+        """
+        :param fields: config -> field -> spec, from resolve_schema
+        :param selection: config -> field names to read
+        """
+        self.configs: list = []
+        self.selection = {config: list(field_names) for config, field_names in selection.items()}
+        columns = []
+
+        for config, field_names in selection.items():
+            self.configs.append(config)
+            field_names = list(field_names)
+            for start in range(0, max(len(field_names), 1), FIELDS_PER_COLUMN):
+                chunk = field_names[start: start + FIELDS_PER_COLUMN]
+                pairs = ",\n        ".join(
+                    f"'{f}', {field_expr(config, f, fields[config][f])}" for f in chunk
+                )
+                columns.append(
+                    (
+                        config,
+                        f"(SELECT json_object(\n        {pairs}\n    ) "
+                        f"FROM {config} WHERE {config}_id = ?)",
+                    )
+                )
+
+        self.column_configs = [config for config, _ in columns]
+        self.sql = "SELECT\n    " + ",\n    ".join(sql for _, sql in columns)
+
+    def read(self, _db: DB, version: int | None = None) -> dict:
+        """
+        :param version: committed version to read, needs the history on
+        :return: config -> field -> value, a struct is a dict and a LIST a
+                 list of dicts
+        """
+        ret = {config: {} for config in self.configs}
+        if not self.column_configs:
+            return ret
+
+        # with history on, the rows of a version are never written again
+        rows = _db.config_rows(self.column_configs, version)
+        with _db.reader() as cursor:
+            cursor.execute(self.sql, rows)
+            (row,) = cursor.fetchall()
+
+        for config, value in zip(self.column_configs, row):
+            if value is not None:
+                ret[config].update(json.loads(value))
+        return ret
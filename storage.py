@@ -0,0 +1,37 @@
+"""
+Storage profiles of evaluator.DB: the pragmas every connection is opened
+with and the size of the pool of read-only connections. A profile is
+chosen by @storage in the CanfigDefine or --storage of canfig.py.
+"""
+
+# name -> pragmas of the connections and the number of read-only connections
+STORAGE_PROFILES = {
+    # sqlite defaults: rollback journal, every commit is synced. Readers and
+    # the writer lock each other out of the file, a pool would only move the
+    # wait into the busy handler of sqlite
+    "durable": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "mmap_size": 0,
+        "cache_size": -2000,
+        "read_pool": 0,
+    },
+    # readers do not wait on the writer, commits are synced at checkpoints
+    # so a power loss can lose the last ones
+    "fast-local": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 256 << 20,
+        "cache_size": -(64 << 10),
+        "read_pool": 4,
+    },
+    # as fast-local, the database is mapped and cached in full by many readers
+    "read-mostly": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 1 << 30,
+        "cache_size": -(256 << 10),
+        "read_pool": 8,
+    },
+}
+DEFAULT_STORAGE_PROFILE = "durable"
@@ -0,0 +1,61 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import canfig
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+
+SAMPLE = os.path.join(ROOT, "sample", "sample.cand")
+
+
+@pytest.fixture(scope="session")
+def sample_path() -> str:
+    return SAMPLE
+
+
+@pytest.fixture(scope="session")
+def sample_source() -> str:
+    with open(SAMPLE) as f:
+        return f.read()
+
+
+@pytest.fixture(scope="session")
+def commands():
+    """
+    builds Server.commands elements: commands(3) for c0 to c2, or
+    commands("a", "b") by name
+    """
+
+    def build(*names, description: str = "command number") -> list:
+        if len(names) == 1 and isinstance(names[0], int):
+            names = tuple(f"c{k}" for k in range(names[0]))
+        return [{"name": name, "description": f"{description} {name}"} for name in names]
+
+    return build
+
+
+@pytest.fixture(scope="session")
+def cplan():
+    return compile_source(path=SAMPLE)
+
+
+@pytest.fixture
+def db(cplan, tmp_path):
+    """
+    DB of the sample schema, with the plans of canfig built on it
+    """
+    _db = DB(str(tmp_path / "test.sqlite3"), "fast-local")
+    migrate(_db, cplan.tables, cplan.schema)
+
+    canfig.final_plan.clear()
+    canfig.build_plans(cplan.fields)
+    canfig.load_slices(cplan.field_index, cplan.slices)
+    canfig.db = _db
+    yield _db
+    _db.close()
@@ -0,0 +1,80 @@
+import pytest
+
+import canfig
+from utils import CanfigException, TriggerException
+
+# counts its runs in Runner.runner_name, refuses port 13
+SERVER_TRIGGER = """
+    runs = GET("Runner.runner_name")[0]["runner_name"] or ""
+    SET("Runner.runner_name", runs + "x")
+    if GET("Server.port")[0]["port"] == 13:
+        CANFIG_ERR(msg="port 13 is refused")
+"""
+
+
+@pytest.fixture
+def counted(db):
+    canfig.register_triggers(
+        [{"name": "CountServer", "condition": "Server", "cmd": SERVER_TRIGGER}]
+    )
+    return db
+
+
+def runs() -> int:
+    return len(canfig.GET("Runner.runner_name")[0]["runner_name"] or "")
+
+
+def test_apply_many_configs_in_one_transaction(db):
+    before = db.write_version
+    canfig.apply(
+        {
+            "Server.port": 8128,
+            "Server.name": {"NAME": "server-a"},
+            "Server.commands": [{"name": "start", "description": "start the server"}],
+            "Runner.protocol": "tcp",
+        }
+    )
+
+    assert canfig.GET("Server.port") == [{"port": 8128}]
+    assert canfig.GET("Server.name") == [{"NAME": "server-a"}]
+    assert canfig.GET("Runner.protocol") == [{"protocol": "tcp"}]
+    assert db.write_version == before + 1
+
+
+def test_triggers_run_once_per_config(counted):
+    canfig.apply({"Server.port": 1, "Server.description": "a server", "Server.run": 0})
+    assert runs() == 1
+
+    canfig.apply({"Server.port": 2})
+    assert runs() == 2
+
+
+def test_failing_trigger_rolls_back_every_config(counted):
+    canfig.apply({"Server.port": 1, "Runner.protocol": "tcp"})
+    version = counted.write_version
+
+    with pytest.raises(TriggerException, match="port 13 is refused"):
+        canfig.apply({"Server.port": 13, "Runner.protocol": "udp"})
+
+    assert canfig.GET("Server.port") == [{"port": 1}]
+    assert canfig.GET("Runner.protocol") == [{"protocol": "tcp"}]
+    assert runs() == 1
+    assert counted.write_version == version
+
+
+@pytest.mark.parametrize(
+    "changes",
+    [
+        {"Server.port": 2, "Server.commands": [{"name": "c", "description": "short"}]},
+        {"Server.port": 2, "Server.missing": 1},
+    ],
+)
+def test_bad_change_fails_before_any_write(db, changes):
+    canfig.apply({"Server.port": 1})
+    version = db.write_version
+
+    with pytest.raises(CanfigException):
+        canfig.apply(changes)
+
+    assert canfig.GET("Server.port") == [{"port": 1}]
+    assert db.write_version == version
@@ -0,0 +1,110 @@
+import pytest
+
+import canfig
+from evaluator import DB, Backend
+from memory_backend import MemoryBackend
+from migration import migrate
+from utils import CanfigException
+
+
+def test_incomplete_backend_fails_on_creation():
+    class ReadOnly(Backend):
+        in_transaction = False
+
+        def read_field(self, plan, version=None):
+            return (), []
+
+    with pytest.raises(TypeError):
+        ReadOnly()
+
+
+def test_memory_backend_persists_to_sqlite(db, cplan):
+    memory = canfig.db = MemoryBackend(db, cplan.fields)
+    # the write-behind waits for this transaction, sqlite is not written yet
+    with db.transaction():
+        canfig.apply(
+            {
+                "Server.port": 8128,
+                "Server.commands": [{"name": "start", "description": "start the server"}],
+            }
+        )
+        canfig.final_plan["Server"]["commands"].append(
+            memory, {"name": "stop", "description": "stop the server"}
+        )
+        in_memory = canfig.snapshot("Server")
+        assert canfig.final_plan["Server"]["port"].view(db) == [{"port": None}]
+    memory.flush()
+
+    canfig.db = db
+    assert canfig.snapshot("Server") == in_memory
+    assert canfig.final_plan["Server"]["port"].view(db) == [{"port": 8128}]
+    assert [c["name"] for c in in_memory["commands"]] == ["start", "stop"]
+    memory.close()
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def backend(request, db, cplan, tmp_path):
+    _db = DB(str(tmp_path / "history.sqlite3"), "fast-local", history=50)
+    migrate(_db, cplan.tables, cplan.schema)
+    canfig.db = _db if request.param == "sqlite" else MemoryBackend(_db, cplan.fields)
+    yield canfig.db
+    canfig.db.close()
+
+
+def test_module_api_on_both_backends(backend):
+    canfig.record_values()
+    with canfig.watch() as subscription:
+        canfig.SET("Server.port", 1)
+        first = backend.read_write_version()
+        # versions to roll back to are the ones of the database history
+        sqlite = backend.db if isinstance(backend, MemoryBackend) else backend
+        if sqlite is not backend:
+            backend.flush()
+        pinned = sqlite.read_write_version()
+        canfig.apply({"Server.port": 2, "Server.commands": [{"name": "a", "description": "the command a"}]})
+
+        assert canfig.GET("Server.port") == [{"port": 2}]
+        assert canfig.changed_values({"Server": ["port"]}) == {"Server": {"port": 2}}
+        assert canfig.snapshot("Server")["commands"] == [{"name": "a", "description": "the command a"}]
+        assert subscription.get(timeout=0).values == {"Server": {"port": 1}}
+        event = subscription.get(timeout=0)
+        assert event.version == backend.read_write_version() > first
+        assert event.changes == {"Server": ["commands", "port"]}
+
+    assert "Server" in canfig.rollback(pinned)
+    assert canfig.GET("Server.port") == [{"port": 1}]
+    assert canfig.snapshot("Server")["commands"] == []
+
+
+def test_memory_backend_replays_no_changelog(db, cplan):
+    memory = canfig.db = MemoryBackend(db, cplan.fields)
+    canfig.SET("Server.port", 1)
+    with canfig.watch(since=memory.read_write_version() - 1) as subscription:
+        assert subscription.get(timeout=0).reset
+    with pytest.raises(CanfigException, match="keeps no version"):
+        canfig.GET("Server.port", version=1)
+    memory.close()
+
+
+def test_memory_backend_stores_values_by_column_affinity(db, cplan):
+    memory = canfig.db = MemoryBackend(db, cplan.fields)
+    canfig.apply(
+        {
+            "Server.port": "8128",
+            "Server.alive_time": {"minute": "2", "second": 20.0},
+            "Server.alive_in": [{"minute": "1", "second": "30"}],
+        }
+    )
+    canfig.final_plan["Server"]["alive_in"].update(memory, 0, {"minute": 3.0})
+    in_memory = canfig.snapshot("Server")
+    assert in_memory["port"] == 8128
+    assert in_memory["alive_time"]["minute"] == 2 and in_memory["alive_time"]["second"] == 20
+    memory.flush()
+
+    canfig.db = db
+    persisted = canfig.snapshot("Server")
+    assert persisted == in_memory
+    assert [type(v) for v in persisted["alive_in"][0].values()] == [
+        type(v) for v in in_memory["alive_in"][0].values()
+    ]
+    memory.close()
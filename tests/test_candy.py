@@ -0,0 +1,87 @@
+import os
+
+import pytest
+
+import candy
+from slices import SliceRegistry, index_fields
+from utils import CanfigException
+
+SECTIONS = {
+    "meta": {"name": "Server", "port": 8128, "ratio": 0.5, "on": True, "none": None},
+    "ints": [0, -1, 63, -64, 200, 1 << 40, -(1 << 62), (1 << 63) - 1],
+    "fields": [{"name": "port", "type": "INTEGER"}, {"name": "name", "type": "TEXT"}],
+    "blob": b"\x00\x01\xff",
+}
+MD5 = "0123456789abcdef0123456789abcdef"
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "plan.candy")
+    candy.dump(path, MD5, SECTIONS)
+
+    assert candy.read_md5(path) == MD5
+    with candy.load(path) as reader:
+        assert sorted(reader.sections()) == sorted(SECTIONS)
+        for name, value in SECTIONS.items():
+            assert reader[name] == value
+        assert reader.record_count("fields") == 2
+        assert reader.record("fields", 1) == SECTIONS["fields"][1]
+    assert os.listdir(tmp_path) == ["plan.candy"]
+
+
+def test_compiled_plan_round_trip(cplan, tmp_path):
+    path = str(tmp_path / "sample.candy")
+    cplan.dump(path)
+
+    with candy.load(path) as reader:
+        assert "fields" in reader
+        assert reader["fields"] == cplan.fields
+
+
+def test_repeated_value_stored_once(tmp_path):
+    check = {"name": "CHK", "columns": ["minute", "second"], "expr": ["literal", 10]}
+    once, many = str(tmp_path / "once.candy"), str(tmp_path / "many.candy")
+    candy.dump(once, MD5, {"fields": {"A": [check]}})
+    candy.dump(many, MD5, {"fields": {"A": [dict(check) for _ in range(100)]}})
+
+    # a reference is a few bytes, the check is not written again
+    assert os.path.getsize(many) - os.path.getsize(once) < 100 * 4
+    with candy.load(many) as reader:
+        checks = reader["fields"]["A"]
+        assert checks == [check] * 100
+        # the references share one object
+        assert len({id(c) for c in checks}) < 4
+
+
+def test_slices_round_trip(cplan, tmp_path):
+    path = str(tmp_path / "sample.candy")
+    cplan.dump(path)
+
+    with candy.load(path) as reader:
+        assert index_fields(reader["fields"]) == cplan.field_index
+        loaded = SliceRegistry(index_fields(reader["fields"]), reader["slices"])
+    compiled = SliceRegistry(cplan.field_index, cplan.slices)
+    for name in compiled.slices:
+        assert loaded[name].bitmap == compiled[name].bitmap
+        assert loaded[name].fields() == compiled[name].fields()
+
+
+def test_dump_keeps_open_reader(tmp_path):
+    path = str(tmp_path / "plan.candy")
+    candy.dump(path, MD5, SECTIONS)
+
+    with candy.load(path) as reader:
+        candy.dump(path, MD5, {"meta": {"name": "Client"}})
+        # the open reader still maps the replaced file
+        assert reader["fields"] == SECTIONS["fields"]
+    with candy.load(path) as reader:
+        assert reader["meta"] == {"name": "Client"}
+
+
+@pytest.mark.parametrize("data", [b"NOT A CANDY" * 8, candy.MAGIC + b"\x00" * 3])
+def test_bad_candy(tmp_path, data):
+    path = tmp_path / "bad.candy"
+    path.write_bytes(data)
+
+    with pytest.raises(CanfigException):
+        candy.load(str(path))
@@ -0,0 +1,95 @@
+import pytest
+
+import canfig
+import changefeed
+import evaluator
+from changefeed import ChangeFeed
+from evaluator import DB
+from utils import CanfigException
+
+
+def versions(subscription) -> list:
+    ret = []
+    while (event := subscription.get(timeout=0)) is not None:
+        ret.append(event.version)
+    return ret
+
+
+def test_event_per_commit(db):
+    with canfig.watch() as subscription:
+        canfig.apply({"Server.port": 8128, "Runner.protocol": "udp"})
+
+        event = subscription.get(timeout=0)
+        assert event.version == db.write_version
+        assert event.changes == {"Runner": ["protocol"], "Server": ["port"]}
+        assert event.values is None
+        assert subscription.get(timeout=0) is None
+
+
+def test_failed_write_publishes_nothing(db):
+    with canfig.watch() as subscription:
+        with pytest.raises(CanfigException):
+            canfig.apply({"Server.port": 8128, "Runner.protocol": "quic"})
+        assert subscription.get(timeout=0) is None
+
+
+def test_values_recorded(db):
+    canfig.record_values()
+    with canfig.watch() as subscription:
+        canfig.apply({"Server.port": 8128})
+        assert subscription.get(timeout=0).values == {"Server": {"port": 8128}}
+
+
+def test_resume_from_a_version(db):
+    canfig.SET("Server.port", 1)
+    seen = db.write_version
+    for port in (2, 3, 4):
+        canfig.SET("Server.port", port)
+
+    with canfig.watch(seen) as subscription:
+        canfig.SET("Server.port", 5)
+        # the missed events from the changelog, then the new one, once each
+        assert versions(subscription) == list(range(seen + 1, seen + 5))
+
+
+def test_pruned_changelog_resets(db, monkeypatch):
+    monkeypatch.setattr(evaluator, "CHANGELOG_SIZE", 2)
+    for port in range(4):
+        canfig.SET("Server.port", port)
+
+    with canfig.watch(0) as subscription:
+        event = subscription.get(timeout=0)
+        assert event.reset and event.version == db.write_version
+        assert event.to_dict() == {"version": event.version, "committed_at": event.committed_at, "reset": True}
+
+    # a watcher within the changelog still gets every event
+    with canfig.watch(db.write_version - 1) as subscription:
+        assert versions(subscription) == [db.write_version]
+
+
+def test_slow_subscription_falls_back_to_the_changelog(db, monkeypatch):
+    monkeypatch.setattr(changefeed, "SUBSCRIPTION_QUEUE_SIZE", 2)
+    with canfig.watch() as subscription:
+        first = db.write_version + 1
+        for port in range(5):
+            canfig.SET("Server.port", port)
+        assert versions(subscription) == list(range(first, first + 5))
+
+
+def test_writes_of_another_process_polled(db, monkeypatch):
+    feed = ChangeFeed(db)
+    subscription = feed.subscribe()
+
+    other = DB(db.db_dir, "fast-local")
+    try:
+        monkeypatch.setattr(canfig, "db", other)
+        canfig.apply({"Server.port": 8128})
+    finally:
+        monkeypatch.setattr(canfig, "db", db)
+        other.close()
+    assert subscription.get(timeout=0) is None
+
+    feed.poll()
+    event = subscription.get(timeout=0)
+    assert event.changes == {"Server": ["port"]}
+    feed.close()
@@ -0,0 +1,119 @@
+import sqlite3
+
+import pytest
+
+import canfig
+from checks import Checks, compile_checks
+from utils import CanfigException
+
+
+def table_checks(ddl: str) -> Checks:
+    connection = sqlite3.connect(":memory:")
+    connection.execute(ddl)
+    (sql,) = connection.execute("SELECT sql FROM sqlite_master").fetchone()
+    info = connection.execute("PRAGMA table_info(t)").fetchall()
+    return compile_checks(sql, info)
+
+
+def test_compile_sample_checks(cplan):
+    checks = {
+        field_dir: [check["name"] for check in spec["checks"]]
+        for config, fields in cplan.fields.items()
+        for field, spec in fields.items()
+        if spec["checks"] and (field_dir := f"{config}.{field}")
+    }
+    assert checks["Server.commands"] == ["LENGTH(description) > 10"]
+    assert checks["Server.alive_time"] == ["CHK_Time"]
+    assert checks["Runner.protocol"] == ["protocol IN ('tcp', 'udp', 'sctp', 'dccp')"]
+
+
+def test_unsupported_checks_are_left_to_sqlite():
+    checks = table_checks(
+        "CREATE TABLE t (a TEXT, b INT, CHECK (a LIKE 'x%'), CHECK (a || 'x' <> 'y'), CHECK (b > 0))"
+    )
+    assert [check["name"] for check in checks] == ["b > 0"]
+
+
+@pytest.mark.parametrize(
+    "row",
+    [
+        {"a": "abc", "b": 5},
+        {"a": None, "b": None},
+        {"a": 5, "b": "5"},
+        {"a": "É", "b": 2.0},
+        {"b": "not a number"},
+        {},
+    ],
+)
+def test_validators_agree_with_sqlite(row):
+    ddl = (
+        "CREATE TABLE t (a TEXT DEFAULT 'dflt', b INT, "
+        "CHECK (LENGTH(a) BETWEEN 2 AND 4), CHECK (b IS NULL OR b * 2 >= 4), "
+        "CHECK (UPPER(a) NOT IN ('ABC', 'X')), CHECK (b <> 3 AND NOT b = 7))"
+    )
+    connection = sqlite3.connect(":memory:")
+    connection.execute(ddl)
+    try:
+        if row:
+            connection.execute(
+                f"INSERT INTO t ({', '.join(row)}) VALUES ({', '.join('?' * len(row))})",
+                tuple(row.values()),
+            )
+        else:
+            connection.execute("INSERT INTO t DEFAULT VALUES")
+        accepted = True
+    except sqlite3.IntegrityError:
+        accepted = False
+
+    try:
+        Checks(table_checks(ddl)).validate("t", [row])
+        validated = True
+    except CanfigException:
+        validated = False
+    # a validator never rejects a row sqlite accepts
+    assert validated or not accepted
+
+
+def test_bind_rejects_a_bad_element_before_any_sql(db):
+    statements = []
+    db.connection.set_trace_callback(statements.append)
+    commands = [{"name": f"c{i}", "description": f"command number {i}"} for i in range(1000)]
+    commands[900]["description"] = "short"
+
+    with pytest.raises(CanfigException, match="element 900 of Server.commands"):
+        canfig.SET("Server.commands", commands)
+    assert statements == []
+
+
+@pytest.mark.parametrize(
+    "values", [[{"name": "c0", "description": "command number 0"}, "c1"], {"name": "c0"}]
+)
+def test_bind_rejects_a_list_of_non_dicts(db, values):
+    with pytest.raises(CanfigException, match="Server.commands is a LIST"):
+        canfig.final_plan["Server"]["commands"].bind(values)
+
+
+def test_rejected_bind_keeps_the_plan(db):
+    plan = canfig.final_plan["Runner"]["protocol"]
+    canfig.SET("Runner.protocol", "tcp")
+
+    with pytest.raises(CanfigException, match="CHECK constraint failed"):
+        plan.bind("bogus")
+
+    assert plan.bound == "tcp"
+    assert plan.view(db) == [{"protocol": "tcp"}]
+    plan.execute(db)
+    assert canfig.GET("Runner.protocol") == [{"protocol": "tcp"}]
+
+
+def test_element_edits_are_validated(db):
+    plan = canfig.final_plan["Server"]["commands"]
+    canfig.SET("Server.commands", [{"name": "a", "description": "a long description"}])
+
+    with pytest.raises(CanfigException):
+        plan.append(db, {"name": "b", "description": "short"})
+    with pytest.raises(CanfigException):
+        plan.update(db, 0, {"description": "short"})
+    plan.update(db, 0, {"name": "renamed"})
+
+    assert canfig.GET("Server.commands") == [{"name": "renamed", "description": "a long description"}]
@@ -0,0 +1,117 @@
+import os
+import threading
+
+import pytest
+
+import compiler
+import dependency
+import schema
+from compile_cache import DeclarationCache
+from compiler import _parse_incremental, compile_source
+from utils import CanfigException
+
+
+def parse(cache_dir, name: str, source: str) -> tuple:
+    cache = DeclarationCache(str(cache_dir), name)
+    parser = _parse_incremental(source, cache)
+    cache.save()
+    return parser, cache
+
+
+def test_incremental_matches_full(cplan, tmp_path, sample_path):
+    cold = compile_source(path=sample_path, cache_dir=str(tmp_path))
+    warm = compile_source(path=sample_path, cache_dir=str(tmp_path))
+
+    for compiled in (cold, warm):
+        assert compiled.meta_data == cplan.meta_data
+        assert compiled.sql_query == cplan.sql_query
+        assert compiled.triggers == cplan.triggers
+        assert compiled.slices == cplan.slices
+
+
+def test_unchanged_declarations_not_recompiled(tmp_path, monkeypatch, sample_source):
+    source = sample_source
+    edited = source.replace("'sctp', 'dccp'", "'sctp', 'dccp', 'quic'")
+    compile_source(source, cache_dir=str(tmp_path), cache_name="sample")
+
+    checked, compiled, analyzed = [], [], []
+
+    def counted(calls, f):
+        def wrapper(*args):
+            calls.append(args[0])
+            return f(*args)
+
+        return wrapper
+
+    monkeypatch.setattr(schema, "compile_checks", counted(checked, schema.compile_checks))
+    monkeypatch.setattr(compiler, "compile_trigger", counted(compiled, compiler.compile_trigger))
+    monkeypatch.setattr(dependency, "trigger_reads", counted(analyzed, dependency.trigger_reads))
+
+    warm = compile_source(edited, cache_dir=str(tmp_path), cache_name="sample")
+    # only the table of the edited CONFIG is applied and its CHECKs compiled
+    assert [sql.split("(")[0].split()[-1] for sql in checked] == ["Runner"]
+    assert (compiled, analyzed) == ([], [])
+    assert warm.to_dict() == compile_source(edited).to_dict()
+
+    checked.clear()
+    compile_source(edited, cache_dir=str(tmp_path), cache_name="sample")
+    assert checked == []
+
+
+def test_key_is_declaration_text(tmp_path, sample_source):
+    source = sample_source
+    _, cache = parse(tmp_path, "sample", source)
+    assert cache.hits == 0
+
+    # the declaration after an edited one is still a hit
+    edited = source.replace('@author        "erdao";', '@author        "someone else";')
+    _, cache = parse(tmp_path, "sample", edited)
+    assert (cache.hits, cache.misses) == (15, 1)
+
+
+def test_unnamed_source_is_not_cached(tmp_path, sample_source):
+    compile_source(sample_source, cache_dir=str(tmp_path))
+    assert os.listdir(tmp_path) == []
+
+    compile_source(sample_source, cache_dir=str(tmp_path), cache_name="sample")
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_threads_save_one_cache(tmp_path, sample_source):
+    source = sample_source
+    errors = []
+
+    def compile_edited(k: int):
+        try:
+            parse(tmp_path, "sample", source.replace('"erdao"', f'"author {k}"'))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=compile_edited, args=(k,)) for k in range(16)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert [f for f in os.listdir(tmp_path) if f.endswith(".tmp")] == []
+    _, cache = parse(tmp_path, "sample", source)
+    assert cache.misses == 1
+
+
+@pytest.mark.parametrize("source", ['@version "1" "2";', "CONFIG X X X;", "X {"])
+def test_errors_as_without_cache(tmp_path, source):
+    with pytest.raises(CanfigException) as uncached:
+        compile_source(source)
+    with pytest.raises(CanfigException) as cached:
+        compile_source(source, cache_dir=str(tmp_path), cache_name="bad")
+    assert str(cached.value) == str(uncached.value)
+
+
+def test_cache_bug_is_not_hidden(tmp_path, monkeypatch, sample_path):
+    def broken(self, key):
+        raise RuntimeError("broken cache")
+
+    monkeypatch.setattr(DeclarationCache, "get", broken)
+    with pytest.raises(RuntimeError, match="broken cache"):
+        compile_source(path=sample_path, cache_dir=str(tmp_path))
@@ -0,0 +1,107 @@
+import hashlib
+import shutil
+import threading
+
+import pytest
+
+import candy
+import compiler
+from bench.schema import generate_schema
+from compiler import compile_file, compile_many, compile_source
+
+
+def test_threads_compile_on_their_own():
+    sources = [generate_schema(n) for n in (1, 2, 3, 4)]
+    expected = [compile_source(source).to_dict() for source in sources]
+
+    results, errors = {}, []
+
+    def run(i: int):
+        try:
+            for _ in range(5):
+                results[i] = compile_source(sources[i]).to_dict()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(sources))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert [results[i] for i in range(len(sources))] == expected
+
+
+def test_plan_is_self_contained():
+    first = compile_source(generate_schema(1))
+    compile_source(generate_schema(3))
+    assert first.to_dict() == compile_source(generate_schema(1)).to_dict()
+
+
+def test_source_or_path(sample_path):
+    with pytest.raises(AssertionError):
+        compile_source()
+    with pytest.raises(AssertionError):
+        compile_source("", path=sample_path)
+
+    with open(sample_path, "rb") as f:
+        assert compile_source(f.read()).to_dict() == compile_source(path=sample_path).to_dict()
+
+
+def test_compile_file_skips_a_fresh_candy(tmp_path, sample_path):
+    input_file = str(tmp_path / "sample.cand")
+    shutil.copy(sample_path, input_file)
+
+    assert compile_file(input_file) == (str(tmp_path / "sample.candy"), True)
+    assert compile_file(input_file) == (str(tmp_path / "sample.candy"), False)
+    assert compile_file(input_file, force=True)[1]
+
+    with open(input_file, "a") as f:
+        f.write("\nSLICE Extra = <Server.port>;\n")
+    assert compile_file(input_file)[1]
+
+
+def test_compile_file_compiles_the_bytes_it_hashed(tmp_path, monkeypatch, sample_path):
+    input_file = str(tmp_path / "sample.cand")
+    shutil.copy(sample_path, input_file)
+    with open(input_file, "rb") as f:
+        source = f.read()
+
+    def edited_meanwhile(*args, **kwargs):
+        with open(input_file, "a") as f:
+            f.write("\nSLICE Extra = <Server.port>;\n")
+        return real_compile_source(*args, **kwargs)
+
+    real_compile_source = compiler.compile_source
+    monkeypatch.setattr(compiler, "compile_source", edited_meanwhile)
+    cplan_file, _ = compile_file(input_file)
+    monkeypatch.undo()
+
+    assert candy.read_md5(cplan_file) == hashlib.md5(source).hexdigest()
+    assert "Extra" not in candy.load(cplan_file)["slices"]
+    # the edit is compiled by the next run
+    assert compile_file(input_file)[1]
+
+
+def test_compile_many(tmp_path, capsys, sample_path):
+    for name in ("a", "b"):
+        (tmp_path / "defs" / name).mkdir(parents=True)
+        shutil.copy(sample_path, tmp_path / "defs" / name / f"{name}.cand")
+    (tmp_path / "defs" / "bad.cand").write_text("CONFIG X X X;")
+
+    assert compile_many(str(tmp_path / "defs"), jobs=2) == 1
+
+    with open(sample_path, "rb") as f:
+        md5 = compile_source(f.read()).md5
+    for name in ("a", "b"):
+        assert candy.read_md5(str(tmp_path / "defs" / name / f"{name}.candy")) == md5
+    assert not (tmp_path / "defs" / "bad.candy").exists()
+
+    out = capsys.readouterr().out
+    assert "3 file(s), 1 failed" in out
+    assert out.count("compiled") == 2 and "failed" in out
+
+    # fresh candies are not compiled again
+    assert compile_many(str(tmp_path / "defs"), jobs=2) == 1
+    assert capsys.readouterr().out.count("fresh") == 2
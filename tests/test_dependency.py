@@ -0,0 +1,36 @@
+from dependency import trigger_index, trigger_reads
+
+FIELDS = {
+    "Server": {"port": {}, "name": {}, "commands": {}},
+    "Runner": {"protocol": {}},
+}
+
+
+def trigger(name: str, condition: str, cmd: str) -> dict:
+    return {"name": name, "condition": condition, "cmd": cmd}
+
+
+def test_trigger_reads():
+    assert trigger_reads("T", 'GET("Server.port")\nGET("Runner.protocol")\nGET("Server.port")') == [
+        "Server.port",
+        "Runner.protocol",
+    ]
+    assert trigger_reads("T", 'field = "Server.port"\nGET(field)') is None
+    assert trigger_reads("T", "get = GET") is None
+
+
+def test_index_only_watched_config():
+    index = trigger_index(
+        [
+            trigger("T", "Server", 'GET("Server.port")\nGET("Runner.protocol")'),
+            trigger("U", "Server", '    if GET("Runner.protocol") == "tcp":\n        pass'),
+            trigger("V", "Runner", 'x = GET'),
+        ],
+        FIELDS,
+    )
+    assert index == {
+        "Server.port": ["T", "U"],
+        "Server.name": ["U"],
+        "Server.commands": ["U"],
+        "Runner.protocol": ["V"],
+    }
@@ -0,0 +1,112 @@
+import pytest
+
+import canfig
+from evaluator import DB
+from migration import migrate
+from utils import CanfigException
+
+
+@pytest.fixture
+def hdb(db, cplan, tmp_path):
+    _db = DB(str(tmp_path / "history.sqlite3"), "fast-local", history=50)
+    migrate(_db, cplan.tables, cplan.schema)
+    canfig.db = _db
+    yield _db
+    _db.close()
+
+
+@pytest.fixture
+def pruned_db(db, cplan, tmp_path):
+    _db = DB(str(tmp_path / "pruned.sqlite3"), "fast-local", history=5, prune_every=10)
+    migrate(_db, cplan.tables, cplan.schema)
+    canfig.db = _db
+    yield _db
+    _db.close()
+
+
+def write(values: dict) -> int:
+    canfig.apply(values)
+    return canfig.db.write_version
+
+
+def test_rollback(hdb, commands):
+    v1 = write({"Server.port": 1, "Server.name": {"NAME": "a"}, "Server.commands": commands(3)})
+    v2 = write({"Server.port": 2, "Server.name": {"NAME": "b"}, "Server.commands": commands(5)})
+    plan = canfig.final_plan["Server"]["commands"]
+    plan.update(hdb, 0, {"description": "changed description"})
+    plan.remove(hdb, -1)
+
+    assert "Server" in canfig.rollback(v1)
+    server = canfig.snapshot("Server")
+    assert server["port"] == 1
+    assert server["name"] == {"NAME": "a"}
+    assert [c["name"] for c in server["commands"]] == ["c0", "c1", "c2"]
+    assert canfig.GET("Server.port") == [{"port": 1}]
+
+    # the rollback is a new version, the ones before it are still readable
+    assert hdb.write_version > v2
+    rolled_back = hdb.write_version
+    assert canfig.snapshot("Server", v2)["commands"] == commands(5)
+
+    canfig.SET("Server.port", 77)
+    assert canfig.snapshot("Server", rolled_back)["port"] == 1
+    assert canfig.snapshot("Server")["port"] == 77
+    assert len(canfig.GET("Server.commands")) == 3
+
+
+def test_rollback_out_of_history(hdb):
+    write({"Server.port": 1})
+    with pytest.raises(CanfigException, match="not in history"):
+        canfig.rollback(hdb.write_version + 1)
+
+
+def test_versions_pruned(hdb):
+    first = write({"Server.port": 0})
+    for k in range(1, 160):
+        write({"Server.port": k})
+
+    assert hdb.history.history_from(hdb) > first
+    with pytest.raises(CanfigException, match="not in history"):
+        canfig.rollback(first)
+    assert canfig.snapshot("Server")["port"] == 159
+
+
+def test_prune_every(pruned_db):
+    first = write({"Server.port": 0})
+    while pruned_db.write_version % 10:
+        assert pruned_db.history.history_from(pruned_db) < first
+        write({"Server.port": pruned_db.write_version})
+
+    assert pruned_db.history.history_from(pruned_db) == pruned_db.write_version - 5
+
+
+def link_rows(hdb, link: str) -> int:
+    with hdb.reader() as cursor:
+        return cursor.execute(f"SELECT COUNT(*) FROM {link}").fetchone()[0]
+
+
+def test_links_copied_only_when_the_list_is_written(hdb, commands):
+    v1 = write({"Server.commands": commands(50)})
+    link = f"{canfig.schema_fields['Server']['commands']['ext_table']}_Server"
+    links = link_rows(hdb, link)
+
+    for port in range(1, 20):
+        write({"Server.port": port})
+    assert link_rows(hdb, link) == links
+    assert canfig.snapshot("Server")["commands"] == commands(50)
+    assert len(canfig.GET("Server.commands")) == 50
+
+    canfig.final_plan["Server"]["commands"].remove(hdb, 0)
+    assert link_rows(hdb, link) == links + 49
+    assert canfig.snapshot("Server", v1)["commands"] == commands(50)
+    assert canfig.snapshot("Server")["commands"] == commands(50)[1:]
+
+
+def test_prune_keeps_the_links_a_kept_row_reads(hdb, commands):
+    write({"Server.commands": commands(3)})
+    for k in range(1, 160):
+        write({"Server.port": k})
+
+    assert canfig.snapshot("Server")["commands"] == commands(3)
+    canfig.final_plan["Server"]["commands"].append(hdb, commands(4)[3])
+    assert canfig.snapshot("Server")["commands"] == commands(4)
@@ -0,0 +1,84 @@
+import os
+import shutil
+
+import pytest
+
+from bench.bench_lexer import ocaml_available, ocaml_lexing
+from lexer import lex, split_declarations
+from utils import CanfigException
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tokens(source: str) -> list:
+    return [str(token) for token in lex(source)]
+
+
+# token streams of the ast.mll rules, as the old tokenizer read them back
+# from the .cando file
+@pytest.mark.parametrize(
+    "source, expected",
+    [
+        (
+            '@version "1.0"; @storage "fast-local";',
+            ["VERSION", "STRING(1.0)", "SEMI", "STORAGE", "STRING(fast-local)", "SEMI"],
+        ),
+        ("STRUCT CONFIG TRIGGER SLICE Nm_x", ["STRUCT", "CONFIG", "TRIGGER", "SLICE", "IDENT(Nm_x)"]),
+        (
+            "TRIGGER T WHEN CHANGE Server {x};",
+            ["TRIGGER", "IDENT(T)", "TRICOND", "IDENT(Server)", "COMMAND(x)", "SEMI"],
+        ),
+        (
+            "STRUCT S(a:int = 1) {n TEXT;};",
+            ["STRUCT", "IDENT(S)", "ARGUMENT(a:int = 1)", "COMMAND(n TEXT;)", "SEMI"],
+        ),
+        ("X {a {b} (* c (* d *) *) e};", ["IDENT(X)", "COMMAND(a {b}  e)", "SEMI"]),
+        ("(* a (* nested *) comment *) X // line comment\nY", ["IDENT(X)", "IDENT(Y)"]),
+        ("X // comment until eof", ["IDENT(X)"]),
+        ('"a\\tb\\"c\\\\d\\ e"', ['STRING(a\tb"c\\d e)']),
+        ('"\\101\\\n    B"', ["STRING(AB)"]),
+        # ast.mll drops the last character before ';', the native lexer keeps it
+        ("SLICE A = <B>;", ["SLICE", "IDENT(A)", "COMMAND( <B>)", "SEMI"]),
+    ],
+)
+def test_ast_rules(source, expected):
+    assert tokens(source) == expected
+
+
+@pytest.mark.parametrize(
+    "source, error",
+    [
+        ("X *)", "unmatched closed comment"),
+        ("(* open", "unmatched open comment"),
+        ("X {a (* b", "unmatched open comment"),
+        ("X {a", "unmatched command block"),
+        ("X }", "unmatched command block"),
+        ("X (a", "unmatched ()"),
+        ("X )", "unmatched ()"),
+        ("x", "unexpected character"),
+    ],
+)
+def test_ast_errors(source, error):
+    with pytest.raises(CanfigException, match=error):
+        list(lex(source))
+
+
+def test_declarations_lex_like_the_source(sample_source):
+    split = [token for decl in split_declarations(sample_source) for token in tokens(decl)]
+    assert split == tokens(sample_source)
+
+
+def test_same_tokens_as_ocaml(tmp_path, monkeypatch, sample_path, sample_source):
+    monkeypatch.chdir(ROOT)
+    if not ocaml_available():
+        pytest.skip("ocaml toolchain not found")
+
+    cand_file = str(tmp_path / "sample.cand")
+    shutil.copy(sample_path, cand_file)
+    old = [str(token) for token in ocaml_lexing(cand_file)]
+    new = tokens(sample_source)
+
+    assert len(old) == len(new)
+    for old_token, new_token in zip(old, new):
+        # the '= ...;' rule of ast.mll drops the last character before ';'
+        assert old_token in (new_token, new_token[:-2] + ")")
@@ -0,0 +1,57 @@
+import canfig
+
+COMMANDS = "Server.commands"
+
+
+def element_ids(db) -> list:
+    with db.reader() as cursor:
+        cursor.execute("SELECT COMMAND_id FROM COMMAND_Server ORDER BY pos")
+        return [row[0] for row in cursor.fetchall()]
+
+
+def test_replace_keeps_equal_elements(db, commands):
+    canfig.SET(COMMANDS, commands("a", "b", "c", "d"))
+    a, b, c, d = element_ids(db)
+
+    canfig.SET(COMMANDS, commands("a", "c", "x", "d", "e"))
+
+    assert canfig.GET(COMMANDS) == commands("a", "c", "x", "d", "e")
+    ids = element_ids(db)
+    assert ids[0] == a and ids[1] == c and ids[3] == d
+    assert b not in ids
+
+
+def test_replace_writes_left_out_columns_as_an_insert(db):
+    canfig.SET(COMMANDS, [{"name": "a", "description": "first long description"}])
+    canfig.SET(COMMANDS, [{"name": "b"}])
+    replaced = canfig.GET(COMMANDS)
+
+    canfig.SET(COMMANDS, [])
+    canfig.SET(COMMANDS, [{"name": "b"}])
+
+    assert replaced == canfig.GET(COMMANDS) == [{"name": "b", "description": None}]
+
+
+def test_element_operations(db, commands):
+    plan = canfig.final_plan["Server"]["commands"]
+    canfig.SET(COMMANDS, commands("a", "b"))
+
+    plan.append(db, commands("c"))
+    plan.update(db, 0, {"description": "the first command"})
+    plan.remove(db, 1)
+
+    assert canfig.GET(COMMANDS) == [
+        {"name": "a", "description": "the first command"},
+        *commands("c"),
+    ]
+
+
+def test_reorder_and_shrink(db, commands):
+    canfig.SET(COMMANDS, commands(*"abcdef"))
+    canfig.SET(COMMANDS, commands(*"fedcba"))
+    assert canfig.GET(COMMANDS) == commands(*"fedcba")
+
+    canfig.SET(COMMANDS, commands("c"))
+    assert canfig.GET(COMMANDS) == commands("c")
+    with db.reader() as cursor:
+        assert cursor.execute("SELECT COUNT(*) FROM COMMAND").fetchone()[0] == 1
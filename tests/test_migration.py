@@ -0,0 +1,79 @@
+import canfig
+from compiler import compile_source
+from evaluator import DB
+from migration import applied_fingerprint, migrate
+
+
+def scalar(_db: DB, sql: str):
+    _db.execute(sql)
+    return next(iter(_db.fetchall()[0].values()))
+
+
+def test_restart_on_the_same_schema(db, cplan):
+    canfig.apply({"Server.port": 8128, "Runner.protocol": "udp"})
+    db_file = db.db_dir
+    db.close()
+
+    _db = DB(db_file, "fast-local")
+    try:
+        assert migrate(_db, cplan.tables, cplan.schema) == []
+        assert scalar(_db, "SELECT port FROM Server") == 8128
+        assert scalar(_db, "SELECT protocol FROM Runner") == "udp"
+    finally:
+        _db.close()
+
+
+def test_only_the_changed_table_is_migrated(db, cplan, sample_source):
+    canfig.apply({"Server.port": 8128, "Runner.protocol": "udp"})
+    changed = compile_source(
+        sample_source.replace(
+            "    runner_name     TEXT OPTIONAL,",
+            "    retries         INT DEFAULT 3,\n    runner_name     TEXT OPTIONAL,",
+        )
+    )
+
+    script = migrate(db, changed.tables, changed.schema)
+    assert script and all("Runner" in sql for sql in script)
+    assert applied_fingerprint(db) == changed.schema["fingerprint"]
+
+    # the values of both configs are kept, the new column has its DEFAULT
+    assert scalar(db, "SELECT port FROM Server") == 8128
+    assert scalar(db, "SELECT protocol FROM Runner") == "udp"
+    assert scalar(db, "SELECT retries FROM Runner") == 3
+    assert scalar(db, "SELECT COUNT(*) FROM _canfig_migration") == 2
+
+
+def test_whitespace_does_not_migrate(db, cplan, sample_source):
+    spaced = compile_source(sample_source.replace("    port            INT,", "    port    INT,"))
+    assert spaced.schema == cplan.schema
+    assert migrate(db, spaced.tables, spaced.schema) == []
+
+
+def test_removed_config_is_dropped(db, cplan, sample_source):
+    # Runner and the trigger and slices declared after it
+    without = compile_source(sample_source.split("CONFIG Runner")[0])
+
+    assert "DROP TABLE IF EXISTS Runner" in migrate(db, without.tables, without.schema)
+    db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Runner'")
+    assert db.fetchall() == []
+
+
+def test_tables_loaded_only_to_migrate(cplan, tmp_path):
+    loaded = []
+
+    def tables():
+        loaded.append(True)
+        return cplan.tables
+
+    _db = DB(str(tmp_path / "lazy.sqlite3"), "fast-local")
+    try:
+        # a fresh database is bootstrapped from the tables
+        assert migrate(_db, tables, cplan.schema) != []
+        assert loaded == [True]
+        assert applied_fingerprint(_db) == cplan.schema["fingerprint"]
+
+        # on the schema, the tables are never asked for
+        assert migrate(_db, tables, cplan.schema) == []
+        assert loaded == [True]
+    finally:
+        _db.close()
@@ -0,0 +1,68 @@
+import json
+import logging
+import os
+
+import pytest
+
+from bench.bench_parser import MachineParser, parse
+from common import TokenType
+from compiler import Parser
+
+GOLDEN = os.path.join(os.path.dirname(__file__), "parser_golden.json")
+
+
+def test_every_token_has_a_transition():
+    for state in Parser.states:
+        for token_type in TokenType:
+            assert (state, token_type) in Parser.dispatch
+
+
+def test_sample_declarations(sample_source):
+    meta_data, sql_query, triggers, slices = parse(Parser, sample_source)
+
+    assert meta_data["AUTHOR"] == "erdao"
+    assert [(p["type"], p["name"]) for p in sql_query] == [
+        ("STRUCT", "COMMAND"),
+        ("STRUCT", "TIME_S"),
+        ("STRUCT", "NAME"),
+        ("CONFIG", "Server"),
+        ("CONFIG", "Runner"),
+    ]
+    assert [(t["name"], t["condition"]) for t in triggers] == [("ServerChangeAction", "Server")]
+    assert [s["name"] for s in slices] == ["Default", "UserConfig", "DevConfig"]
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "STRUCT {};",
+        "CONFIG Server Runner;",
+        "TRIGGER T WHEN CHANGE { x };",
+        '@version "1" "2";',
+        "CONFIG X X X;",
+    ],
+)
+def test_errors(source):
+    ret = parse(Parser, source)
+    assert ret[0] == "error" and ret[1].startswith("parse error in state")
+
+
+def golden() -> list:
+    # captured from the transitions Machine by python3 -m bench.bench_parser --golden
+    with open(GOLDEN) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize("case", golden())
+def test_same_as_machine(case):
+    # tuples come back from json as lists
+    assert json.loads(json.dumps(parse(Parser, case["source"]))) == case["expected"]
+
+
+@pytest.mark.parametrize("case", golden())
+def test_golden_up_to_date(case):
+    pytest.importorskip("transitions")
+    # the Machine warns about the ERROR method already bound on the model
+    logging.getLogger("transitions").setLevel(logging.ERROR)
+
+    assert parse(Parser, case["source"]) == parse(MachineParser, case["source"])
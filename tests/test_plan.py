@@ -0,0 +1,55 @@
+import sqlite3
+
+import pytest
+
+import canfig
+from evaluator import RowMode
+from utils import CanfigException
+
+
+def test_view_reads_fields_not_bound_in_this_process(db, cplan):
+    canfig.apply(
+        {
+            "Server.port": 8128,
+            "Server.commands": [{"name": "start", "description": "start the server"}],
+        }
+    )
+
+    # plans of a new process on the same database
+    canfig.final_plan.clear()
+    canfig.build_plans(cplan.fields)
+
+    assert canfig.GET("Server.port") == [{"port": 8128}]
+    assert canfig.GET("Server.commands") == [{"name": "start", "description": "start the server"}]
+    assert canfig.scope("<Server.port>").get("Server.port") == [{"port": 8128}]
+    assert canfig.snapshot("Server")["port"] == 8128
+    assert canfig.snapshot_field("Server.port") == 8128
+    assert canfig.snapshot_field("Server.commands") == [
+        {"name": "start", "description": "start the server"}
+    ]
+
+
+def test_view_row_modes(db):
+    canfig.SET("Server.commands", [{"name": "start", "description": "start the server"}])
+    plan = canfig.final_plan["Server"]["commands"]
+
+    assert plan.view(db, RowMode.TUPLE) == [("start", "start the server")]
+    (row,) = plan.view(db, RowMode.ROW)
+    assert isinstance(row, sqlite3.Row)
+    assert row["description"] == "start the server" and row[0] == "start"
+    assert row.keys() == ["name", "description"]
+    assert plan.view(db) == [{"name": "start", "description": "start the server"}]
+
+
+def test_snapshot_field_query_cached(db):
+    canfig.SET("Server.port", 8128)
+    assert canfig.snapshot_field("Server.port") == 8128
+    query = canfig.snapshot_queries[("field", "Server.port")]
+    assert query.selection == {"Server": ["port"]}
+
+    canfig.SET("Server.port", 8129)
+    assert canfig.snapshot_field("Server.port") == 8129
+    assert canfig.snapshot_queries[("field", "Server.port")] is query
+
+    with pytest.raises(CanfigException, match="not exist"):
+        canfig.snapshot_field("Server.nothing")
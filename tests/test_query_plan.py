@@ -0,0 +1,68 @@
+import pytest
+
+import canfig
+from compiler import compile_source
+from migration import migrate
+from query_plan import full_scans, verify_read_plans
+from utils import CanfigException
+
+
+def indexes(db, table: str) -> list:
+    db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+        (table,),
+    )
+    return [row["name"] for row in db.fetchall()]
+
+
+def test_sample_reads_use_an_index(db):
+    assert canfig.verify_plans() > 0
+
+
+def test_full_scan_found(db):
+    assert full_scans(db, "SELECT * FROM Server WHERE port = ?", (1,)) == ["SCAN Server"]
+    assert full_scans(db, "SELECT * FROM Server WHERE Server_id = ?", (1,)) == []
+    # a SELECT without FROM and the rows of a subquery are not scans of a table
+    assert full_scans(db, "SELECT 1") == []
+    assert full_scans(db, "SELECT * FROM (SELECT port FROM Server WHERE Server_id = 1) LIMIT 1") == []
+
+    reads = {
+        "by port": ("SELECT * FROM Server WHERE port = 1", ()),
+        "by id": ("SELECT * FROM Server WHERE Server_id = 1", ()),
+    }
+    failed = verify_read_plans(db, reads)
+    assert list(failed) == ["by port"]
+
+
+def test_missing_index_fails(db):
+    db.execute("DROP INDEX COMMAND_Server_Server_id_pos_idx")
+    with pytest.raises(CanfigException, match="read plan\\(s\\) scan a whole table"):
+        canfig.verify_plans()
+
+
+def test_join_tables_keyed_and_indexed(db, cplan):
+    joins = [table["name"] for table in cplan.tables if table["kind"] == "M2M"]
+    assert joins
+    for name in joins:
+        db.execute(f"SELECT sql FROM sqlite_master WHERE type = 'table' AND name = '{name}'")
+        assert db.fetchall()[0]["sql"].rstrip().endswith("WITHOUT ROWID")
+        config = name.rsplit("_", 1)[1]
+        assert indexes(db, name) == [f"{name}_{config}_id_pos_idx"]
+
+    # a struct reference column of a config
+    assert "Server_alive_time_idx" in indexes(db, "Server")
+
+
+def test_rebuilt_table_keeps_its_indexes(db, sample_source):
+    changed = compile_source(
+        sample_source.replace(
+            "    runner_name     TEXT OPTIONAL,",
+            "    retries         INT DEFAULT 3,\n    runner_name     TEXT OPTIONAL,",
+        )
+    )
+    assert migrate(db, changed.tables, changed.schema)
+    assert indexes(db, "Runner") == ["Runner_alive_time_idx"]
+
+    canfig.final_plan.clear()
+    canfig.build_plans(changed.fields)
+    assert canfig.verify_plans() > 0
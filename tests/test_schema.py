@@ -0,0 +1,91 @@
+import re
+
+import pytest
+
+import canfig
+import evaluator
+from compiler import compile_source
+from evaluator import DB
+from migration import migrate
+from utils import CanfigException
+
+
+def test_sample_tables(cplan):
+    assert [(t["name"], t["kind"]) for t in cplan.tables] == [
+        ("COMMAND", "STRUCT"),
+        ("TIME_S", "STRUCT"),
+        ("NAME", "STRUCT"),
+        ("TIME_S_5", "STRUCT"),
+        ("Server", "CONFIG"),
+        ("COMMAND_Server", "M2M"),
+        ("TIME_S_5_Server", "M2M"),
+        ("TEXT", "STRUCT"),
+        ("TIME_S_500", "STRUCT"),
+        ("Runner", "CONFIG"),
+        ("COMMAND_Runner", "M2M"),
+        ("TEXT_Runner", "M2M"),
+    ]
+
+    # a struct instance takes its argument
+    ddl = {t["name"]: " ".join(t["ddl"]) for t in cplan.tables}
+    assert "minute<5" in ddl["TIME_S_5"].replace(" ", "")
+    assert "minute<500" in ddl["TIME_S_500"].replace(" ", "")
+
+
+def test_sample_fields(cplan):
+    spec = {
+        (config, field): (s["kind"], s["ext_table"], s["columns"])
+        for config, fields in cplan.fields.items()
+        for field, s in fields.items()
+    }
+    assert spec[("Server", "port")] == ("std", None, [])
+    assert spec[("Server", "name")] == ("ext", "NAME", ["NAME"])
+    assert spec[("Server", "alive_in")] == ("list", "TIME_S_5", ["minute", "second"])
+    assert spec[("Runner", "nickname")] == ("list", "TEXT", ["val"])
+    assert spec[("Runner", "alive_time")] == ("ext", "TIME_S_500", ["minute", "second"])
+    assert len(spec) == 12
+
+
+def test_fresh_database_has_every_table(cplan, tmp_path):
+    _db = DB(str(tmp_path / "fresh.sqlite3"), "fast-local")
+    try:
+        assert migrate(_db, cplan.tables, cplan.schema) == [
+            sql for table in cplan.tables for sql in table["ddl"]
+        ]
+        _db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")
+        names = {row["name"] for row in _db.fetchall()}
+        assert {t["name"] for t in cplan.tables} <= names
+
+        # every config has its single row
+        for config in cplan.fields:
+            _db.execute(f"SELECT COUNT(*) AS n FROM {config}")
+            assert _db.fetchall()[0]["n"] == 1
+    finally:
+        _db.close()
+
+
+def test_plans_built_without_the_sql(cplan, monkeypatch):
+    def parse_sql(*args, **kwargs):
+        raise AssertionError("the evaluator parsed the sql")
+
+    monkeypatch.setattr(evaluator, "pre_sql_get_args", parse_sql)
+    monkeypatch.setattr(evaluator.PreSQL, "make", parse_sql)
+
+    canfig.final_plan.clear()
+    canfig.build_plans(cplan.fields)
+    assert sorted(canfig.final_plan["Runner"]) == sorted(cplan.fields["Runner"])
+
+
+@pytest.mark.parametrize(
+    "source, error",
+    [
+        ("CONFIG C { values LIST(FOO) };", "invalid type LIST(FOO)"),
+        ("CONFIG C { port INT };\nCONFIG C { name TEXT };", "CONFIG 'C' already defined"),
+        ("STRUCT S { a INT };\nSTRUCT S { b INT };", "STRUCT 'S' already defined"),
+        ("STRUCT S { a INT };\nCONFIG S { b INT };", "CONFIG 'S' already defined"),
+        ("STRUCT S { a INT, a INT };", "invalid STRUCT 'S'"),
+    ],
+)
+def test_schema_errors(source, error):
+    with pytest.raises(CanfigException, match=re.escape(error)):
+        compile_source(source)
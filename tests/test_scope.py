@@ -0,0 +1,25 @@
+import canfig
+
+
+def expressions(n: int) -> list:
+    return ["(" * k + "Server - <Server.port>" + ")" * k for k in range(n)]
+
+
+def test_composed_slices_are_bounded(db, monkeypatch):
+    monkeypatch.setattr(canfig, "SNAPSHOT_CACHE_SIZE", 4)
+    expected = canfig.scope("Server - <Server.port>").snapshot()
+
+    for expr in expressions(20):
+        assert canfig.scope(expr).snapshot() == expected
+        assert len(canfig.snapshot_queries) <= 4
+
+
+def test_recently_used_query_is_kept(db, monkeypatch):
+    monkeypatch.setattr(canfig, "SNAPSHOT_CACHE_SIZE", 4)
+    canfig.snapshot("Server")
+
+    for expr in expressions(10):
+        canfig.snapshot("Server")
+        canfig.scope(expr).snapshot()
+
+    assert ("config", "Server") in canfig.snapshot_queries
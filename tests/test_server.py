@@ -0,0 +1,138 @@
+import asyncio
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import Request
+
+import canfig
+import server
+from evaluator import DB
+
+
+def watch(n: int, since: int | None = None, last_event_id: str | None = None) -> list:
+    """
+    first n messages of GET /watch, the stream never ends so it is read
+    from the endpoint instead of a client
+    """
+    headers = [] if last_event_id is None else [(b"last-event-id", last_event_id.encode())]
+
+    async def read():
+        response = await server.watch(Request({"type": "http", "headers": headers}), since)
+        stream = response.body_iterator
+        try:
+            return [await anext(stream) for _ in range(n)]
+        finally:
+            await stream.aclose()
+
+    return asyncio.run(read())
+
+
+@pytest.fixture
+def client(cplan, tmp_path, monkeypatch):
+    cplan.dump(candy_file := str(tmp_path / "sample.candy"))
+    monkeypatch.setattr(server, "CANDY_FILE", candy_file)
+    monkeypatch.setattr(server, "SERVER_DB_FILE", str(tmp_path / "server.sqlite3"))
+    canfig.final_plan.clear()
+    with TestClient(server.app) as _client:
+        yield _client
+
+
+@pytest.mark.parametrize("path", ["/config/Server", "/config/Server/port", "/slice/UserConfig"])
+def test_any_tag_matches_an_existing_resource(client, path):
+    assert client.get(path, headers={"If-None-Match": "*"}).status_code == 304
+
+
+@pytest.mark.parametrize("path", ["/config/Nope", "/config/Server/nope", "/slice/Nope"])
+def test_no_tag_matches_a_missing_resource(client, path):
+    etag = client.get("/config/Server").headers["ETag"]
+
+    assert client.get(path, headers={"If-None-Match": "*"}).status_code == 404
+    assert client.get(path, headers={"If-None-Match": etag}).status_code == 404
+
+
+def test_etag_of_the_write_version(client, cplan):
+    response = client.get("/config/Server")
+    assert response.status_code == 200
+    assert response.json()["description"] == "default description"
+    assert response.headers["ETag"] == f'"{cplan.md5[:12]}-{server.served.db.write_version}"'
+
+    # every resource is tagged by the same version
+    assert client.get("/slice/UserConfig").headers["ETag"] == response.headers["ETag"]
+
+
+def test_current_tag_not_read_again(client, monkeypatch):
+    etag = client.get("/config/Server").headers["ETag"]
+
+    def read(*args):
+        raise AssertionError("the database is read")
+
+    monkeypatch.setattr(canfig, "snapshot", read)
+    for if_none_match in (etag, f'"other", {etag}'):
+        response = client.get("/config/Server", headers={"If-None-Match": if_none_match})
+        assert response.status_code == 304
+        assert response.headers["ETag"] == etag
+        assert response.content == b""
+
+
+def test_write_changes_the_tag(client):
+    etag = client.get("/config/Server/port").headers["ETag"]
+
+    canfig.apply({"Server.port": 8128})
+    response = client.get("/config/Server/port", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json() == 8128
+    assert response.headers["ETag"] != etag
+
+
+def test_write_of_another_process_changes_the_tag(client, monkeypatch):
+    etag = client.get("/config/Server").headers["ETag"]
+
+    other = DB(server.served.db.db_dir, "fast-local")
+    try:
+        monkeypatch.setattr(canfig, "db", other)
+        canfig.apply({"Server.port": 8128})
+    finally:
+        monkeypatch.setattr(canfig, "db", server.served.db)
+        other.close()
+
+    # seen by the poll of the server
+    deadline = time.monotonic() + 5
+    while (response := client.get("/config/Server", headers={"If-None-Match": etag})).status_code == 304:
+        assert time.monotonic() < deadline, "the write is not seen"
+        time.sleep(server.VERSION_POLL)
+    assert response.json()["port"] == 8128
+
+
+def test_slice(client):
+    canfig.apply({"Server.port": 8128, "Runner.protocol": "udp"})
+    body = client.get("/slice/UserConfig").json()
+    assert body["Server"] == {"name": None, "port": 8128, "description": "default description"}
+    assert body["Runner"]["protocol"] == "udp"
+    assert "commands" not in body["Runner"]
+
+    composed = client.get("/slice/UserConfig - Runner").json()
+    assert list(composed) == ["Server"]
+
+
+def test_watch_from_a_version(client):
+    canfig.apply({"Server.port": 8128})
+    canfig.apply({"Runner.protocol": "udp"})
+
+    start, *events = watch(3, since=0)
+    assert start == "retry: 1000\nid: 0\n\n"
+    assert [event.split("\n")[:2] for event in events] == [
+        ["id: 1", "event: change"],
+        ["id: 2", "event: change"],
+    ]
+    assert json.loads(events[1].split("\n")[2].removeprefix("data: "))["changes"] == {"Runner": ["protocol"]}
+
+    # a reconnecting client resumes after its Last-Event-ID
+    start, event = watch(2, last_event_id="1")
+    assert start.startswith("retry: 1000\nid: 1\n")
+    assert event.startswith("id: 2\n")
+
+
+def test_watch_invalid_last_event_id(client):
+    assert client.get("/watch", headers={"Last-Event-ID": "x"}).status_code == 400
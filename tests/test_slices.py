@@ -0,0 +1,115 @@
+import re
+
+import pytest
+
+import canfig
+from slices import SliceRegistry, compile_slices
+from utils import CanfigException
+
+FIELDS = {
+    "Server": {"name": {}, "port": {}, "description": {}},
+    "Runner": {"commands": {}, "protocol": {}},
+}
+
+
+def registry(*slices: tuple) -> SliceRegistry:
+    field_index, plans = compile_slices([{"name": n, "cmd": c} for n, c in slices], FIELDS)
+    return SliceRegistry(field_index, plans)
+
+
+@pytest.mark.parametrize(
+    "cmd, fields",
+    [
+        ("<>", []),
+        ("ALL", ["Server.name", "Server.port", "Server.description", "Runner.commands", "Runner.protocol"]),
+        ("Runner", ["Runner.commands", "Runner.protocol"]),
+        ("{Server.port, Runner.protocol}", ["Server.port", "Runner.protocol"]),
+        ("ALL - Server - <Runner.commands>", ["Runner.protocol"]),
+        ("ALL - (Server - <Server.port>)", ["Server.port", "Runner.commands", "Runner.protocol"]),
+        ("(Runner - <Runner.commands>) + <Server.name>", ["Server.name", "Runner.protocol"]),
+    ],
+)
+def test_slice_algebra(cmd, fields):
+    assert registry(("S", cmd))["S"].fields() == fields
+
+
+def test_slice_refers_to_other_slices():
+    loaded = registry(("Both", "Ports + Runner"), ("Ports", "<Server.port>"))
+    assert loaded["Both"].fields() == ["Server.port", "Runner.commands", "Runner.protocol"]
+
+
+def test_membership():
+    ports = registry(("Ports", "<Server.port>"))["Ports"]
+    assert "Server.port" in ports
+    assert "Server.name" not in ports
+    assert "Server.nothing" not in ports
+    assert len(ports) == 1
+
+
+def test_compose():
+    loaded = registry(("Ports", "<Server.port>"), ("Names", "<Server.name>"))
+    assert (loaded["Ports"] + loaded["Names"]).fields() == ["Server.name", "Server.port"]
+    assert (loaded["Ports"] - loaded["Ports"]).fields() == []
+    assert loaded.compose("Server - Ports").fields() == ["Server.name", "Server.description"]
+    assert loaded.compose("Server - Ports").bitmap == registry(("S", "Server - <Server.port>"))["S"].bitmap
+
+
+def test_trailing_zero_bytes_left_out():
+    # a candy leaves out the zero bytes a bitmap ends with
+    fields = {"C": {f"f{i}": {} for i in range(20)}}
+    field_index, plans = compile_slices([{"name": "First", "cmd": "<C.f0>"}], fields)
+    loaded = SliceRegistry(field_index, [{**plans[0], "bitmap": plans[0]["bitmap"].rstrip(b"\0")}])
+    assert loaded["First"].fields() == ["C.f0"]
+    assert "C.f19" not in loaded["First"]
+    assert len(loaded.compose("ALL - First")) == 19
+
+
+@pytest.mark.parametrize(
+    "slices, error",
+    [
+        ((("S", "S + <Server.port>"),), "slice 'S' refers to itself"),
+        ((("A", "B"), ("B", "A")), "refers to itself"),
+        ((("S", "<>"), ("S", "ALL")), "slice 'S' already defined"),
+        ((("Server", "<>"),), "slice 'Server' already defined"),
+        ((("ALL", "<>"),), "slice 'ALL' already defined"),
+        ((("S", "<Server.nothing>"),), "field 'Server.nothing' not exist"),
+        ((("S", "Nothing"),), "'Nothing' is neither a config nor a slice"),
+        ((("S", "(Server"),), "missing ')'"),
+        ((("S", "Server Runner"),), "unexpected 'Runner'"),
+    ],
+)
+def test_invalid_slices(slices, error):
+    with pytest.raises(CanfigException, match=re.escape(error)):
+        registry(*slices)
+
+
+def test_sample_slices(db):
+    user = canfig.slices["UserConfig"]
+    assert user.fields() == [
+        "Server.name", "Server.port", "Server.description",
+        "Runner.nickname", "Runner.alive_time", "Runner.runner_name", "Runner.protocol",
+    ]
+    assert canfig.slices["Default"].fields() == []
+    assert len(canfig.slices["DevConfig"]) == len(canfig.slices.field_index)
+    with pytest.raises(CanfigException, match="slice 'Missing' not exist"):
+        canfig.slices["Missing"]
+
+
+def test_scope_limits_reads_and_writes(db):
+    user = canfig.scope("UserConfig")
+    user.apply({"Server.port": 8128})
+    port = user.get("Server.port")
+    assert port == canfig.GET("Server.port")
+    assert set(user.read()) == set(user.fields())
+
+    for field_dir in ("Server.run", "Runner.commands"):
+        with pytest.raises(CanfigException, match=f"field '{field_dir}' is not in slice 'UserConfig'"):
+            user.get(field_dir)
+    with pytest.raises(CanfigException, match="is not in slice"):
+        user.apply({"Server.port": 8129, "Server.run": True})
+    # nothing is written when a field is out of the slice
+    assert canfig.GET("Server.port") == port
+
+    composed = canfig.scope("UserConfig - <Server.port>")
+    with pytest.raises(CanfigException, match=re.escape("is not in slice 'UserConfig - <Server.port>'")):
+        composed.set("Server.port", 1)
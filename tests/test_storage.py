@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+import canfig
+from compiler import compile_source
+from evaluator import DB
+from storage import STORAGE_PROFILES
+from utils import CanfigException
+
+SYNCHRONOUS = {"OFF": 0, "NORMAL": 1, "FULL": 2, "EXTRA": 3}
+
+
+def port() -> int:
+    return canfig.GET("Server.port")[0]["port"]
+
+
+def pragma(connection, name: str):
+    return connection.execute(f"PRAGMA {name}").fetchone()[0]
+
+
+@pytest.mark.parametrize("profile", list(STORAGE_PROFILES))
+def test_profile_settings(profile, tmp_path):
+    settings = STORAGE_PROFILES[profile]
+    _db = DB(str(tmp_path / "storage.sqlite3"), profile)
+    try:
+        assert _db.profile == profile
+        assert pragma(_db.connection, "journal_mode").upper() == settings["journal_mode"]
+        assert pragma(_db.connection, "synchronous") == SYNCHRONOUS[settings["synchronous"]]
+        assert pragma(_db.connection, "mmap_size") == settings["mmap_size"]
+        assert pragma(_db.connection, "cache_size") == settings["cache_size"]
+        assert _db.uses_pool() == bool(settings["read_pool"])
+    finally:
+        _db.close()
+
+
+def test_unknown_profile(tmp_path):
+    with pytest.raises(CanfigException, match="storage profile 'fastest' not exist"):
+        DB(str(tmp_path / "storage.sqlite3"), "fastest")
+
+
+def test_in_memory_database_has_no_pool():
+    _db = DB(":memory:", "read-mostly")
+    try:
+        assert not _db.uses_pool()
+    finally:
+        _db.close()
+
+
+def test_storage_tag(sample_source):
+    source = sample_source.replace('@author', '@storage       "read-mostly";\n@author', 1)
+    assert compile_source(source).meta_data["STORAGE"] == "read-mostly"
+
+    with pytest.raises(CanfigException, match="@storage 'fastest' not exist"):
+        compile_source(sample_source.replace('@author', '@storage "fastest";\n@author', 1))
+
+
+def test_pool_is_read_only(db):
+    with pytest.raises(CanfigException, match="readonly database"):
+        with db.reader() as cursor:
+            assert cursor.connection is not db.connection
+            assert pragma(cursor.connection, "query_only") == 1
+            cursor.execute("UPDATE Server SET port = 1")
+
+
+def test_transaction_reads_its_own_writes(db):
+    canfig.SET("Server.port", 8128)
+    with db.transaction():
+        canfig.SET("Server.port", 8129)
+        assert not db.uses_pool()
+        with db.reader() as cursor:
+            assert cursor.connection is db.connection
+        assert port() == 8129
+
+        # other threads still read the committed value from the pool
+        seen = []
+        reader = threading.Thread(target=lambda: seen.append((db.uses_pool(), port())))
+        reader.start()
+        reader.join()
+        assert seen == [(True, 8128)]
+    assert port() == 8129
+
+
+def test_readers_do_not_wait_on_each_other(db):
+    size = STORAGE_PROFILES[db.profile]["read_pool"]
+    inside = threading.Barrier(size)
+    connections = []
+
+    def read():
+        with db.reader() as cursor:
+            cursor.execute("SELECT port FROM Server")
+            connections.append(cursor.connection)
+            # every reader holds its connection until all of them are in
+            inside.wait(timeout=5)
+
+    readers = [threading.Thread(target=read) for _ in range(size)]
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    assert len(set(map(id, connections))) == size
@@ -0,0 +1,151 @@
+import sqlite3
+import threading
+
+import pytest
+
+import canfig
+from migration import collect_garbage
+from trigger_engine import ENGINE
+from utils import CanfigException, TriggerException, compile_trigger
+
+
+def test_savepoint_rollback_keeps_outer_writes(db):
+    with db.transaction():
+        canfig.final_plan["Server"]["port"].bind(1)
+        canfig.final_plan["Server"]["port"].write(db)
+        with pytest.raises(CanfigException):
+            with db.transaction():
+                canfig.final_plan["Runner"]["protocol"].bind("tcp")
+                canfig.final_plan["Runner"]["protocol"].write(db)
+                raise CanfigException("undo the savepoint")
+
+    assert canfig.GET("Server.port") == [{"port": 1}]
+    assert canfig.GET("Runner.protocol") == [{"protocol": None}]
+
+
+def test_failed_outer_transaction_rolls_back_everything(db):
+    canfig.SET("Server.port", 1)
+    with pytest.raises(CanfigException):
+        with db.transaction():
+            canfig.SET("Server.port", 2)
+            raise CanfigException("undo all")
+
+    assert canfig.GET("Server.port") == [{"port": 1}]
+
+
+def test_other_thread_waits_for_the_outer_transaction(db):
+    started, written = threading.Event(), threading.Event()
+
+    def other():
+        started.wait()
+        canfig.SET("Runner.runner_name", "runner-b")
+        written.set()
+
+    thread = threading.Thread(target=other)
+    thread.start()
+    with pytest.raises(CanfigException):
+        with db.transaction():
+            canfig.SET("Server.port", 2)
+            started.set()
+            # the write of the other thread is not a savepoint of this one
+            assert not written.wait(0.2)
+            raise CanfigException("roll back")
+    thread.join()
+
+    assert canfig.GET("Server.port") == [{"port": None}]
+    assert canfig.GET("Runner.runner_name") == [{"runner_name": "runner-b"}]
+
+
+@pytest.mark.parametrize("write", ["write_rows", "edit_rows"])
+def test_outer_writes_wait_without_the_connection_lock(db, write):
+    inside, done = threading.Event(), threading.Event()
+
+    def owner():
+        with db.transaction():
+            inside.set()
+            # the other write waits for this transaction meanwhile
+            done.wait(0.2)
+            canfig.SET("Runner.runner_name", "runner-b")
+        done.set()
+
+    if write == "write_rows":
+        plan = canfig.final_plan["Server"]["port"]
+        plan.bind(5)
+        args = (db,)
+    else:
+        plan = canfig.final_plan["Server"]["commands"]
+        args = (db, "append", [{"name": "ls", "description": "list the files"}])
+
+    thread = threading.Thread(target=owner, daemon=True)
+    thread.start()
+    inside.wait()
+    other = threading.Thread(target=getattr(plan, write), args=args, daemon=True)
+    other.start()
+
+    assert done.wait(5), "deadlock"
+    other.join(5)
+    assert not other.is_alive()
+    assert canfig.GET("Runner.runner_name") == [{"runner_name": "runner-b"}]
+
+
+SLOW_TRIGGER = """
+    import time
+    time.sleep(0.3)
+    try:
+        SET("Server.port", 4242)
+    except Exception as e:
+        refused.append(e)
+    done.set()
+"""
+
+
+def slow_trigger(monkeypatch) -> dict:
+    """
+    add to Server.name a trigger that writes after its deadline
+
+    :return: env of the trigger, "refused" holds the error of its write
+    """
+    monkeypatch.setitem(ENGINE.deadlines, "Slow", 0.05)
+    env = canfig.trigger_globals()
+    env.update(refused=[], done=threading.Event())
+    canfig.final_plan["Server"]["name"].add_trigger("Slow", compile_trigger("Slow", SLOW_TRIGGER), env)
+    return env
+
+
+@pytest.mark.parametrize("later", ["no transaction", "other transaction"])
+def test_trigger_past_its_deadline_cannot_write(db, monkeypatch, later):
+    env = slow_trigger(monkeypatch)
+
+    with pytest.raises(TriggerException, match="timed out"):
+        canfig.apply({"Server.port": 1, "Server.name": {"NAME": "a"}})
+
+    if later == "no transaction":
+        assert env["done"].wait(5)
+    else:
+        with db.transaction():
+            canfig.SET("Runner.runner_name", "runner-b")
+            assert env["done"].wait(5)
+        assert canfig.GET("Runner.runner_name") == [{"runner_name": "runner-b"}]
+
+    assert [str(e) for e in env["refused"]] == [
+        "the transaction that ran the trigger has ended, its write is refused"
+    ]
+    assert canfig.GET("Server.port") == [{"port": None}]
+
+
+def test_commit_without_change_keeps_the_version(db, cplan):
+    canfig.SET("Server.port", 1)
+    version = db.write_version
+    other = sqlite3.connect(db.db_dir)
+    data_version = other.execute("PRAGMA data_version").fetchone()[0]
+
+    with db.transaction():
+        pass
+    assert collect_garbage(db, cplan.fields) == 0
+    assert db.write_version == version
+    assert other.execute("PRAGMA data_version").fetchone()[0] == data_version
+
+    canfig.SET("Server.port", 2)
+    assert db.write_version == version + 1
+    assert other.execute("PRAGMA data_version").fetchone()[0] != data_version
+    other.close()
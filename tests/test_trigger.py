@@ -0,0 +1,65 @@
+import marshal
+import sys
+import types
+
+import pytest
+
+import candy
+import canfig
+from utils import CanfigException, compile_trigger
+
+
+def test_candy_holds_trigger_source_only(cplan, tmp_path):
+    path = str(tmp_path / "sample.candy")
+    cplan.dump(path)
+
+    with candy.load(path) as reader:
+        (trigger,) = reader["triggers"]
+    assert "code" not in trigger and "cache_tag" not in trigger
+    code = canfig.trigger_code(trigger)
+    assert isinstance(code, types.CodeType)
+    assert code.co_filename == "<trigger ServerChangeAction>"
+
+
+def test_trigger_compiled_once_for_every_field(db, cplan, monkeypatch):
+    compiled = []
+
+    def compile_once(name, cmd):
+        compiled.append(name)
+        return compile_trigger(name, cmd)
+
+    monkeypatch.setattr(canfig, "compile_trigger", compile_once)
+    canfig.register_triggers(cplan.triggers, cplan.trigger_index)
+    assert compiled == ["ServerChangeAction"]
+
+    registered = [
+        plan.triggers["ServerChangeAction"]
+        for plan in canfig.final_plan["Server"].values()
+        if "ServerChangeAction" in plan.triggers
+    ]
+    assert len(registered) > 1
+    # one code object and globals shared by every field
+    assert all(code is registered[0][0] and env is registered[0][1] for code, env in registered)
+    assert not any(plan.triggers for plan in canfig.final_plan["Runner"].values())
+
+
+def test_trigger_globals_are_minimal():
+    env = canfig.trigger_globals()
+    assert set(env) == set(canfig.TRIGGER_API) | {"__builtins__"}
+    assert "final_plan" not in env and "db" not in env
+
+
+@pytest.mark.parametrize(
+    "code",
+    [marshal.dumps(compile("raise SystemExit", "<crafted>", "exec")), b"\xff broken"],
+)
+def test_code_shipped_in_the_candy_is_not_run(cplan, code):
+    # a candy of an older compiler, or one edited to hold other bytecode
+    trigger = {**cplan.triggers[0], "cache_tag": sys.implementation.cache_tag, "code": code}
+    compiled = canfig.trigger_code(trigger)
+    assert compiled.co_code == compile_trigger(trigger["name"], trigger["cmd"]).co_code
+
+
+def test_invalid_body_fails_to_compile():
+    with pytest.raises(CanfigException, match="Trigger 'Bad' is not valid python"):
+        canfig.trigger_code({"name": "Bad", "cmd": "\n    if:\n"})
@@ -0,0 +1,75 @@
+import sqlite3
+
+import pytest
+
+import canfig
+from utils import CanfigException
+
+
+def view(db, field_dir: str) -> list:
+    config, field = field_dir.split(".")
+    return canfig.final_plan[config][field].view(db)
+
+
+def reads(db, field_dir: str) -> int:
+    """
+    :return: times a view of the field read the database
+    """
+    misses = db.view_cache.misses
+    view(db, field_dir)
+    return db.view_cache.misses - misses
+
+
+def test_second_read_is_a_hit(db, monkeypatch):
+    canfig.SET("Server.commands", [{"name": "start", "description": "start the server"}])
+    stats = db.view_cache.stats()
+    assert reads(db, "Server.commands") == 1
+
+    def no_read():
+        raise AssertionError("a hit read the database")
+
+    monkeypatch.setattr(db, "reader", no_read)
+    assert reads(db, "Server.commands") == 0
+    assert view(db, "Server.commands") == [{"name": "start", "description": "start the server"}]
+
+    after = db.view_cache.stats()
+    assert after["misses"] == stats["misses"] + 1
+    assert after["hits"] == stats["hits"] + 2
+
+
+def test_write_invalidates_only_its_field(db):
+    canfig.SET("Server.port", 1)
+    assert view(db, "Server.port") == [{"port": 1}]
+    assert view(db, "Runner.protocol") == [{"protocol": None}]
+    invalidations = db.view_cache.invalidations
+
+    canfig.SET("Server.port", 2)
+    assert db.view_cache.invalidations == invalidations + 1
+    assert view(db, "Server.port") == [{"port": 2}]
+    assert reads(db, "Runner.protocol") == 0
+
+
+def test_commit_of_another_connection_invalidates(db):
+    canfig.SET("Server.port", 1)
+    assert view(db, "Server.port") == [{"port": 1}]
+
+    other = sqlite3.connect(db.db_dir)
+    try:
+        other.execute("UPDATE Server SET port = 5")
+        other.commit()
+    finally:
+        other.close()
+
+    assert view(db, "Server.port") == [{"port": 5}]
+
+
+def test_rollback_invalidates(db):
+    canfig.SET("Server.port", 1)
+    with pytest.raises(CanfigException):
+        with db.transaction():
+            canfig.SET("Server.port", 2)
+            # read inside the transaction, then rolled back
+            assert view(db, "Server.port") == [{"port": 2}]
+            raise CanfigException("roll back")
+
+    assert view(db, "Server.port") == [{"port": 1}]
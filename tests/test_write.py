@@ -0,0 +1,75 @@
+import canfig
+
+
+def record_sql(db, monkeypatch) -> list:
+    """
+    :return: (method, sql, number of parameter rows) of every statement the
+             plans run from now on
+    """
+    calls = []
+    execute, executemany = db.execute, db.executemany
+
+    def record_execute(sql, args=None):
+        calls.append(("execute", sql, 1))
+        return execute(sql, args)
+
+    def record_executemany(sql, seq_of_args):
+        seq_of_args = list(seq_of_args)
+        calls.append(("executemany", sql, len(seq_of_args)))
+        return executemany(sql, seq_of_args)
+
+    monkeypatch.setattr(db, "execute", record_execute)
+    monkeypatch.setattr(db, "executemany", record_executemany)
+    return calls
+
+
+def write(field_dir: str, value):
+    config, field = field_dir.split(".")
+    plan = canfig.final_plan[config][field]
+    plan.bind(value)
+    return list(plan.execute(canfig.db))
+
+
+def test_list_write_is_one_transaction(db, commands):
+    trace = []
+    db.connection.set_trace_callback(trace.append)
+    try:
+        write("Server.commands", commands(200))
+    finally:
+        db.connection.set_trace_callback(None)
+
+    assert sum(sql.strip().upper().startswith("BEGIN") for sql in trace) == 1
+    assert sum(sql.strip().upper() == "COMMIT" for sql in trace) == 1
+    assert not any("last_insert_rowid" in sql for sql in trace)
+    assert canfig.final_plan["Server"]["commands"].view(db) == commands(200)
+
+
+def test_list_elements_inserted_in_bulk(db, monkeypatch, commands):
+    calls = record_sql(db, monkeypatch)
+    write("Server.commands", commands(3))
+    few = list(calls)
+
+    calls.clear()
+    write("Server.commands", commands(3) + commands(200)[3:])
+    many = list(calls)
+
+    # the number of statements does not grow with the list
+    assert [(method, sql) for method, sql, _ in many] == [(method, sql) for method, sql, _ in few]
+    assert sum(rows for method, _, rows in many if method == "executemany") >= 2 * 197
+
+
+def test_sql_is_prepared_once_per_plan(db, monkeypatch):
+    calls = record_sql(db, monkeypatch)
+
+    write("Server.port", 8128)
+    write("Server.alive_time", {"minute": 13, "second": 27})
+    first = [sql for _, sql, _ in calls]
+
+    calls.clear()
+    write("Server.port", 9000)
+    write("Server.alive_time", {"minute": 17, "second": 29})
+
+    # values are bound as parameters, the sql text stays the same
+    assert [sql for _, sql, _ in calls] == first
+    assert not any(value in sql for sql in first for value in ("8128", "9000", "27", "29"))
+    assert canfig.final_plan["Server"]["port"].view(db) == [{"port": 9000}]
@@ -0,0 +1,247 @@
+"""
+Run the triggers of one change concurrently.
+
+a trigger body using await is compiled as a coroutine and runs on the event
+loop of the engine, the other bodies run on a thread pool. Every trigger has
+a deadline, errors, CANFIG_WARN messages and the wall time of each trigger
+are collected into a report.
+
+triggers started from inside a trigger, by a SET, run inline one after the
+other in the calling thread, without deadline. A sync trigger past its
+deadline cannot be stopped, it keeps its worker until it ends but its
+outcome is dropped. Every trigger carries the token of the run that
+started it, the database refuses the writes of a trigger whose run has
+ended.
+"""
+
+import asyncio
+import contextvars
+import inspect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import TriggerException
+
+DEFAULT_DEADLINE = 5.0
+
+# warnings of the trigger running in the current context
+_warnings = contextvars.ContextVar("canfig_trigger_warnings", default=None)
+# set in a thread while it runs a trigger body
+_local = threading.local()
+# token of the run the trigger of the current context belongs to
+_run_token = contextvars.ContextVar("canfig_trigger_run", default=None)
+
+
+class TriggerOutcome:
+    OK = "ok"
+    ERROR = "error"
+    TIMEOUT = "timeout"
+
+    def __init__(self, name: str):
+        self.name = name
+        self.status = self.OK
+        self.message = None
+        self.exception = None
+        self.warnings: list = []
+        self.wall_time = 0.0
+
+    def __str__(self):
+        ret = f"trigger '{self.name}' {self.status} in {self.wall_time * 1000:.2f}ms"
+        if self.message:
+            ret += f": {self.message}"
+        if self.warnings:
+            ret += f" ({len(self.warnings)} warning(s))"
+        return ret
+
+    __repr__ = __str__
+
+
+def warn(msg: str) -> bool:
+    """
+    record a CANFIG_WARN on the trigger running
+
+    :return: False if called outside a trigger
+    """
+    if (warnings := _warnings.get()) is None:
+        return False
+    warnings.append(msg)
+    return True
+
+
+def _is_coroutine(code) -> bool:
+    return bool(getattr(code, "co_flags", 0) & inspect.CO_COROUTINE)
+
+
+def _exec_in_worker(code, env: dict):
+    _local.in_trigger = True
+    try:
+        exec(code, env)
+    finally:
+        _local.in_trigger = False
+
+
+def _run_blocking(coro):
+    """
+    run a coroutine to its end from sync code
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    # the thread already runs a loop, use another thread
+    def run():
+        _local.in_trigger = True
+        return asyncio.run(coro)
+
+    with ThreadPoolExecutor(1) as pool:
+        return pool.submit(contextvars.copy_context().run, run).result()
+
+
+class TriggerEngine:
+    def __init__(self, default_deadline: float = DEFAULT_DEADLINE, max_workers: int | None = None):
+        """
+        :param default_deadline: seconds a trigger may run, unless set by
+                                 set_deadline
+        :param max_workers: threads running sync triggers
+        """
+        self.default_deadline = default_deadline
+        self.deadlines: dict = {}
+
+        self.__max_workers = max_workers
+        self.__pool = None
+        self.__loop = None
+        self.__loop_thread = None
+        self.__start_lock = threading.Lock()
+
+    def set_deadline(self, trigger_name: str, seconds: float):
+        self.deadlines[trigger_name] = seconds
+
+    def deadline(self, trigger_name: str) -> float:
+        return self.deadlines.get(trigger_name, self.default_deadline)
+
+    def in_trigger(self) -> bool:
+        """
+        :return: the current thread runs a trigger body
+        """
+        return getattr(_local, "in_trigger", False) or threading.current_thread() is self.__loop_thread
+
+    def run_token(self):
+        """
+        :return: token given to run() for the trigger the current context
+                 runs, None outside a trigger
+        """
+        return _run_token.get()
+
+    def run(self, callbacks: dict, token=None) -> list:
+        """
+        :param callbacks: trigger name -> (trigger code, env)
+        :param token: identifies the write the triggers run for, run_token()
+                      returns it in their bodies. Triggers run inline from a
+                      trigger keep the token of the caller
+        :return: TriggerOutcome of every trigger, in the order of callbacks
+        :raise TriggerException: a trigger failed or passed its deadline,
+                                 the report is in its .report
+        """
+        if not callbacks:
+            return []
+
+        if self.in_trigger():
+            report = [self.__run_inline(name, code, env) for name, (code, env) in callbacks.items()]
+        else:
+            self.__start()
+            report = asyncio.run_coroutine_threadsafe(
+                self.__run_all(callbacks, token), self.__loop
+            ).result()
+
+        if failed := [outcome for outcome in report if outcome.status != TriggerOutcome.OK]:
+            e = TriggerException("; ".join(outcome.message for outcome in failed))
+            e.report = report
+            raise e from failed[0].exception
+
+        return report
+
+    def close(self):
+        with self.__start_lock:
+            if self.__loop is not None:
+                self.__loop.call_soon_threadsafe(self.__loop.stop)
+                self.__loop_thread.join()
+                self.__loop.close()
+                self.__pool.shutdown(wait=False)
+                self.__loop = self.__loop_thread = self.__pool = None
+
+    def __start(self):
+        with self.__start_lock:
+            if self.__loop is not None:
+                return
+
+            self.__pool = ThreadPoolExecutor(
+                max_workers=self.__max_workers, thread_name_prefix="canfig-trigger"
+            )
+            self.__loop = asyncio.new_event_loop()
+            self.__loop_thread = threading.Thread(
+                target=self.__loop.run_forever, name="canfig-trigger-loop", daemon=True
+            )
+            self.__loop_thread.start()
+
+    async def __run_all(self, callbacks: dict, token) -> list:
+        return list(
+            await asyncio.gather(
+                *(self.__run_one(name, code, env, token) for name, (code, env) in callbacks.items())
+            )
+        )
+
+    async def __run_one(self, name: str, code, env: dict, token) -> TriggerOutcome:
+        # every task runs in its own copy of the context
+        outcome = TriggerOutcome(name)
+        _warnings.set(outcome.warnings)
+        _run_token.set(token)
+        deadline = self.deadline(name)
+
+        start = time.perf_counter()
+        try:
+            if _is_coroutine(code):
+                await asyncio.wait_for(eval(code, env), deadline)
+            else:
+                await asyncio.wait_for(
+                    asyncio.get_running_loop().run_in_executor(
+                        self.__pool, contextvars.copy_context().run, _exec_in_worker, code, env
+                    ),
+                    deadline,
+                )
+        except asyncio.TimeoutError as e:
+            outcome.status = TriggerOutcome.TIMEOUT
+            outcome.message = f"Trigger '{name}' timed out after {deadline}s"
+            outcome.exception = e
+        except Exception as e:
+            outcome.status = TriggerOutcome.ERROR
+            outcome.message = f"Trigger '{name}' failed: {e}"
+            outcome.exception = e
+        outcome.wall_time = time.perf_counter() - start
+
+        return outcome
+
+    def __run_inline(self, name: str, code, env: dict) -> TriggerOutcome:
+        outcome = TriggerOutcome(name)
+        token = _warnings.set(outcome.warnings)
+
+        start = time.perf_counter()
+        try:
+            if _is_coroutine(code):
+                _run_blocking(eval(code, env))
+            else:
+                exec(code, env)
+        except Exception as e:
+            outcome.status = TriggerOutcome.ERROR
+            outcome.message = f"Trigger '{name}' failed: {e}"
+            outcome.exception = e
+        finally:
+            _warnings.reset(token)
+        outcome.wall_time = time.perf_counter() - start
+
+        return outcome
+
+
+# engine used by Plan.execute
+ENGINE = TriggerEngine()
@@ -1,4 +1,5 @@
 import os
+import ast
 import subprocess
 
 
@@ -15,6 +16,31 @@ def check_command_installed(command):
     )
 
 
+def format_code(code_string):
+    # Split the code string into lines
+    lines = code_string.split('\n')
+
+    # Remove 2 spaces of indentation from each line
+    unindented_lines = [line[4:] if line.startswith('    ') else line for line in lines]
+
+    # Join the lines back into a single string
+    return '\n'.join(unindented_lines)
+
+
+def compile_trigger(name: str, cmd: str):
+    """
+    :param cmd: trigger body as written in the .cand
+    :return: code object of the trigger body, a coroutine code if the body
+             uses await
+    """
+    try:
+        return compile(
+            format_code(cmd), f"<trigger {name}>", "exec", flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT
+        )
+    except SyntaxError as e:
+        raise CanfigException(f"Trigger '{name}' is not valid python: {e}")
+
+
 class CanfigException(Exception):
     pass
 
@@ -0,0 +1,65 @@
+"""
+Read-through cache of Plan.view results, one per database connection.
+
+entries are keyed by the "Config.field" of the plan, so every plan of a
+field shares one, and the write of any of them drops it. The whole cache is
+dropped when another connection commits, as seen through PRAGMA
+data_version, or on rollback.
+"""
+
+
+class ViewCache:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        # entries dropped by a write, a rollback or another connection
+        self.invalidations = 0
+
+        # bumped by every invalidation, a read that started before one is
+        # not cached
+        self.generation = 0
+
+        self.__rows: dict = {}
+        self.__data_version = None
+
+    def get(self, key, data_version: int) -> tuple | None:
+        """
+        :param key: "Config.field" of the plan, the plan itself if it has none
+        :param data_version: PRAGMA data_version of the connection, it
+                             changes when another connection commits
+        """
+        if data_version != self.__data_version:
+            self.clear()
+            self.__data_version = data_version
+
+        if (rows := self.__rows.get(key)) is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return rows
+
+    def put(self, key, rows: tuple, generation: int | None = None):
+        """
+        :param generation: self.generation when the rows were read
+        """
+        if generation is None or generation == self.generation:
+            self.__rows[key] = rows
+
+    def invalidate(self, key):
+        self.generation += 1
+        if self.__rows.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.generation += 1
+        self.invalidations += len(self.__rows)
+        self.__rows.clear()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "entries": len(self.__rows),
+        }